@@ -9,6 +9,7 @@ load_dotenv()
 # Import necessary functions from your project files
 from rag import get_rag_response
 import database as db
+from ui_jobs import wait_for_job
 
 # --- Configuration ---
 API_URL = "http://127.0.0.1:8000"
@@ -150,8 +151,14 @@ else:
                             data=payload
                         )
                         
-                        if response.status_code == 200:
-                            st.success(f"✅ Successfully trained on {uploaded_file.name}!")
+                        if response.status_code in (200, 202) and response.json()["status"] == "duplicate":
+                            st.info(response.json()["detail"])
+                        elif response.status_code in (200, 202):
+                            job = wait_for_job(API_URL, response.json()["job_id"], st.empty())
+                            if job["status"] == "succeeded":
+                                st.success(f"✅ Successfully trained on {uploaded_file.name}!")
+                            else:
+                                st.error(f"Error processing file: {job.get('error') or 'processing did not finish'}")
                         else:
                             st.error(f"Error processing file: {response.text}")
                     except Exception as e:
@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# --- Configuration ---
+# Opt-in: a cached answer is only reused for a near-identical question from the
+# same tenant about the same condition, and only while neither the tenant's
+# knowledge base nor the base KB has changed since it was generated.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 5000))
+# Upper edges of the similarity histogram buckets used to tune the threshold.
+SIMILARITY_BUCKETS = [0.5, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.95, 0.96, 0.97, 0.98, 0.99, 1.0]
+
+
+class SemanticAnswerCache:
+    """
+    Answers bucketed by (tenant, condition). A lookup compares the query
+    embedding against the bucket's entries with one matrix-vector product and
+    reuses the best answer if its cosine similarity clears the threshold.
+    """
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry id -> entry dict, in LRU order
+        self._buckets = {}             # (tenant, condition) -> {"ids": [...], "matrix": ndarray | None}
+        self._next_id = 0
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._histogram = [0] * len(SIMILARITY_BUCKETS)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _drop(self, entry_id: int, counter: str):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self._counters[counter] += 1
+        bucket = self._buckets.get(entry["bucket"])
+        if bucket is not None:
+            bucket["ids"].remove(entry_id)
+            bucket["matrix"] = None
+            if not bucket["ids"]:
+                del self._buckets[entry["bucket"]]
+
+    def _bucket_matrix(self, bucket: dict) -> np.ndarray:
+        if bucket["matrix"] is None:
+            bucket["matrix"] = np.stack([self._entries[i]["vector"] for i in bucket["ids"]])
+        return bucket["matrix"]
+
+    def _record_similarity(self, similarity: float):
+        for i, edge in enumerate(SIMILARITY_BUCKETS):
+            if similarity <= edge:
+                self._histogram[i] += 1
+                return
+
+    def lookup(self, tenant: str, condition: str, vector, kb_version) -> tuple:
+        """
+        Returns (cached_result or None, best_similarity or None).
+        """
+        key = (str(tenant), condition)
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket:
+                # Drop entries generated against an older knowledge base, or past their TTL.
+                for entry_id in list(bucket["ids"]):
+                    entry = self._entries[entry_id]
+                    if entry["kb_version"] != kb_version:
+                        self._drop(entry_id, "invalidations")
+                    elif now - entry["created"] > self.ttl_seconds:
+                        self._drop(entry_id, "expirations")
+                bucket = self._buckets.get(key)
+
+            if not bucket:
+                self._counters["misses"] += 1
+                return None, None
+
+            similarities = self._bucket_matrix(bucket) @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            self._record_similarity(similarity)
+            if similarity < self.threshold:
+                self._counters["misses"] += 1
+                return None, similarity
+
+            entry_id = bucket["ids"][best]
+            self._entries.move_to_end(entry_id)
+            self._counters["hits"] += 1
+            return dict(self._entries[entry_id]["result"]), similarity
+
+    def store(self, tenant: str, condition: str, vector, kb_version, result: dict):
+        key = (str(tenant), condition)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "bucket": key,
+                "vector": self._normalize(vector),
+                "result": {"answer": result.get("answer"), "image_url": result.get("image_url")},
+                "kb_version": kb_version,
+                "created": time.time(),
+            }
+            bucket = self._buckets.setdefault(key, {"ids": [], "matrix": None})
+            bucket["ids"].append(entry_id)
+            bucket["matrix"] = None
+            self._counters["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)), "evictions")
+
+    def invalidate_tenant(self, tenant: str):
+        with self._lock:
+            for entry_id, entry in list(self._entries.items()):
+                if entry["bucket"][0] == str(tenant):
+                    self._drop(entry_id, "invalidations")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "threshold": self.threshold,
+                **self._counters,
+                "size": len(self._entries),
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "best_similarity_histogram": {
+                    f"<={edge}": count for edge, count in zip(SIMILARITY_BUCKETS, self._histogram)
+                },
+            }
+
+
+_cache = SemanticAnswerCache()
+
+
+def get_cache() -> SemanticAnswerCache:
+    return _cache
+
+
+def is_enabled() -> bool:
+    return ANSWER_CACHE_ENABLED
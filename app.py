@@ -1,13 +1,20 @@
 import os
 import uvicorn
-import shutil
 from dotenv import load_dotenv
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
 import database as db
 from website_chat_router import chat_router
-from process_user_docs import process_user_document # <-- New Import
+import ingest_jobs
+import vector_store
+import rag
+import answer_cache
+import embedding_batcher
+import metrics
+import clients
+import warmup
 
 # --- Load Environment Variables ---
 load_dotenv()
@@ -39,41 +46,89 @@ def get_db():
 # --- API Routers ---
 app.include_router(chat_router, prefix="/chat", tags=["Chat"])
 
-# --- NEW: File Upload Endpoint ---
-@app.post("/upload_document/", tags=["Document Upload"])
+# --- Startup Checks & Warmup ---
+# Warmup runs in the background so /healthz answers immediately; /readyz only
+# reports ready once it has finished.
+@app.on_event("startup")
+async def check_configuration_and_warm_up():
+    clients.check_configuration()
+    await warmup.start()
+
+@app.on_event("shutdown")
+async def stop_warmup():
+    await warmup.stop()
+
+@app.get("/healthz", tags=["Health"])
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz", tags=["Health"])
+def readyz():
+    """Readiness: warmup has finished, so the worker can take traffic."""
+    status = warmup.get_status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+# --- Background Ingestion Queue ---
+@app.on_event("startup")
+async def start_ingest_queue():
+    await ingest_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    await ingest_jobs.stop()
+
+# --- File Upload Endpoint ---
+@app.post("/upload_document/", tags=["Document Upload"], status_code=202)
 async def upload_document(user_id: str = Form(...), file: UploadFile = File(...)):
     """
     Endpoint for clients to upload documents to train their personal bot.
+    The document is queued for background processing; poll GET /jobs/{job_id}
+    with the returned job_id for progress. Re-uploading content the user
+    already has returns "duplicate" immediately.
     """
-    # Create a temporary directory to store uploaded files
-    temp_dir = "temp_uploads"
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    temp_filepath = os.path.join(temp_dir, file.filename)
-    
     try:
-        # Save the uploaded file temporarily
-        with open(temp_filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Process the document and add it to the user's knowledge base
-        process_user_document(user_id=user_id, filepath=temp_filepath)
-        
-        return {"status": "success", "filename": file.filename, "detail": "Document processed successfully."}
-        
+        outcome, job = await ingest_jobs.submit(user_id, file.filename, file.file)
+    except ingest_jobs.IngestQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-        
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
+    if outcome == "duplicate":
+        # Identical content is already in the tenant's knowledge base.
+        return JSONResponse(status_code=200, content={
+            "status": "duplicate", "filename": file.filename, "job_id": job["job_id"],
+            "detail": f"This document is already in your knowledge base as {job['filename']}.",
+        })
+    return {"status": outcome, "filename": job["filename"], "job_id": job["job_id"], "job": job}
+
+@app.get("/jobs/{job_id}", tags=["Document Upload"])
+async def read_job(job_id: str):
+    job = await ingest_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 # --- Root Endpoint ---
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Nutrition Chatbot API"}
 
+# --- Cache Statistics Endpoint ---
+@app.get("/stats/cache", tags=["Diagnostics"])
+def read_cache_stats():
+    return {
+        **vector_store.get_cache_stats(),
+        "session_conditions": rag.get_session_cache_stats(),
+        "answer_cache": answer_cache.get_cache().stats(),
+        "query_embedding_batcher": embedding_batcher.get_stats(),
+    }
+
+# --- Prometheus Metrics Endpoint ---
+@app.get("/metrics", tags=["Diagnostics"])
+def read_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
 # --- Main Entry Point ---
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
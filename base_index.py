@@ -0,0 +1,343 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import shutil
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- UNIFIED PATH CONFIGURATION ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
+PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
+BASE_CHROMA_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstore_base")
+BASE_MMAP_DIR = os.path.join(PERSISTENT_DISK_PATH, "base_index")
+
+# --- Export Configuration ---
+# The base knowledge embeddings are exported from Chroma to a read-only matrix
+# that every worker memory-maps, so N workers share one page-cache copy
+# instead of each loading its own HNSW index. float16 halves the size at a
+# small cost in score precision.
+BASE_INDEX_DTYPE = os.environ.get("BASE_INDEX_DTYPE", "float32")
+BASE_INDEX_RELOAD_CHECK_SECONDS = float(os.environ.get("BASE_INDEX_RELOAD_CHECK_SECONDS", 5))
+EXPORT_PAGE_SIZE = 5000
+# Rows scored per matrix-vector product; bounds the float32 copy a float16 matrix needs.
+SCORE_BLOCK_ROWS = 32768
+
+# Each export is written to its own version directory; CURRENT_FILE names the
+# live one and is replaced atomically, so readers never see a partial export.
+CURRENT_FILE = "current.json"
+# Rewritten with a new id by every writer of the base Chroma collection
+# (build_base_db.py, the admin upload) before it writes. An export records the
+# id it started from, so it is stale exactly when the content has changed
+# since; file mtimes are not used because SQLite housekeeping moves them.
+SOURCE_VERSION_FILE = "source_version.json"
+# Kept next to the base Chroma collection: the embedding model its chunks were
+# embedded with. Chunks from different models are not comparable, so writers
+# refuse to add to a collection built with another model.
+EMBEDDING_MODEL_FILE = "embedding_model.json"
+MATRIX_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "chunks.offsets.npy"
+
+
+def read_source_version(output_dir: str = BASE_MMAP_DIR) -> str | None:
+    try:
+        with open(os.path.join(output_dir, SOURCE_VERSION_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def mark_source_changed(output_dir: str = BASE_MMAP_DIR) -> str:
+    """
+    Records that the base Chroma collection is about to change, so workers
+    stop trusting the current export until the next one. Call it before
+    writing to the collection.
+    """
+    version = uuid.uuid4().hex
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = os.path.join(output_dir, f"{SOURCE_VERSION_FILE}.{version}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "changed_at": time.time()}, f)
+    os.replace(tmp_path, os.path.join(output_dir, SOURCE_VERSION_FILE))
+    return version
+
+
+@contextmanager
+def source_write(output_dir: str = BASE_MMAP_DIR):
+    """
+    Wraps a write to the base Chroma collection made from a serving process:
+    marks the source changed before and after it, and meanwhile tells this
+    process's readers (see write_in_progress) not to reopen the collection
+    under the writer, whose Chroma system they share.
+    """
+    global _writes_in_progress
+    mark_source_changed(output_dir)
+    with _lock:
+        _writes_in_progress += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _writes_in_progress -= 1
+        mark_source_changed(output_dir)
+
+
+def write_in_progress() -> bool:
+    return _writes_in_progress > 0
+
+
+def check_embedding_model(model: str, chroma_dir: str = BASE_CHROMA_DIR):
+    """
+    Raises ValueError if the base Chroma collection was built with another
+    embedding model than `model`; otherwise records `model` as its model.
+    Call it before writing to the collection.
+    """
+    path = os.path.join(chroma_dir, EMBEDDING_MODEL_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            recorded = json.load(f)["model"]
+    except (OSError, ValueError, KeyError):
+        recorded = None
+    if recorded is not None and recorded != model:
+        raise ValueError(f"The base knowledge collection was embedded with '{recorded}', not '{model}'. "
+                         f"Rebuild it (delete {chroma_dir} and data/file_tracker.json, then run "
+                         f"build_base_db.py) or set EMBEDDING_MODEL={recorded}.")
+    if recorded is None:
+        os.makedirs(chroma_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"model": model, "recorded_at": time.time()}, f)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# --- Export ---
+def export_base_index(vector_store, dtype: str = BASE_INDEX_DTYPE, output_dir: str = BASE_MMAP_DIR) -> int:
+    """
+    Writes every embedding in `vector_store` (the base Chroma collection) to a
+    row-normalized matrix, with chunk texts and metadata as JSON lines in a
+    sidecar indexed by byte offsets. Returns the number of chunks exported.
+    """
+    started = time.time()
+    # Read before paging, so a write made during the export marks it stale.
+    source_version = read_source_version(output_dir)
+    version = f"v{int(started * 1000)}"
+    version_dir = os.path.join(output_dir, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    vectors, offsets, position = [], [0], 0
+    with open(os.path.join(version_dir, CHUNKS_FILE), "wb") as chunks_file:
+        offset = 0
+        while True:
+            page = vector_store.get(include=["embeddings", "documents", "metadatas"],
+                                    limit=EXPORT_PAGE_SIZE, offset=offset)
+            if not page["ids"]:
+                break
+            for chunk_id, embedding, text, metadata in zip(
+                    page["ids"], page["embeddings"], page["documents"], page["metadatas"]):
+                record = json.dumps({"id": chunk_id, "page_content": text, "metadata": metadata or {}},
+                                    ensure_ascii=False).encode("utf-8") + b"\n"
+                chunks_file.write(record)
+                position += len(record)
+                offsets.append(position)
+                vectors.append(np.asarray(embedding, dtype=np.float32))
+            offset += len(page["ids"])
+            print(f"Exported {offset} base chunks...")
+
+    if not vectors:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        print("Base knowledge collection is empty. Nothing to export.")
+        return 0
+
+    matrix = np.ascontiguousarray(_normalize_rows(np.vstack(vectors)).astype(dtype))
+    np.save(os.path.join(version_dir, MATRIX_FILE), matrix)
+    np.save(os.path.join(version_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+
+    manifest = {
+        "version": version,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "dtype": dtype,
+        "source_version": source_version,
+        "exported_at": started,
+    }
+    tmp_current = os.path.join(output_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_current, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_current, os.path.join(output_dir, CURRENT_FILE))
+
+    # Keep the previous version for workers still mapping it; older ones go.
+    versions = sorted(name for name in os.listdir(output_dir) if name.startswith("v") and name != version)
+    for stale in versions[:-1]:
+        shutil.rmtree(os.path.join(output_dir, stale), ignore_errors=True)
+    print(f"✅ Exported {matrix.shape[0]}x{matrix.shape[1]} {dtype} base matrix to '{version_dir}' "
+          f"in {time.time() - started:.1f}s.")
+    return matrix.shape[0]
+
+
+# --- Query Time ---
+class MmapVectorIndex:
+    """
+    Read-only, memory-mapped base index with the subset of the Chroma store
+    API the app uses. Rows are unit-normalized, so the top-k by dot product
+    is the cosine (and, for normalized embeddings such as OpenAI's, the L2)
+    nearest neighbours.
+    """
+    def __init__(self, directory: str, manifest: dict, embedding_function=None):
+        version_dir = os.path.join(directory, manifest["version"])
+        self.manifest = manifest
+        self.matrix = np.load(os.path.join(version_dir, MATRIX_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(version_dir, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(version_dir, CHUNKS_FILE), "rb") as f:
+            self._chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.offsets) != self.matrix.shape[0] + 1:
+            raise ValueError("Base index matrix and chunk sidecar are out of sync. Re-export the index.")
+        self.embedding_function = embedding_function
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def _record(self, row: int) -> dict:
+        return json.loads(self._chunks[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def top_k(self, query_vector, k: int) -> tuple:
+        """Returns (rows, scores) of the `k` best rows, best first."""
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        k = min(k, len(self))
+        if norm == 0 or k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = q / norm
+
+        rows, scores = [], []
+        for start in range(0, len(self), SCORE_BLOCK_ROWS):
+            block_scores = np.asarray(self.matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32) @ q
+            best = np.argpartition(-block_scores, k - 1)[:k] if len(block_scores) > k else np.arange(len(block_scores))
+            rows.append(best + start)
+            scores.append(block_scores[best])
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return rows[order], scores[order]
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4) -> list:
+        from langchain_core.documents import Document
+        rows, scores = self.top_k(embedding, k)
+        results = []
+        for row, score in zip(rows, scores):
+            record = self._record(row)
+            document = Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+            results.append((document, float(score)))
+        return results
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def as_retriever(self, search_kwargs: dict | None = None):
+        return make_retriever(self, (search_kwargs or {}).get("k", 4))
+
+
+_retriever_class = None
+
+
+def make_retriever(index, k: int = 4):
+    """
+    LangChain retriever over anything with `similarity_search` (e.g. an
+    MmapVectorIndex, for MergerRetriever). The class is created on first use
+    so importing this module does not import langchain_core.
+    """
+    global _retriever_class
+    if _retriever_class is None:
+        from langchain_core.retrievers import BaseRetriever
+
+        class MmapRetriever(BaseRetriever):
+            index: object
+            k: int = 4
+
+            def _get_relevant_documents(self, query: str, *, run_manager=None) -> list:
+                return self.index.similarity_search(query, k=self.k)
+
+        _retriever_class = MmapRetriever
+    return _retriever_class(index=index, k=k)
+
+
+_index = None
+_index_version = None
+_index_stale = False
+_last_check = 0.0
+_writes_in_progress = 0
+_lock = threading.Lock()
+
+
+def read_manifest(directory: str = BASE_MMAP_DIR) -> dict | None:
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_stale(manifest: dict) -> bool:
+    # The Chroma collection was written (e.g. by an admin upload) after this export started.
+    source_version = read_source_version()
+    return source_version is not None and source_version != manifest.get("source_version")
+
+
+def get_index(embedding_function=None) -> MmapVectorIndex | None:
+    """
+    Returns the current memory-mapped base index, reloading it when a new
+    export appears, or None if nothing has been exported.
+    """
+    global _index, _index_version, _index_stale, _last_check
+    now = time.monotonic()
+    if now - _last_check < BASE_INDEX_RELOAD_CHECK_SECONDS:
+        return _index
+    with _lock:
+        _last_check = now
+        manifest = read_manifest()
+        _index_stale = manifest is not None and _is_stale(manifest)
+        if manifest is None:
+            _index, _index_version = None, None
+        elif manifest["version"] != _index_version:
+            try:
+                _index = MmapVectorIndex(BASE_MMAP_DIR, manifest, embedding_function)
+                print(f"Loaded memory-mapped base index {manifest['version']} ({manifest['count']} chunks).")
+            except Exception as e:
+                print(f"Could not load memory-mapped base index: {e}")
+                _index = None
+            _index_version = manifest["version"]
+        return _index
+
+
+def is_stale() -> bool:
+    """True if the base Chroma collection has been written to since the loaded export."""
+    return _index_stale
+
+
+def version():
+    """Version of the loaded export, for cache keys (None if none is loaded)."""
+    return _index_version
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the base Chroma collection to the memory-mapped index.")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=BASE_INDEX_DTYPE)
+    args = parser.parse_args()
+
+    from langchain_chroma import Chroma
+    store = Chroma(persist_directory=BASE_CHROMA_DIR, collection_name="base_knowledge")
+    export_base_index(store, dtype=args.dtype)
@@ -0,0 +1,95 @@
+"""
+Compares the local condition classifier against the LLM classification path.
+
+    python -m benchmarks.condition_classifier            # local path only
+    python -m benchmarks.condition_classifier --llm      # also call the LLM (needs OPENAI_API_KEY)
+
+Reports per-question latency for each path, accuracy against the expected
+labels, how often the local path defers to the LLM, and the agreement rate
+between the two paths. Results are printed as JSON.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from condition_classifier import get_classifier, to_label
+
+DEFAULT_QUESTIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "condition_questions.jsonl")
+
+
+def load_questions(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentiles(samples_ms: list) -> dict:
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "mean_ms": round(statistics.mean(ordered), 4),
+        "p50_ms": round(pick(0.50), 4),
+        "p95_ms": round(pick(0.95), 4),
+        "max_ms": round(ordered[-1], 4),
+    }
+
+
+def run(questions: list, use_llm: bool, repeat: int) -> dict:
+    classifier = get_classifier()
+    local_ms, llm_ms, rows = [], [], []
+
+    for item in questions:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = classifier.classify(item["question"])
+        local_ms.append((time.perf_counter() - start) * 1000 / repeat)
+        rows.append({"question": item["question"], "expected": item.get("expected"),
+                     "local": result.label, "ambiguous": result.ambiguous})
+
+    if use_llm:
+        from rag import _disease_prompt
+        from llm import get_direct_llm_response
+        for row in rows:
+            start = time.perf_counter()
+            answer = get_direct_llm_response(_disease_prompt(row["question"]))
+            llm_ms.append((time.perf_counter() - start) * 1000)
+            row["llm"] = to_label(answer)
+
+    decided = [r for r in rows if not r["ambiguous"]]
+    summary = {
+        "questions": len(rows),
+        "local_latency": percentiles(local_ms),
+        "local_decided": len(decided),
+        "deferred_to_llm": len(rows) - len(decided),
+        "local_accuracy_when_decided": round(
+            sum(r["local"] == r["expected"] for r in decided) / len(decided), 4) if decided else None,
+    }
+    if use_llm:
+        summary["llm_latency"] = percentiles(llm_ms)
+        summary["llm_accuracy"] = round(sum(r["llm"] == r["expected"] for r in rows) / len(rows), 4)
+        summary["agreement_when_decided"] = round(
+            sum(r["local"] == r["llm"] for r in decided) / len(decided), 4) if decided else None
+        # What the pipeline actually returns: local when decided, LLM otherwise.
+        summary["hybrid_accuracy"] = round(
+            sum((r["llm"] if r["ambiguous"] else r["local"]) == r["expected"] for r in rows) / len(rows), 4)
+    summary["disagreements"] = [
+        r for r in rows
+        if (not r["ambiguous"] and r["local"] != r["expected"]) or (use_llm and r.get("llm") != r["local"] and not r["ambiguous"])
+    ]
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="JSONL file of {question, expected}")
+    parser.add_argument("--llm", action="store_true", help="Also run the LLM path for latency and agreement")
+    parser.add_argument("--repeat", type=int, default=100, help="Local classifier repetitions per question")
+    args = parser.parse_args()
+
+    print(json.dumps(run(load_questions(args.questions), args.llm, args.repeat), indent=2))
@@ -0,0 +1,171 @@
+"""
+Throughput vs added latency of query-embedding micro-batching.
+
+Concurrent callers embed queries back to back for a fixed duration, first
+with one request per query (the unbatched path) and then through the
+EmbeddingBatcher at each --max-wait-ms setting. By default the embedding
+endpoint is simulated: each request costs --request-ms plus --per-input-ms
+per input, with at most --backend-concurrency requests served at once (the
+connection pool / rate limit). Pass --live to hit the real API instead.
+
+    python -m benchmarks.embedding_batcher --callers 200 --duration 10 --max-wait-ms 1,2,5,10
+    python -m benchmarks.embedding_batcher --live --callers 50 --duration 5   # needs OPENAI_API_KEY
+
+Reports queries/s, latency percentiles and upstream requests per query for
+each configuration, as JSON.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_batcher import EmbeddingBatcher
+
+QUESTIONS = [
+    "How much rice can I eat with diabetes?",
+    "What is a healthy breakfast for high blood pressure?",
+    "Is brown rice better than white rice?",
+    "What snacks are good for someone with CKD?",
+    "How much salt per day with hypertension?",
+]
+
+
+class SimulatedEmbeddings:
+    """Stand-in embedding endpoint with fixed per-request cost and limited concurrency."""
+    def __init__(self, request_ms: float, per_input_ms: float, concurrency: int, dim: int = 8):
+        self.request_s = request_ms / 1000.0
+        self.per_input_s = per_input_ms / 1000.0
+        self.dim = dim
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def embed_documents(self, texts: list) -> list:
+        with self._slots:
+            time.sleep(self.request_s + self.per_input_s * len(texts))
+        with self._lock:
+            self.requests += 1
+        return [[float(len(t) % 7)] * self.dim for t in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+class CountingEmbeddings:
+    """Wraps the real client to count upstream requests."""
+    def __init__(self, underlying):
+        self.underlying = underlying
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def embed_documents(self, texts: list) -> list:
+        with self._lock:
+            self.requests += 1
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+async def run_callers(embed, callers: int, duration: float) -> tuple:
+    latencies, errors = [], 0
+    stop_at = time.perf_counter() + duration
+
+    async def caller(i: int):
+        nonlocal errors
+        n = 0
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                await embed(QUESTIONS[(i + n) % len(QUESTIONS)] + f" #{i}-{n}")
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                errors += 1
+            n += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(i) for i in range(callers)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def summarize(label: str, latencies: list, errors: int, elapsed: float, requests: int, extra: dict = None) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "mode": label,
+        "queries": len(ordered),
+        "errors": errors,
+        "queries_per_second": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50), 2),
+        "p95_ms": round(percentile(ordered, 0.95), 2),
+        "p99_ms": round(percentile(ordered, 0.99), 2),
+        "upstream_requests": requests,
+        "requests_per_query": round(requests / len(ordered), 4) if ordered else 0.0,
+        **(extra or {}),
+    }
+
+
+def make_backend(args):
+    if args.live:
+        import clients
+        return CountingEmbeddings(clients.get_embeddings())
+    return SimulatedEmbeddings(args.request_ms, args.per_input_ms, args.backend_concurrency)
+
+
+async def main(args) -> dict:
+    results = []
+
+    # Unbatched: every query is its own request, as without the batcher.
+    backend = make_backend(args)
+    executor = ThreadPoolExecutor(max_workers=args.callers)
+    loop = asyncio.get_running_loop()
+    latencies, errors, elapsed = await run_callers(
+        lambda text: loop.run_in_executor(executor, backend.embed_query, text), args.callers, args.duration)
+    executor.shutdown(wait=False)
+    results.append(summarize("unbatched", latencies, errors, elapsed, backend.requests))
+    print(json.dumps(results[-1]), file=sys.stderr)
+
+    for max_wait_ms in [float(w) for w in args.max_wait_ms.split(",")]:
+        backend = make_backend(args)
+        batcher = EmbeddingBatcher(lambda: backend, max_wait_ms=max_wait_ms,
+                                   max_batch_size=args.max_batch_size, max_in_flight=args.max_in_flight)
+        latencies, errors, elapsed = await run_callers(batcher.aembed, args.callers, args.duration)
+        stats = batcher.stats()
+        results.append(summarize(f"batched max_wait={max_wait_ms}ms", latencies, errors, elapsed, backend.requests, {
+            "mean_batch_size": stats["mean_batch_size"],
+            "mean_queue_wait_ms": stats["mean_queue_wait_ms"],
+        }))
+        print(json.dumps(results[-1]), file=sys.stderr)
+
+    return {
+        "backend": "live" if args.live else {
+            "request_ms": args.request_ms, "per_input_ms": args.per_input_ms,
+            "concurrency": args.backend_concurrency,
+        },
+        "callers": args.callers,
+        "duration_s": args.duration,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callers", type=int, default=200, help="Concurrent closed-loop callers")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per configuration")
+    parser.add_argument("--max-wait-ms", default="1,2,5,10", help="Comma-separated batcher wait settings")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--request-ms", type=float, default=40.0, help="Simulated per-request latency")
+    parser.add_argument("--per-input-ms", type=float, default=0.2, help="Simulated per-input latency")
+    parser.add_argument("--backend-concurrency", type=int, default=8, help="Simulated concurrent request limit")
+    parser.add_argument("--live", action="store_true", help="Use the real embedding API via clients")
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,98 @@
+"""
+Fault-injection check for the embedding scheduler's retries.
+
+Runs RateLimitedEmbeddings over a stand-in client that fails the first
+attempts of each batch with the errors the OpenAI SDK raises for a 5xx
+response, a dropped connection, a timeout and a 429, and checks that every
+batch still comes back, in order, after the expected number of attempts.
+Exits non-zero on failure, so it can gate CI:
+
+    python -m benchmarks.embedding_retries
+"""
+import os
+import sys
+import json
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep the retry backoff short; must be set before the scheduler is imported.
+os.environ.setdefault("EMBED_MAX_BACKOFF_SECONDS", "0.05")
+
+import httpx
+import openai
+from embedding_scheduler import RateLimitedEmbeddings, RateLimiter
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+
+
+def server_error():
+    return openai.InternalServerError("Internal Server Error", response=httpx.Response(500, request=REQUEST), body=None)
+
+
+def rate_limit_error():
+    return openai.RateLimitError("Too Many Requests", response=httpx.Response(429, request=REQUEST), body=None)
+
+
+SCENARIOS = {
+    "5xx": [server_error],
+    "connection_error": [lambda: openai.APIConnectionError(request=REQUEST)],
+    "timeout": [lambda: openai.APITimeoutError(request=REQUEST)],
+    "rate_limit": [rate_limit_error],
+    "mixed": [server_error, lambda: openai.APIConnectionError(request=REQUEST), rate_limit_error],
+}
+
+
+class FlakyEmbeddings:
+    """Raises `failures` in order on the first attempts for each distinct batch, then succeeds."""
+    model = "flaky-embedding"
+
+    def __init__(self, failures: list):
+        self.failures = failures
+        self.attempts = {}
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list) -> list:
+        with self._lock:
+            attempt = self.attempts.get(texts[0], 0)
+            self.attempts[texts[0]] = attempt + 1
+        if attempt < len(self.failures):
+            raise self.failures[attempt]()
+        return [[float(len(text))] for text in texts]
+
+
+def run(name: str, failures: list) -> dict:
+    texts = [f"chunk {i} " + "word " * i for i in range(40)]
+    flaky = FlakyEmbeddings(failures)
+    embeddings = RateLimitedEmbeddings(flaky, limiter=RateLimiter(rpm=1_000_000, tpm=1_000_000_000),
+                                       max_attempts=5, max_batch_inputs=8)
+    try:
+        vectors = embeddings.embed_documents(texts)
+        error = None
+    except Exception as e:
+        vectors, error = [], f"{type(e).__name__}: {e}"
+    expected_attempts = len(failures) + 1
+    ok = (error is None and vectors == [[float(len(text))] for text in texts]
+          and all(n == expected_attempts for n in flaky.attempts.values()))
+    return {"scenario": name, "ok": ok, "error": error, "batches": len(flaky.attempts),
+            "attempts_per_batch": sorted(set(flaky.attempts.values())), "stats": embeddings.throughput()}
+
+
+def run_exhausted() -> dict:
+    # A batch that keeps failing must raise once max_attempts is used up.
+    flaky = FlakyEmbeddings([server_error] * 10)
+    embeddings = RateLimitedEmbeddings(flaky, limiter=RateLimiter(rpm=1_000_000, tpm=1_000_000_000), max_attempts=3)
+    try:
+        embeddings.embed_documents(["always failing"])
+        raised = None
+    except openai.InternalServerError as e:
+        raised = type(e).__name__
+    return {"scenario": "exhausted", "ok": raised is not None and flaky.attempts["always failing"] == 3,
+            "error": raised, "attempts_per_batch": sorted(set(flaky.attempts.values()))}
+
+
+if __name__ == "__main__":
+    report = [run(name, failures) for name, failures in SCENARIOS.items()] + [run_exhausted()]
+    for result in report:
+        print(json.dumps({k: v for k, v in result.items() if k != "stats"}), file=sys.stderr)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if all(result["ok"] for result in report) else 1)
@@ -0,0 +1,137 @@
+"""
+Deterministic local stand-ins for the OpenAI chat and embedding models, with
+configurable simulated latency. `install()` routes every caller of the
+`clients` registry (llm.get_llm, get_direct_llm_response, the retrievers and
+the ingestion paths) to them, so benchmarks measure our own code.
+"""
+import time
+import asyncio
+import hashlib
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+DEFAULT_RESPONSES = [
+    "For Type 2 Diabetes, keep rice to about one cup of cooked brown rice per meal and fill half "
+    "your plate with vegetables. [IMAGE: one cup of brown rice]",
+    "Choose grilled fish or chicken breast, a palm-sized portion, with leafy greens and limit "
+    "fried foods. [IMAGE: grilled chicken breast portion]",
+    "Spread carbohydrates evenly across meals, prefer whole grains, and pair them with protein "
+    "and fibre to keep blood sugar steady.",
+    "A healthy plate is half vegetables, a quarter lean protein and a quarter whole grains, with "
+    "water instead of sweetened drinks. [IMAGE: healthy plate]",
+]
+CONDITION_PROMPT_MARKER = "identify the primary health condition"
+
+
+def _prompt_text(messages) -> str:
+    return "\n".join(str(m.content) for m in messages)
+
+
+def _usage(prompt: str, text: str) -> dict:
+    input_tokens, output_tokens = len(prompt.split()), len(text.split())
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens}
+
+
+class SimulatedChatModel(BaseChatModel):
+    """
+    Chat model that answers from a fixed list, picked by a hash of the prompt,
+    after `latency_ms` (time to first token) plus `token_ms` per word.
+    Condition-identification prompts get `condition` back.
+    """
+    responses: list = DEFAULT_RESPONSES
+    condition: str = "Type 2 Diabetes"
+    latency_ms: float = 0.0
+    token_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-chat"
+
+    def _respond(self, prompt: str) -> str:
+        if CONDITION_PROMPT_MARKER in prompt:
+            return self.condition
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        return self.responses[digest % len(self.responses)]
+
+    def _result(self, prompt: str, text: str) -> ChatResult:
+        message = AIMessage(content=text, usage_metadata=_usage(prompt, text))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay_s(self, text: str) -> float:
+        return (self.latency_ms + self.token_ms * len(text.split())) / 1000
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = _prompt_text(messages)
+        text = self._respond(prompt)
+        time.sleep(self._delay_s(text))
+        return self._result(prompt, text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = _prompt_text(messages)
+        text = self._respond(prompt)
+        await asyncio.sleep(self._delay_s(text))
+        return self._result(prompt, text)
+
+    def _chunks(self, prompt: str):
+        text = self._respond(prompt)
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=word if last else word + " ",
+                usage_metadata=_usage(prompt, text) if last else None,
+            ))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency_ms / 1000)
+        for chunk in self._chunks(_prompt_text(messages)):
+            time.sleep(self.token_ms / 1000)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency_ms / 1000)
+        for chunk in self._chunks(_prompt_text(messages)):
+            await asyncio.sleep(self.token_ms / 1000)
+            yield chunk
+
+
+class SimulatedEmbeddings(DeterministicFakeEmbedding):
+    """
+    Deterministic embeddings (a fixed random vector per text) that take
+    `latency_ms` per request plus `per_input_ms` per input.
+    """
+    latency_ms: float = 0.0
+    per_input_ms: float = 0.0
+    model: str = "simulated-embedding"
+
+    def _delay_s(self, inputs: int) -> float:
+        return (self.latency_ms + self.per_input_ms * inputs) / 1000
+
+    def embed_documents(self, texts: list) -> list:
+        time.sleep(self._delay_s(len(texts)))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        time.sleep(self._delay_s(1))
+        return super().embed_query(text)
+
+    async def aembed_documents(self, texts: list) -> list:
+        await asyncio.sleep(self._delay_s(len(texts)))
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list:
+        await asyncio.sleep(self._delay_s(1))
+        return super().embed_query(text)
+
+
+def install(chat_latency_ms: float = 0.0, chat_token_ms: float = 0.0, embed_latency_ms: float = 0.0,
+            embed_per_input_ms: float = 0.0, dim: int = 1536) -> tuple:
+    """Installs simulated models for every `clients` caller and returns (chat_model, embeddings)."""
+    import clients
+    chat_model = SimulatedChatModel(latency_ms=chat_latency_ms, token_ms=chat_token_ms)
+    embeddings = SimulatedEmbeddings(size=dim, latency_ms=embed_latency_ms, per_input_ms=embed_per_input_ms)
+    clients.override(chat_model=chat_model, embeddings=embeddings)
+    return chat_model, embeddings
@@ -0,0 +1,98 @@
+"""
+Cold-start import budget for the app and the worker processes.
+
+Imports each module in a fresh interpreter --runs times and reports the
+median wall time, the slowest imports (from `python -X importtime`) and any
+heavy dependency that was loaded eagerly. Exits non-zero when a module goes
+over --budget-ms or imports a heavy dependency, so it can gate CI:
+
+    python -m benchmarks.import_time --budget-ms 1500
+    python -m benchmarks.import_time --modules app,process_user_docs --runs 7 --budget-ms 1200
+
+Budgets depend on the machine; record a baseline on the CI runner and set
+--budget-ms a little above it.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Dependencies that must only be imported on first use (see warmup.py).
+HEAVY_MODULES = [
+    "unstructured",
+    "chromadb",
+    "langchain_chroma",
+    "langchain_core",
+    "langchain_openai",
+    "langchain_community",
+    "langchain.retrievers",
+    "fitz",
+    "tiktoken",
+]
+
+MEASURE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+import json
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_once(module: str) -> dict:
+    code = MEASURE.format(module=module, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, top: int) -> list:
+    """Top `top` imports by cumulative time, parsed from -X importtime output."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append({"module": name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 1)})
+    return sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top]
+
+
+def main(args) -> tuple:
+    report, ok = [], True
+    for module in args.modules.split(","):
+        runs = [measure_once(module) for _ in range(args.runs)]
+        median_ms = statistics.median(r["ms"] for r in runs)
+        loaded = sorted({name for r in runs for name in r["loaded"]})
+        within_budget = median_ms <= args.budget_ms and not loaded
+        ok = ok and within_budget
+        report.append({
+            "module": module,
+            "median_ms": round(median_ms, 1),
+            "min_ms": round(min(r["ms"] for r in runs), 1),
+            "budget_ms": args.budget_ms,
+            "heavy_modules_loaded": loaded,
+            "ok": within_budget,
+            "slowest_imports": slowest_imports(module, args.top),
+        })
+        print(json.dumps({k: v for k, v in report[-1].items() if k != "slowest_imports"}), file=sys.stderr)
+    return report, ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", default="app,process_user_docs,ingest_jobs",
+                        help="Comma-separated modules to import (the app and what worker processes import)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Maximum median cold import time")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list per module")
+    report, ok = main(parser.parse_args())
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
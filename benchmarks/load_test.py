@@ -0,0 +1,268 @@
+"""
+Concurrent-session load test for the chat API.
+
+Ramps the number of concurrent chat sessions against the server and reports
+throughput, latency percentiles and error rate at each level. The capacity is
+the highest level whose p95 latency and error rate stay within the given
+limits. Sessions replay multi-turn conversations (--sessions-file, JSONL of
+{"turns": [...]}) and a fraction of them also upload a document and wait for
+its ingestion job (--upload-ratio).
+
+Against a server you started yourself:
+
+    uvicorn app:app --workers 1 --port 8000
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --username loadtest --create-user \\
+        --levels 10,20,40,80,160,320 --turns 3
+
+To size workers, let the harness start the local OpenAI stand-in and one
+server per worker configuration, and compare "capacity" across them:
+
+    python -m benchmarks.load_test --start-stub --workers 1,2,4 --create-user \\
+        --levels 20,40,80,160 --upload-ratio 0.05 --stub-args="--chat-latency lognormal:800,0.4"
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shlex
+import random
+import asyncio
+import argparse
+import statistics
+import subprocess
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+QUESTIONS = [
+    "How much rice can I eat with diabetes?",
+    "What is a healthy breakfast for high blood pressure?",
+    "Can you show me a portion of chicken breast?",
+    "Is brown rice better than white rice?",
+    "What snacks are good for someone with CKD?",
+]
+UPLOAD_PARAGRAPH = ("For Type 2 Diabetes, a serving of brown rice is about 150 g cooked. Pair it with grilled "
+                    "fish and vegetables, and prefer steaming over frying. ")
+JOB_POLL_SECONDS = 0.5
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies_ms: list, errors: int, elapsed_s: float) -> dict:
+    ordered = sorted(latencies_ms)
+    total = len(latencies_ms) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "throughput_rps": round(len(latencies_ms) / elapsed_s, 2) if elapsed_s else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50), 1),
+        "p95_ms": round(percentile(ordered, 0.95), 1),
+        "p99_ms": round(percentile(ordered, 0.99), 1),
+        "mean_ms": round(statistics.mean(ordered), 1) if ordered else 0.0,
+    }
+
+
+def load_sessions(path: str | None, turns: int) -> list:
+    """Conversations to replay: from a JSONL file, or `turns`-long scripts over QUESTIONS."""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line)["turns"] for line in f if line.strip()]
+    return [[QUESTIONS[(start + t) % len(QUESTIONS)] for t in range(turns)] for start in range(len(QUESTIONS))]
+
+
+async def run_session(client: httpx.AsyncClient, endpoint: str, username: str, turns: list, think_s: float,
+                      latencies: list, errors: list):
+    session_id = f"load_{uuid.uuid4()}"
+    for turn, question in enumerate(turns):
+        if turn and think_s:
+            await asyncio.sleep(think_s)
+        payload = {"username": username, "question": question, "session_id": session_id}
+        start = time.perf_counter()
+        try:
+            response = await client.post(endpoint, json=payload)
+            if response.status_code == 200:
+                latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+
+
+async def run_upload(client: httpx.AsyncClient, username: str, paragraphs: int, job_timeout: float,
+                     accept_latencies: list, completion_latencies: list, errors: list):
+    """Uploads a unique document and waits for its ingestion job to finish."""
+    content = (f"Load test document {uuid.uuid4()}\n\n" + UPLOAD_PARAGRAPH * paragraphs).encode("utf-8")
+    start = time.perf_counter()
+    try:
+        response = await client.post("/upload_document/", data={"user_id": username},
+                                     files={"file": (f"load_{uuid.uuid4().hex}.txt", content, "text/plain")})
+        if response.status_code not in (200, 202):
+            errors.append(response.status_code)
+            return
+        accept_latencies.append((time.perf_counter() - start) * 1000)
+        job_id = response.json().get("job_id")
+        deadline = time.perf_counter() + job_timeout
+        while job_id and time.perf_counter() < deadline:
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] == "succeeded":
+                completion_latencies.append((time.perf_counter() - start) * 1000)
+                return
+            if job["status"] == "failed":
+                errors.append("job_failed")
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+        if job_id:
+            errors.append("job_timeout")
+    except httpx.HTTPError as e:
+        errors.append(type(e).__name__)
+
+
+async def run_level(url: str, username: str, sessions: int, conversations: list, args) -> dict:
+    latencies, errors = [], []
+    upload_accept, upload_done, upload_errors = [], [], []
+    rng = random.Random(sessions)
+    limits = httpx.Limits(max_connections=sessions * 2, max_keepalive_connections=sessions * 2)
+    async with httpx.AsyncClient(base_url=url, timeout=args.timeout, limits=limits) as client:
+        tasks = []
+        for i in range(sessions):
+            tasks.append(run_session(client, "/chat/get_response", username, conversations[i % len(conversations)],
+                                     args.think_ms / 1000, latencies, errors))
+            if rng.random() < args.upload_ratio:
+                tasks.append(run_upload(client, username, args.upload_paragraphs, args.timeout,
+                                        upload_accept, upload_done, upload_errors))
+        start = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    result = {"concurrent_sessions": sessions, **summarize(latencies, len(errors), elapsed)}
+    if upload_accept or upload_errors:
+        result["uploads"] = {
+            "accepted": summarize(upload_accept, len(upload_errors), elapsed),
+            "completed": summarize(upload_done, 0, elapsed),
+        }
+    return result
+
+
+def ensure_user(username: str):
+    import database as db
+    session = db.SessionLocal()
+    try:
+        if not db.get_user(session, username):
+            db.add_user(session, username, uuid.uuid4().hex)
+    finally:
+        session.close()
+
+
+# --- Managed Processes (stub and app servers) ---
+def wait_until_up(url: str, timeout: float = 120.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_stub(args) -> subprocess.Popen:
+    command = [sys.executable, "-m", "benchmarks.openai_stub", "--port", str(args.stub_port)]
+    command += shlex.split(args.stub_args)
+    process = subprocess.Popen(command, cwd=REPO_ROOT)
+    wait_until_up(f"http://127.0.0.1:{args.stub_port}/stats")
+    return process
+
+
+def start_server(workers: int, args) -> subprocess.Popen:
+    env = dict(os.environ)
+    if args.start_stub:
+        env["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.stub_port}/v1"
+        env.setdefault("OPENAI_API_KEY", "sk-stub")
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.server_port),
+               "--workers", str(workers), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    wait_until_up(f"http://127.0.0.1:{args.server_port}/readyz")  # 503 until warmup is done
+    return process
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def run_levels(url: str, conversations: list, args) -> dict:
+    results = []
+    for sessions in [int(level) for level in args.levels.split(",")]:
+        result = await run_level(url, args.username, sessions, conversations, args)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+
+    within_slo = [r for r in results if r["p95_ms"] <= args.slo_p95_ms and r["error_rate"] <= args.max_error_rate]
+    return {
+        "capacity": max((r["concurrent_sessions"] for r in within_slo), default=0),
+        "levels": results,
+    }
+
+
+async def main(args) -> dict:
+    if args.create_user:
+        ensure_user(args.username)
+    conversations = load_sessions(args.sessions_file, args.turns)
+    summary = {
+        "sessions": args.sessions_file or f"{len(conversations)} built-in scripts of {args.turns} turns",
+        "upload_ratio": args.upload_ratio,
+        "slo_p95_ms": args.slo_p95_ms,
+    }
+
+    if not args.workers:
+        return {"url": args.url, **summary, **await run_levels(args.url, conversations, args)}
+
+    stub = start_stub(args) if args.start_stub else None
+    configs = []
+    try:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            print(f"--- {workers} worker(s) ---", file=sys.stderr)
+            server = start_server(workers, args)
+            try:
+                url = f"http://127.0.0.1:{args.server_port}"
+                configs.append({"workers": workers, **await run_levels(url, conversations, args)})
+            finally:
+                stop(server)
+        if stub:
+            summary["stub_stats"] = httpx.get(f"http://127.0.0.1:{args.stub_port}/stats").json()
+    finally:
+        if stub:
+            stop(stub)
+    return {**summary, "configurations": configs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server to test when --workers is not given")
+    parser.add_argument("--username", default="loadtest")
+    parser.add_argument("--create-user", action="store_true", help="Create the user in the local users.db first")
+    parser.add_argument("--levels", default="10,20,40,80,160", help="Comma-separated concurrent session counts")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per session (without --sessions-file)")
+    parser.add_argument("--sessions-file", help="JSONL of {\"turns\": [question, ...]} conversations to replay")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between turns of a session")
+    parser.add_argument("--upload-ratio", type=float, default=0.0, help="Fraction of sessions that also upload")
+    parser.add_argument("--upload-paragraphs", type=int, default=50, help="Size of each uploaded document")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request (and per-job) timeout in seconds")
+    parser.add_argument("--slo-p95-ms", type=float, default=10000.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--workers", help="Comma-separated uvicorn worker counts to start and test in turn")
+    parser.add_argument("--server-port", type=int, default=8100)
+    parser.add_argument("--start-stub", action="store_true", help="Start benchmarks.openai_stub for the servers")
+    parser.add_argument("--stub-port", type=int, default=9000)
+    parser.add_argument("--stub-args", default="", help="Extra arguments for benchmarks.openai_stub")
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,199 @@
+"""
+Local OpenAI-compatible stand-in server for load testing.
+
+Serves /v1/chat/completions (including streaming) and /v1/embeddings with
+deterministic content, configurable latency distributions and optional 429
+injection, so the app can be load tested without cost or OpenAI variance.
+
+    python -m benchmarks.openai_stub --port 9000 --chat-latency lognormal:800,0.4 \\
+        --token-latency fixed:15 --embed-latency lognormal:40,0.3 --rate-limit-rate 0.01
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=sk-stub uvicorn app:app
+
+Latency specs: "fixed:MS", "uniform:MIN_MS,MAX_MS" or "lognormal:MEDIAN_MS,SIGMA".
+GET /stats returns request, token and injected-429 counts.
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fakes import DEFAULT_RESPONSES, CONDITION_PROMPT_MARKER
+
+
+class Latency:
+    """Samples a delay in seconds from a "kind:params" spec."""
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v]
+        if kind == "fixed":
+            self._sample = lambda: values[0]
+        elif kind == "uniform":
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal":
+            median, sigma = values
+            self._sample = lambda: random.lognormvariate(math.log(median), sigma)
+        else:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        self.spec = spec
+
+    def sample(self) -> float:
+        return max(0.0, self._sample()) / 1000
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text.split()))
+
+
+def _prompt_text(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):  # multi-part (e.g. vision) messages
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+def _answer(prompt: str) -> str:
+    if CONDITION_PROMPT_MARKER in prompt:
+        return "Type 2 Diabetes"
+    digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    return DEFAULT_RESPONSES[digest % len(DEFAULT_RESPONSES)]
+
+
+def _vector(text: str, dim: int) -> np.ndarray:
+    seed = int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16)
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_app(chat_latency: Latency, token_latency: Latency, embed_latency: Latency,
+               rate_limit_rate: float, retry_after: float, dim: int) -> FastAPI:
+    app = FastAPI()
+    stats = {"chat_requests": 0, "stream_requests": 0, "embedding_requests": 0, "embedding_inputs": 0,
+             "prompt_tokens": 0, "completion_tokens": 0, "rate_limited": 0}
+
+    def rate_limited() -> JSONResponse | None:
+        if rate_limit_rate and random.random() < rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": str(retry_after)},
+                content={"error": {"message": "Rate limit reached (injected by stub).",
+                                   "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        return None
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        limited = rate_limited()
+        if limited:
+            return limited
+        body = await request.json()
+        prompt = _prompt_text(body.get("messages", []))
+        answer = _answer(prompt)
+        model = body.get("model", "stub-chat")
+        usage = {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(answer)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["completion_tokens"] += usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            stats["chat_requests"] += 1
+            await asyncio.sleep(chat_latency.sample() + token_latency.sample() * usage["completion_tokens"])
+            return {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        stats["stream_requests"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: dict, finish_reason=None, usage_block=None, choices=True) -> str:
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if choices else []}
+            if usage_block is not None:
+                payload["usage"] = usage_block
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(chat_latency.sample())
+            yield chunk({"role": "assistant", "content": ""})
+            words = answer.split(" ")
+            for i, word in enumerate(words):
+                await asyncio.sleep(token_latency.sample())
+                yield chunk({"content": word if i == len(words) - 1 else word + " "})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk({}, usage_block=usage, choices=False)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        limited = rate_limited()
+        if limited:
+            return limited
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        # Clients may send pre-tokenized inputs (lists of token ids); hash their text form.
+        texts = [item if isinstance(item, str) else " ".join(map(str, item)) for item in inputs]
+        stats["embedding_requests"] += 1
+        stats["embedding_inputs"] += len(texts)
+        await asyncio.sleep(embed_latency.sample())
+
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(texts):
+            vector = _vector(text, body.get("dimensions") or dim)
+            embedding = base64.b64encode(vector.tobytes()).decode("ascii") if as_base64 else vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(_tokens(t) for t in texts)
+        return {"object": "list", "data": data, "model": body.get("model", "stub-embedding"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.get("/stats")
+    def read_stats():
+        return {**stats, "chat_latency": chat_latency.spec, "token_latency": token_latency.spec,
+                "embed_latency": embed_latency.spec, "rate_limit_rate": rate_limit_rate}
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--chat-latency", default="lognormal:800,0.4", help="Time to first token")
+    parser.add_argument("--token-latency", default="fixed:10", help="Delay per streamed word")
+    parser.add_argument("--embed-latency", default="lognormal:40,0.3")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    app = create_app(Latency(args.chat_latency), Latency(args.token_latency), Latency(args.embed_latency),
+                     args.rate_limit_rate, args.retry_after, args.dim)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
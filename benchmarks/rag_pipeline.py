@@ -0,0 +1,276 @@
+"""
+Offline, deterministic micro-benchmarks for the RAG pipeline.
+
+The chat and embedding models are replaced with local fakes (see
+benchmarks/fakes.py) with fixed simulated latency, and temporary base and
+tenant Chroma stores are populated with synthetic chunks, so the numbers
+measure our own code: retriever setup, vector search, orchestration, image
+matching and ingestion.
+
+    python -m benchmarks.rag_pipeline --corpus-sizes 1000,10000 --tenants 1,50 \\
+        --chat-latency-ms 300 --embed-latency-ms 30
+
+Each (corpus size, tenant count) combination runs in its own subprocess with
+its own temporary data directory. Measured:
+  - get_rag_response: sequential latency percentiles, per-stage breakdown, and
+    throughput at --concurrency parallel requests
+  - get_retriever: cold (store opened from disk) and warm (cached) latency
+  - find_image_url: latency over a synthetic annotation set
+  - process_user_document: seconds and chunks/s per uploaded document
+Results are printed as JSON; diff two runs to spot regressions.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+SEED = 1234
+FOODS = ["brown rice", "white rice", "chicken breast", "salmon", "tofu", "lentils", "oats", "papaya",
+         "spinach", "broccoli", "sweet potato", "eggs", "yogurt", "almonds", "noodles", "chapati"]
+CONDITIONS = ["Type 2 Diabetes", "hypertension", "CKD", "high cholesterol", "general health"]
+QUESTIONS = [
+    "How much rice can I eat with diabetes?",
+    "What is a healthy breakfast for high blood pressure?",
+    "Can you show me a portion of chicken breast?",
+    "Is brown rice better than white rice?",
+    "What snacks are good for someone with CKD?",
+    "How many eggs a week with high cholesterol?",
+]
+
+
+# --- Synthetic Data ---
+def synthetic_chunk(rng: random.Random, i: int) -> str:
+    food, other, condition = rng.choice(FOODS), rng.choice(FOODS), rng.choice(CONDITIONS)
+    grams = rng.randint(30, 250)
+    return (f"Guideline {i}: for {condition}, a serving of {food} is about {grams} g. "
+            f"Pair {food} with {other} and vegetables, and prefer steaming or grilling over frying. "
+            f"Portion advice varies with activity level and medication; review with a dietitian.")
+
+
+def populate_stores(corpus_size: int, tenants: int, chunks_per_tenant: int, embeddings) -> dict:
+    import vector_store as vs
+    from langchain_chroma import Chroma
+
+    rng = random.Random(SEED)
+    start = time.perf_counter()
+    base = Chroma(collection_name=vs.BASE_COLLECTION_NAME, embedding_function=embeddings,
+                  persist_directory=vs.BASE_INDEX_DIR)
+    for i in range(0, corpus_size, 1000):
+        texts = [synthetic_chunk(rng, j) for j in range(i, min(i + 1000, corpus_size))]
+        base.add_texts(texts, metadatas=[{"source": "synthetic_base.txt"}] * len(texts))
+    base_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for t in range(tenants):
+        with vs.tenant_write(f"bench_{t}", embeddings) as store:
+            texts = [synthetic_chunk(rng, j) for j in range(chunks_per_tenant)]
+            store.add_texts(texts, metadatas=[{"source": f"tenant_{t}.txt"}] * len(texts))
+    return {"base_populate_s": round(base_seconds, 2), "tenant_populate_s": round(time.perf_counter() - start, 2)}
+
+
+def write_annotations(count: int):
+    import csv
+    import image_index
+    import image_embeddings
+
+    rng = random.Random(SEED)
+    os.makedirs(os.path.dirname(image_index.ANNOTATION_FILE), exist_ok=True)
+    with open(image_index.ANNOTATION_FILE, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["filename", "description"])
+        writer.writeheader()
+        for i in range(count):
+            food = rng.choice(FOODS)
+            writer.writerow({"filename": f"img_{i}.jpg",
+                             "description": f"{rng.choice(['one cup of', 'a slice of', 'a bowl of', 'a portion of'])} {food}"})
+    image_embeddings.build_annotation_matrix(embedder=image_embeddings.HashingEmbedder())
+
+
+def write_document(path: str, paragraphs: int, rng: random.Random):
+    with open(path, "w", encoding="utf-8") as f:
+        for p in range(paragraphs):
+            f.write(f"Section {p}\n\n{synthetic_chunk(rng, p)} {synthetic_chunk(rng, p + 1)}\n\n")
+
+
+# --- Measurement Helpers ---
+def percentiles(samples_ms: list) -> dict:
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.mean(ordered), 3),
+        "p50_ms": round(pick(0.50), 3),
+        "p95_ms": round(pick(0.95), 3),
+        "p99_ms": round(pick(0.99), 3),
+    }
+
+
+def timed(func, *args) -> tuple:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def bench_rag(requests: int, concurrency: int, tenants: int) -> dict:
+    import rag
+
+    def one(i: int):
+        user_id = f"bench_{i % tenants}" if tenants else "bench_none"
+        return timed(rag.get_rag_response, QUESTIONS[i % len(QUESTIONS)], user_id, f"bench_session_{uuid.uuid4()}")
+
+    rag.get_rag_response(QUESTIONS[0], "bench_0", "warmup")  # Opens the base store and the background loop.
+
+    latencies, stages = [], {}
+    for i in range(requests):
+        result, ms = one(i)
+        latencies.append(ms)
+        for name, span in result["diagnostics"]["timings_ms"].items():
+            stages.setdefault(name, []).append(span["duration"])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        concurrent_latencies = [ms for _, ms in executor.map(one, range(requests))]
+    elapsed = time.perf_counter() - start
+
+    return {
+        "sequential": percentiles(latencies),
+        "stages": {name: percentiles(samples) for name, samples in stages.items()},
+        "concurrent": {
+            "concurrency": concurrency,
+            "throughput_rps": round(requests / elapsed, 2),
+            **percentiles(concurrent_latencies),
+        },
+    }
+
+
+def bench_retriever(tenants: int, repeat: int) -> dict:
+    import vector_store as vs
+
+    cold = [timed(vs.get_retriever, f"bench_{t}")[1] for t in range(1, tenants)]  # bench_0 was opened by warmup
+    warm = [timed(vs.get_retriever, f"bench_{i % max(1, tenants)}")[1] for i in range(repeat)]
+    return {"cold": percentiles(cold), "warm": percentiles(warm)}
+
+
+def bench_images(repeat: int) -> dict:
+    import rag
+
+    rng = random.Random(SEED)
+    queries = [f"{rng.choice(['cup of', 'slice of', 'portion of'])} {rng.choice(FOODS)}" for _ in range(repeat)]
+    rag.find_image_url(queries[0])  # Loads the index and matrix.
+    return percentiles([timed(rag.find_image_url, q)[1] for q in queries])
+
+
+def bench_ingest(documents: int, paragraphs: int, workdir: str) -> dict:
+    import process_user_docs
+    import upload_manifest
+
+    rng = random.Random(SEED + 1)
+    rows = []
+    for d in range(documents):
+        path = os.path.join(workdir, f"upload_{d}.txt")
+        write_document(path, paragraphs, rng)
+        _, ms = timed(process_user_docs.process_user_document, "bench_ingest", path)
+        chunks = upload_manifest.load("bench_ingest").get(os.path.basename(path), {}).get("chunks", 0)
+        rows.append((ms, chunks))
+    total_s = sum(ms for ms, _ in rows) / 1000
+    return {
+        "documents": documents,
+        "per_document": percentiles([ms for ms, _ in rows]),
+        "chunks": sum(c for _, c in rows),
+        "chunks_per_second": round(sum(c for _, c in rows) / total_s, 2) if total_s else 0.0,
+    }
+
+
+def run_single(args) -> dict:
+    from benchmarks import fakes
+
+    fakes.install(chat_latency_ms=args.chat_latency_ms, chat_token_ms=args.chat_token_ms,
+                  embed_latency_ms=args.embed_latency_ms, embed_per_input_ms=args.embed_per_input_ms,
+                  dim=args.dim)
+    setup_embeddings = fakes.SimulatedEmbeddings(size=args.dim)  # no latency while populating
+
+    setup = populate_stores(args.corpus_size, args.tenant_count, args.chunks_per_tenant, setup_embeddings)
+    write_annotations(args.annotations)
+
+    results = {
+        "corpus_size": args.corpus_size,
+        "tenants": args.tenant_count,
+        "setup": setup,
+        "get_rag_response": bench_rag(args.requests, args.concurrency, args.tenant_count),
+        "get_retriever": bench_retriever(args.tenant_count, args.requests),
+        "find_image_url": bench_images(args.requests),
+    }
+    if args.documents:
+        results["process_user_document"] = bench_ingest(args.documents, args.paragraphs, os.getcwd())
+    return results
+
+
+def run_matrix(args) -> dict:
+    runs = []
+    for corpus_size in [int(c) for c in args.corpus_sizes.split(",")]:
+        for tenants in [int(t) for t in args.tenants.split(",")]:
+            with tempfile.TemporaryDirectory(prefix="rag_bench_") as workdir:
+                env = {
+                    **os.environ,
+                    "PERSISTENT_DISK_PATH": os.path.join(workdir, "data"),
+                    "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+                    "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-offline-benchmark"),
+                    "ANSWER_CACHE_ENABLED": "false",
+                }
+                command = [sys.executable, "-m", "benchmarks.rag_pipeline", "--single",
+                           "--corpus-size", str(corpus_size), "--tenant-count", str(tenants)]
+                command += [arg for arg in sys.argv[1:] if arg not in ("--single",)]
+                print(f"Running corpus_size={corpus_size} tenants={tenants} ...", file=sys.stderr)
+                completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    print(completed.stderr, file=sys.stderr)
+                    runs.append({"corpus_size": corpus_size, "tenants": tenants, "error": completed.returncode})
+                    continue
+                runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {
+        "config": {
+            "chat_latency_ms": args.chat_latency_ms, "chat_token_ms": args.chat_token_ms,
+            "embed_latency_ms": args.embed_latency_ms, "embed_per_input_ms": args.embed_per_input_ms,
+            "dim": args.dim, "requests": args.requests, "concurrency": args.concurrency,
+            "chunks_per_tenant": args.chunks_per_tenant,
+        },
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus-sizes", default="1000,10000", help="Comma-separated base KB chunk counts")
+    parser.add_argument("--tenants", default="1,20", help="Comma-separated tenant counts")
+    parser.add_argument("--chunks-per-tenant", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per measurement")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--annotations", type=int, default=500, help="Synthetic image annotations")
+    parser.add_argument("--documents", type=int, default=5, help="Documents to ingest (0 to skip)")
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs per ingested document")
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0)
+    parser.add_argument("--chat-token-ms", type=float, default=0.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-per-input-ms", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    # Internal: run one combination in this process (used by the matrix driver).
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus-size", type=int, default=1000, help=argparse.SUPPRESS)
+    parser.add_argument("--tenant-count", type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_single(args)))
+    else:
+        print(json.dumps(run_matrix(args), indent=2))
@@ -0,0 +1,140 @@
+"""
+Per-user vs shared tenant store layout, as the number of tenants grows.
+
+For each (tenant count, layout) this populates a temporary data directory
+with --chunks-per-tenant synthetic chunks per tenant, written through
+vector_store.tenant_write as uploads are, then measures in a fresh process:
+  - open: cold latency of get_user_store for a sample of tenants (a Chroma
+    directory per tenant vs a filtered view on an already open shard)
+  - query: warm similarity_search_by_vector latency for the same tenants
+  - disk: files and bytes under the data directory, and the process's peak RSS
+
+    python -m benchmarks.tenant_layout --tenants 10,1000,10000 --layouts per_user,shared
+
+Populating 10k per-user stores takes a while; use --chunks-per-tenant and a
+smaller --dim for a quicker run. Results are printed as JSON.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.rag_pipeline import SEED, synthetic_chunk, percentiles, timed
+
+
+def populate(args) -> dict:
+    from benchmarks import fakes
+    import vector_store as vs
+
+    _, embeddings = fakes.install(dim=args.dim)
+    rng = random.Random(SEED)
+    start = time.perf_counter()
+    for t in range(args.tenant_count):
+        with vs.tenant_write(f"tenant_{t}", embeddings) as store:
+            texts = [synthetic_chunk(rng, j) for j in range(args.chunks_per_tenant)]
+            store.add_texts(texts, metadatas=[{"source": f"tenant_{t}.txt"}] * len(texts))
+        # Per-user stores each hold SQLite and index handles; close them as we go.
+        vs._release_store(store)
+        if (t + 1) % 500 == 0:
+            print(f"  populated {t + 1}/{args.tenant_count} tenants", file=sys.stderr)
+    return {"populate_s": round(time.perf_counter() - start, 2)}
+
+
+def disk_usage(path: str) -> dict:
+    files, size = 0, 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return {"files": files, "mb": round(size / (1024 * 1024), 1)}
+
+
+def measure(args) -> dict:
+    from benchmarks import fakes
+    import vector_store as vs
+
+    _, embeddings = fakes.install(dim=args.dim)
+    rng = random.Random(SEED + 1)
+    tenants = rng.sample(range(args.tenant_count), min(args.sample, args.tenant_count))
+    queries = [embeddings.embed_query(synthetic_chunk(rng, i)) for i in range(args.queries)]
+
+    stores, open_ms = {}, []
+    for t in tenants:
+        stores[t], elapsed = timed(vs.get_user_store, f"tenant_{t}")
+        open_ms.append(elapsed)
+    if any(store is None for store in stores.values()):
+        raise RuntimeError("A sampled tenant has no store; populate failed.")
+
+    query_ms = []
+    for t in tenants:
+        for vector in queries:
+            _, elapsed = timed(stores[t].similarity_search_by_vector, vector, vs.RETRIEVER_K)
+            query_ms.append(elapsed)
+    return {
+        "first_open_ms": round(open_ms[0], 3),
+        "open": percentiles(open_ms[1:] or open_ms),
+        "query": percentiles(query_ms),
+        "disk": disk_usage(vs.PERSISTENT_DISK_PATH),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_matrix(args) -> dict:
+    runs = []
+    for tenants in [int(t) for t in args.tenants.split(",")]:
+        for layout in args.layouts.split(","):
+            with tempfile.TemporaryDirectory(prefix="tenant_bench_") as workdir:
+                env = {
+                    **os.environ,
+                    "PERSISTENT_DISK_PATH": os.path.join(workdir, "data"),
+                    "PYTHONPATH": REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+                    "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-offline-benchmark"),
+                    "TENANT_STORE_LAYOUT": layout,
+                    "TENANT_STORE_FORMAT": "chroma",
+                }
+                run = {"tenants": tenants, "layout": layout}
+                for phase in ("populate", "measure"):
+                    print(f"Running tenants={tenants} layout={layout} phase={phase} ...", file=sys.stderr)
+                    command = [sys.executable, "-m", "benchmarks.tenant_layout", "--phase", phase,
+                               "--tenant-count", str(tenants)] + sys.argv[1:]
+                    completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+                    if completed.returncode != 0:
+                        print(completed.stderr, file=sys.stderr)
+                        run["error"] = f"{phase} exited with {completed.returncode}"
+                        break
+                    run.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+                runs.append(run)
+    return {
+        "config": {"chunks_per_tenant": args.chunks_per_tenant, "dim": args.dim, "sample": args.sample,
+                   "queries": args.queries},
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", default="10,1000,10000", help="Comma-separated tenant counts")
+    parser.add_argument("--layouts", default="per_user,shared", help="Comma-separated TENANT_STORE_LAYOUT values")
+    parser.add_argument("--chunks-per-tenant", type=int, default=20)
+    parser.add_argument("--sample", type=int, default=50, help="Tenants opened and queried per run")
+    parser.add_argument("--queries", type=int, default=5, help="Queries per sampled tenant")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    # Internal: run one phase in this process (used by the matrix driver).
+    parser.add_argument("--phase", choices=["populate", "measure"], help=argparse.SUPPRESS)
+    parser.add_argument("--tenant-count", type=int, default=10, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.phase == "populate":
+        print(json.dumps(populate(args)))
+    elif args.phase == "measure":
+        print(json.dumps(measure(args)))
+    else:
+        print(json.dumps(run_matrix(args), indent=2))
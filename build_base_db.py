@@ -1,18 +1,19 @@
 import os
 import json
 import time
+import queue
+import threading
 from dotenv import load_dotenv
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Dict
 
 # --- Load environment variables from .env file FIRST ---
 load_dotenv()
 
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain.docstore.document import Document
-from unstructured.partition.auto import partition
-from unstructured.chunking.title import chunk_by_title
+from embedding_cache import cached_embeddings
+from hashing import file_sha256, chunk_ids
+import base_index
+import metrics
 
 # --- UNIFIED PATH CONFIGURATION ---
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -24,43 +25,113 @@ BASE_DOCS_DIR = os.path.join(APP_DIR, "data", "base_docs")
 BASE_INDEX_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstore_base")
 FILE_TRACKER_PATH = os.path.join(LOCAL_DATA_PATH, "file_tracker.json")
 COLLECTION_NAME = "base_knowledge"
-EMBEDDING_MODEL = "text-embedding-3-small"
 MAX_WORKERS = os.cpu_count() or 4
 # NEW: Define a safe batch size for adding documents to ChromaDB
 DB_BATCH_SIZE = 4000 
+# Memory bounds for the streaming build: files being partitioned at once, and
+# partitioned files waiting for the embedding/storage stage.
+MAX_IN_FLIGHT_FILES = int(os.environ.get("BUILD_MAX_IN_FLIGHT_FILES", MAX_WORKERS * 2))
+STORE_QUEUE_MAX_FILES = int(os.environ.get("BUILD_STORE_QUEUE_MAX_FILES", MAX_WORKERS))
 # =================================
 
 def load_processed_files_tracker():
+    """
+    Returns {filename: {"mtime", "size", "sha256", "chunk_ids"}}. Older trackers
+    stored only the mtime; those entries are upgraded on their next change.
+    """
     if os.path.exists(FILE_TRACKER_PATH):
         with open(FILE_TRACKER_PATH, 'r') as f:
-            return json.load(f)
+            tracker = json.load(f)
+        return {name: entry if isinstance(entry, dict) else {"mtime": entry} for name, entry in tracker.items()}
     return {}
 
 def save_processed_files_tracker(tracker):
-    with open(FILE_TRACKER_PATH, 'w') as f:
+    # Written after every stored file, so replace atomically to survive interruption.
+    tmp_path = f"{FILE_TRACKER_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
         json.dump(tracker, f, indent=4)
+    os.replace(tmp_path, FILE_TRACKER_PATH)
 
 def get_files_to_process():
+    """
+    Returns (files_to_process, tracker, removed_files, tracker_changed).
+    files_to_process holds (filepath, fingerprint) pairs. A file whose size and
+    mtime match the tracker is skipped without reading it; otherwise its
+    content hash decides whether it really changed.
+    """
     tracker = load_processed_files_tracker()
     files_to_process = []
+    tracker_changed = False
     if not os.path.exists(BASE_DOCS_DIR):
         print(f"Error: The directory '{BASE_DOCS_DIR}' was not found.")
-        return [], tracker
+        return [], tracker, [], False
 
+    present = set()
     for filename in os.listdir(BASE_DOCS_DIR):
         filepath = os.path.join(BASE_DOCS_DIR, filename)
         if not os.path.isfile(filepath):
             continue
-        modification_time = os.path.getmtime(filepath)
-        if filename not in tracker or tracker[filename] < modification_time:
-            files_to_process.append(filepath)
-    return files_to_process, tracker
+        present.add(filename)
+        stat = os.stat(filepath)
+        entry = tracker.get(filename, {})
+        if entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            continue
+        fingerprint = {"mtime": stat.st_mtime, "size": stat.st_size, "sha256": file_sha256(filepath)}
+        if entry.get("sha256") == fingerprint["sha256"] and "chunk_ids" in entry:
+            # Touched but not modified: remember the new mtime and move on.
+            tracker[filename] = {**entry, **fingerprint}
+            tracker_changed = True
+            continue
+        files_to_process.append((filepath, fingerprint))
 
-def process_single_file(filepath: str) -> List[Document]:
+    removed_files = [filename for filename in tracker if filename not in present]
+    return files_to_process, tracker, removed_files, tracker_changed
+
+def _indexed_chunk_ids(vector_store, filename: str, entry: Dict) -> set:
+    # Files indexed before chunk manifests existed are looked up by source.
+    if "chunk_ids" in entry:
+        return set(entry["chunk_ids"])
+    return set(vector_store.get(where={"source": filename}, include=[])["ids"])
+
+def remove_deleted_files(vector_store, tracker: Dict, removed_files: List[str]) -> int:
+    """Deletes the chunks of files that are no longer in BASE_DOCS_DIR."""
+    deleted = 0
+    for filename in removed_files:
+        stale_ids = _indexed_chunk_ids(vector_store, filename, tracker[filename])
+        if stale_ids:
+            vector_store.delete(ids=list(stale_ids))
+            deleted += len(stale_ids)
+        del tracker[filename]
+        print(f"Removed {filename}: {len(stale_ids)} chunks deleted.")
+    save_processed_files_tracker(tracker)
+    return deleted
+
+def store_file_chunks(vector_store, filename: str, chunks: List, previous_ids: set) -> tuple:
+    """
+    Brings one file's chunks in the store up to date: only chunks whose stable
+    id is new are embedded and added, and chunks that vanished from the file
+    are deleted. Returns (chunk_ids, added, deleted).
+    """
+    ids = chunk_ids(filename, [chunk.page_content for chunk in chunks])
+    new_chunks = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id not in previous_ids]
+    for i in range(0, len(new_chunks), DB_BATCH_SIZE):
+        batch = new_chunks[i:i + DB_BATCH_SIZE]
+        vector_store.add_documents([chunk for _, chunk in batch], ids=[chunk_id for chunk_id, _ in batch])
+    stale_ids = previous_ids - set(ids)
+    if stale_ids:
+        vector_store.delete(ids=list(stale_ids))
+    return ids, len(new_chunks), len(stale_ids)
+
+def process_single_file(filepath: str) -> List | None:
     """
     Processes a single document file: partitions, chunks, and creates Document objects.
-    This function is designed to be run in a separate process.
+    This function is designed to be run in a separate process, so the parsing
+    libraries are only imported there. Returns None if the file could not be processed.
     """
+    from langchain.docstore.document import Document
+    from unstructured.partition.auto import partition
+    from unstructured.chunking.title import chunk_by_title
+
     print(f"Processing: {os.path.basename(filepath)}")
     try:
         elements = partition(filename=filepath, strategy="fast")
@@ -78,57 +149,159 @@ def process_single_file(filepath: str) -> List[Document]:
         return langchain_docs
     except Exception as e:
         print(f"Error processing {os.path.basename(filepath)}: {e}")
-        return []
+        return None
+
+def timed_process_single_file(filepath: str) -> tuple:
+    """Runs process_single_file in a worker and returns (documents, seconds) for the parent's metrics."""
+    start = time.perf_counter()
+    documents = process_single_file(filepath)
+    return documents, time.perf_counter() - start
+
+def store_processed_files(file_queue: queue.Queue, vector_store, tracker: Dict, progress: Dict):
+    """
+    Storage stage of the build, run on its own thread: updates each
+    partitioned file's chunks in the store, then records the file and its
+    chunk ids in the tracker. A file is only marked done once all of its
+    chunks are stored, so an interrupted build resumes from the first
+    unfinished file (and, with stable ids, never duplicates chunks).
+    """
+    while True:
+        item = file_queue.get()
+        if item is None:
+            return
+        if progress["error"] is not None:
+            continue  # Keep draining so the partitioning stage never blocks on a full queue.
+        filepath, fingerprint, chunks = item
+        filename = os.path.basename(filepath)
+        try:
+            previous_ids = _indexed_chunk_ids(vector_store, filename, tracker.get(filename, {}))
+            with metrics.span("ingest_base", "embed_and_store"):
+                ids, added, deleted = store_file_chunks(vector_store, filename, chunks, previous_ids)
+            metrics.INGEST_CHUNKS.labels("ingest_base").inc(added)
+            tracker[filename] = {**fingerprint, "chunk_ids": ids}
+            save_processed_files_tracker(tracker)
+        except Exception as e:
+            print(f"Error storing chunks from {filename}: {e}")
+            progress["error"] = e
+            continue
+        progress["files"] += 1
+        progress["added"] += added
+        progress["deleted"] += deleted
+        progress["unchanged"] += len(ids) - added
+        print(f"Updated {filename}: {added} chunks added, {deleted} deleted, {len(ids) - added} unchanged "
+              f"({progress['files']}/{progress['total_files']} files).")
+
+def open_base_store(embedding_function):
+    # Only this (parent) process opens the store; partition workers never import chromadb.
+    from langchain_chroma import Chroma
+
+    return Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embedding_function,
+        persist_directory=BASE_INDEX_DIR
+    )
+
+def export_if_missing_or_stale():
+    """
+    Exports the base collection when nothing changed but there is no current
+    export, or it predates the last write (e.g. a deployment upgraded from
+    before the memory-mapped index, or a build interrupted before its export).
+    """
+    manifest = base_index.read_manifest()
+    if manifest is not None and not base_index._is_stale(manifest):
+        return
+    if not os.path.exists(BASE_INDEX_DIR):
+        return
+    print("Memory-mapped base index is missing or out of date; exporting it.")
+    with metrics.span("ingest_base", "export_index"):
+        base_index.export_base_index(open_base_store(cached_embeddings(max_retries=10)))
 
 def build_base_database():
     start_time = time.time()
     print("--- Starting Knowledge Base Update ---")
 
-    files_to_process, tracker = get_files_to_process()
+    files_to_process, tracker, removed_files, tracker_changed = get_files_to_process()
 
-    if not files_to_process:
+    if not files_to_process and not removed_files:
+        if tracker_changed:
+            save_processed_files_tracker(tracker)
         print("No new or updated files to process. Knowledge base is up to date.")
+        export_if_missing_or_stale()
         return
 
-    print(f"Detected {len(files_to_process)} new/updated documents. Starting parallel processing with {MAX_WORKERS} workers.")
-    all_chunks = []
+    embedding_function = cached_embeddings(max_retries=10)
+    try:
+        base_index.check_embedding_model(embedding_function.model, BASE_INDEX_DIR)
+    except ValueError as e:
+        print(f"\n❌ {e}")
+        return
+    vector_store = open_base_store(embedding_function)
+
+    # Workers on BASE_INDEX_BACKEND=auto search Chroma until the export below.
+    base_index.mark_source_changed()
+
+    progress = {"files": 0, "added": 0, "deleted": 0, "unchanged": 0, "failed": 0,
+                "total_files": len(files_to_process), "error": None}
+    if removed_files or tracker_changed:
+        with metrics.span("ingest_base", "remove_deleted"):
+            progress["deleted"] += remove_deleted_files(vector_store, tracker, removed_files)
 
+    print(f"Detected {len(files_to_process)} new/updated documents. Starting streaming processing with "
+          f"{MAX_WORKERS} workers.")
+
+    # Partitioning (CPU, worker processes) and embedding/storage (network, one
+    # thread) overlap; only a bounded number of files is held in memory at once.
+    file_queue = queue.Queue(maxsize=STORE_QUEUE_MAX_FILES)
+    store_thread = threading.Thread(
+        target=store_processed_files, args=(file_queue, vector_store, tracker, progress), daemon=True)
+    store_thread.start()
+
+    pending_files = iter(files_to_process)
+    in_flight = {}
     with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_file = {executor.submit(process_single_file, filepath): filepath for filepath in files_to_process}
-        for future in as_completed(future_to_file):
-            try:
-                chunks_from_file = future.result()
-                if chunks_from_file:
-                    all_chunks.extend(chunks_from_file)
-            except Exception as exc:
-                print(f'File {future_to_file[future]} generated an exception: {exc}')
-
-    if not all_chunks:
-        print("No content was generated from the new files. Aborting update.")
-        return
+        def submit_next():
+            # The fingerprint was taken before partitioning, so an edit made
+            # during the build is picked up by the next one.
+            filepath, fingerprint = next(pending_files, (None, None))
+            if filepath is not None:
+                in_flight[executor.submit(timed_process_single_file, filepath)] = (filepath, fingerprint)
 
-    print(f"Generated {len(all_chunks)} new chunks. Now creating embeddings and adding to the database in batches...")
+        for _ in range(MAX_IN_FLIGHT_FILES):
+            submit_next()
+        while in_flight and progress["error"] is None:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                filepath, fingerprint = in_flight.pop(future)
+                try:
+                    chunks, seconds = future.result()
+                    metrics.observe_stage("ingest_base", "partition", seconds)
+                except Exception as exc:
+                    print(f'File {filepath} generated an exception: {exc}')
+                    chunks = None
+                if chunks is None:
+                    progress["failed"] += 1
+                else:
+                    file_queue.put((filepath, fingerprint, chunks))  # Blocks while storage catches up.
+                submit_next()
+        executor.shutdown(wait=True, cancel_futures=True)
 
-    embedding_function = OpenAIEmbeddings(model=EMBEDDING_MODEL, max_retries=10)
-    vector_store = Chroma(
-        collection_name=COLLECTION_NAME,
-        embedding_function=embedding_function,
-        persist_directory=BASE_INDEX_DIR
-    )
-    
-    # --- UPDATED LOGIC: Add documents in batches ---
-    for i in range(0, len(all_chunks), DB_BATCH_SIZE):
-        batch = all_chunks[i:i + DB_BATCH_SIZE]
-        vector_store.add_documents(batch)
-        print(f"Added batch {i//DB_BATCH_SIZE + 1} of {len(all_chunks)//DB_BATCH_SIZE + 1} to the vector store.")
-    
-    print(f"Successfully added {len(all_chunks)} new chunks to the vector store.")
-
-    for filepath in files_to_process:
-        tracker[os.path.basename(filepath)] = os.path.getmtime(filepath)
-    save_processed_files_tracker(tracker)
+    file_queue.put(None)
+    store_thread.join()
+
+    embedding_function.report("Base KB build")
+    print(f"Stage totals: {json.dumps(metrics.stage_totals('ingest_base'))}")
+    if progress["error"] is not None:
+        print(f"\n❌ Build stopped after {progress['files']} files: {progress['error']}. "
+              "Re-run to resume from the unfinished files.")
+        return
+
+    # Workers serve base searches from this export (BASE_INDEX_BACKEND).
+    with metrics.span("ingest_base", "export_index"):
+        base_index.export_base_index(vector_store)
 
     end_time = time.time()
+    print(f"Updated {progress['files']} files: {progress['added']} chunks added, {progress['deleted']} deleted, "
+          f"{progress['unchanged']} unchanged ({progress['failed']} files failed and will be retried next run).")
     print(f"\n✅ Knowledge base update complete! Time taken: {end_time - start_time:.2f} seconds.")
 
 if __name__ == "__main__":
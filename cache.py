@@ -0,0 +1,155 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    """
+    A small thread-safe cache with LRU eviction, an idle TTL and an optional
+    weight budget (e.g. bytes on disk or open handles).
+
+    Entries that are evicted, expired or invalidated are passed to
+    `on_evict(key, value, reason)` so the owner can release resources.
+    """
+
+    def __init__(self, max_entries: int = 128, ttl_seconds: float | None = None,
+                 max_weight: float | None = None, weigher=None, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_weight = max_weight
+        self.weigher = weigher or (lambda key, value: 1)
+        self.on_evict = on_evict
+
+        self._entries = OrderedDict()  # key -> [value, weight, last_access]
+        self._lock = threading.RLock()
+        self._key_locks = {}
+        self._total_weight = 0
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    # --- Internal helpers (call with self._lock held) ---
+    def _is_expired(self, entry, now: float) -> bool:
+        return self.ttl_seconds is not None and now - entry[2] > self.ttl_seconds
+
+    def _remove(self, key, reason: str, released: list):
+        value, weight, _ = self._entries.pop(key)
+        self._total_weight -= weight
+        released.append((key, value, reason))
+
+    def _purge_expired(self, now: float, released: list):
+        if self.ttl_seconds is None:
+            return
+        # Entries are kept in access order, so the stalest ones come first.
+        for key in list(self._entries):
+            if not self._is_expired(self._entries[key], now):
+                break
+            self._counters["expirations"] += 1
+            self._remove(key, "expired", released)
+
+    def _enforce_budget(self, released: list):
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_weight is not None and self._total_weight > self.max_weight and len(self._entries) > 1)
+        ):
+            oldest = next(iter(self._entries))
+            self._counters["evictions"] += 1
+            self._remove(oldest, "evicted", released)
+
+    def _notify(self, released: list):
+        if not self.on_evict:
+            return
+        for key, value, reason in released:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                print(f"Error releasing cache entry {key!r}: {e}")
+
+    # --- Public API ---
+    def get(self, key, default=None):
+        released = []
+        with self._lock:
+            now = time.monotonic()
+            self._purge_expired(now, released)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                value = default
+            else:
+                self._counters["hits"] += 1
+                entry[2] = now
+                self._entries.move_to_end(key)
+                value = entry[0]
+        self._notify(released)
+        return value
+
+    def put(self, key, value):
+        released = []
+        weight = self.weigher(key, value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, "replaced", released)
+            self._entries[key] = [value, weight, time.monotonic()]
+            self._total_weight += weight
+            self._enforce_budget(released)
+        self._notify(released)
+
+    def get_or_create(self, key, factory):
+        """
+        Returns the cached value for `key`, calling `factory()` on a miss.
+        Concurrent misses for the same key only call the factory once.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and not self._is_expired(entry, time.monotonic()):
+                    entry[2] = time.monotonic()
+                    self._entries.move_to_end(key)
+                    return entry[0]
+            value = factory()
+            self.put(key, value)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def invalidate(self, key) -> bool:
+        released = []
+        with self._lock:
+            if key in self._entries:
+                self._counters["invalidations"] += 1
+                self._remove(key, "invalidated", released)
+        self._notify(released)
+        return bool(released)
+
+    def clear(self):
+        released = []
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key, "cleared", released)
+        self._notify(released)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._is_expired(entry, time.monotonic())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "size": len(self._entries),
+                "weight": self._total_weight,
+                "max_entries": self.max_entries,
+                "max_weight": self.max_weight,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,235 @@
+import os
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+import httpx
+from dotenv import load_dotenv
+
+# --- Load Environment Variables ---
+load_dotenv()
+
+# --- Model Configuration ---
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4-turbo")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+
+# --- Transport Configuration ---
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_TIMEOUT_SECONDS", 60))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_CONNECT_TIMEOUT_SECONDS", 10))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY_SECONDS", 60))
+
+# --- Registry State ---
+# Async transports (and the clients built on them) are bound to the event loop
+# that first uses their connections, so they are kept per loop. Callers with no
+# running loop share the `None` slot.
+_lock = threading.RLock()
+_sync_http_client = None
+_loop_state = weakref.WeakKeyDictionary()
+_no_loop_state = {}
+_overrides = {"chat_model": None, "embeddings": None}
+
+
+def _api_key() -> str:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise EnvironmentError("OPENAI_API_KEY environment variable not found. Please set it in your .env file.")
+    return api_key
+
+
+def check_configuration():
+    """
+    Raises EnvironmentError if the OpenAI settings are missing. Called at app
+    startup so a misconfigured worker fails fast without building any client.
+    """
+    _api_key()
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def _current_state() -> dict:
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _no_loop_state
+    state = _loop_state.get(loop)
+    if state is None:
+        state = _loop_state[loop] = {}
+    return state
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Returns the process-wide keep-alive HTTP pool used by all sync OpenAI calls.
+    """
+    global _sync_http_client
+    with _lock:
+        if _sync_http_client is None:
+            _sync_http_client = httpx.Client(timeout=_timeout(), limits=_limits())
+        return _sync_http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Returns the keep-alive HTTP pool for async OpenAI calls on the current event loop.
+    """
+    with _lock:
+        state = _current_state()
+        if "http" not in state:
+            state["http"] = httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+        return state["http"]
+
+
+def get_chat_model(temperature: float = 0.5, max_tokens: int = 1500, model: str | None = None,
+                   streaming: bool = False):
+    """
+    Returns a long-lived ChatOpenAI client for the given settings.
+    """
+    if _overrides["chat_model"] is not None:
+        return _overrides["chat_model"]
+
+    key = ("chat", model or OPENAI_MODEL, temperature, max_tokens, streaming)
+    with _lock:
+        state = _current_state()
+        if key not in state:
+            from langchain_openai import ChatOpenAI
+
+            state[key] = ChatOpenAI(
+                model_name=model or OPENAI_MODEL,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                streaming=streaming,
+                stream_usage=True,  # report token usage on streamed responses too
+                openai_api_key=_api_key(),
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+            )
+        return state[key]
+
+
+def get_embeddings(model: str | None = None, max_retries: int | None = None):
+    """
+    Returns a long-lived OpenAIEmbeddings client. Ingestion paths pass a higher
+    `max_retries` than the interactive default.
+    """
+    if _overrides["embeddings"] is not None:
+        return _overrides["embeddings"]
+
+    retries = OPENAI_MAX_RETRIES if max_retries is None else max_retries
+    key = ("embeddings", model or EMBEDDING_MODEL, retries)
+    with _lock:
+        state = _current_state()
+        if key not in state:
+            from langchain_openai import OpenAIEmbeddings
+
+            state[key] = OpenAIEmbeddings(
+                model=model or EMBEDDING_MODEL,
+                openai_api_key=_api_key(),
+                timeout=_timeout(),
+                max_retries=retries,
+                http_client=get_http_client(),
+                http_async_client=get_async_http_client(),
+            )
+        return state[key]
+
+
+_embeddings_classes = {}
+
+
+def embeddings_class(cls: type) -> type:
+    """
+    `cls` as a subclass of LangChain's Embeddings, created on first use so
+    modules on the app import path do not import langchain_core.
+    """
+    with _lock:
+        if cls not in _embeddings_classes:
+            from langchain_core.embeddings import Embeddings
+            _embeddings_classes[cls] = type(cls.__name__, (cls, Embeddings), {
+                "__module__": cls.__module__, "__qualname__": cls.__qualname__, "__doc__": cls.__doc__})
+        return _embeddings_classes[cls]
+
+
+def get_openai_client():
+    """
+    Returns a raw OpenAI SDK client sharing the same HTTP pool, for calls
+    LangChain does not wrap (e.g. vision annotation).
+    """
+    from openai import OpenAI
+
+    with _lock:
+        if "openai" not in _no_loop_state:
+            _no_loop_state["openai"] = OpenAI(
+                api_key=_api_key(),
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=get_http_client(),
+            )
+        return _no_loop_state["openai"]
+
+
+async def aopen_connection() -> int:
+    """
+    Opens a keep-alive connection to the OpenAI API in this loop's HTTP pool
+    (a GET /models, which costs no tokens) so the first chat turn skips the
+    TCP and TLS handshakes. Returns the response status.
+    """
+    base_url = (os.environ.get("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+    response = await get_async_http_client().get(
+        f"{base_url}/models", headers={"Authorization": f"Bearer {_api_key()}"})
+    return response.status_code
+
+
+# --- Test & Benchmark Hooks ---
+def override(chat_model=None, embeddings=None):
+    """
+    Swaps in local stand-ins (e.g. fake models) for every caller of the registry.
+    Passing None leaves that client unchanged.
+    """
+    with _lock:
+        if chat_model is not None:
+            _overrides["chat_model"] = chat_model
+        if embeddings is not None:
+            _overrides["embeddings"] = embeddings
+
+
+def reset_overrides():
+    with _lock:
+        _overrides["chat_model"] = None
+        _overrides["embeddings"] = None
+
+
+@contextmanager
+def overridden(chat_model=None, embeddings=None):
+    previous = dict(_overrides)
+    override(chat_model=chat_model, embeddings=embeddings)
+    try:
+        yield
+    finally:
+        with _lock:
+            _overrides.update(previous)
+
+
+def close():
+    """
+    Closes the sync HTTP pool. Per-loop async pools are closed with their loop.
+    """
+    global _sync_http_client
+    with _lock:
+        if _sync_http_client is not None:
+            _sync_http_client.close()
+            _sync_http_client = None
+        _no_loop_state.clear()
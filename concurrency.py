@@ -0,0 +1,89 @@
+import os
+import asyncio
+import weakref
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Concurrency Limits ---
+# Chats are served on the event loop; only blocking work (SQLite lookups,
+# Chroma searches, image matching) is pushed to these bounded executors so it
+# cannot starve the loop or exhaust the default thread pool.
+CHAT_MAX_CONCURRENCY = int(os.environ.get("CHAT_MAX_CONCURRENCY", 200))
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("CHAT_QUEUE_TIMEOUT_SECONDS", 30))
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", 8))
+SEARCH_EXECUTOR_WORKERS = int(os.environ.get("SEARCH_EXECUTOR_WORKERS", 16))
+DISCONNECT_POLL_SECONDS = 0.5
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_EXECUTOR_WORKERS, thread_name_prefix="search")
+_chat_semaphores = weakref.WeakKeyDictionary()
+
+
+class ChatCapacityError(Exception):
+    """Raised when no chat slot frees up within CHAT_QUEUE_TIMEOUT_SECONDS."""
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the HTTP client goes away before the response is ready."""
+
+
+async def _run_in(executor, func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_db(func, *args, **kwargs):
+    """Runs a blocking database call on the bounded DB executor."""
+    return await _run_in(_db_executor, func, *args, **kwargs)
+
+
+async def run_search(func, *args, **kwargs):
+    """Runs a blocking vector search (or other CPU/disk-bound lookup) on the search executor."""
+    return await _run_in(_search_executor, func, *args, **kwargs)
+
+
+def _chat_semaphore() -> asyncio.Semaphore:
+    # Semaphores bind to the loop they are first used on, so keep one per loop.
+    loop = asyncio.get_running_loop()
+    semaphore = _chat_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _chat_semaphores[loop] = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+    return semaphore
+
+
+@asynccontextmanager
+async def chat_slot():
+    """
+    Holds one of CHAT_MAX_CONCURRENCY chat slots for the duration of a turn.
+    The slot is released even if the turn is cancelled.
+    """
+    semaphore = _chat_semaphore()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=CHAT_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise ChatCapacityError("The server is at capacity. Please try again shortly.")
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+async def cancel_on_disconnect(request, coro):
+    """
+    Awaits `coro`, cancelling it if the HTTP client disconnects first. Child
+    tasks are cancelled through the normal CancelledError path; blocking calls
+    already running in an executor finish but their results are discarded.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise ClientDisconnectedError()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,220 @@
+import os
+import re
+import json
+from collections import deque
+from dataclasses import dataclass, field
+
+# --- Configuration ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CONDITION_SYNONYMS_PATH = os.environ.get(
+    "CONDITION_SYNONYMS_PATH", os.path.join(APP_DIR, "data", "condition_synonyms.json")
+)
+GENERAL_LABEL = "general health and wellness"
+
+# Each label has "strong" terms, which name the condition outright, and "weak"
+# cues, which hint at it but are too vague to decide on locally (e.g. "sugar"
+# may be about diet rather than diabetes). Malay terms are included since many
+# of our users mix languages. Override with a JSON file of the same shape.
+DEFAULT_SYNONYMS = {
+    "Type 2 Diabetes": {
+        "strong": ["diabetes", "diabetic", "diabetis", "type 2 diabetes", "t2d", "t2dm", "dm2", "blood sugar",
+                   "blood glucose", "hba1c", "a1c", "prediabetes", "pre diabetes", "insulin resistance",
+                   "kencing manis", "diabetes melitus", "gula dalam darah", "paras gula"],
+        "weak": ["sugar", "glucose", "insulin", "gula", "metformin"],
+    },
+    "hypertension": {
+        "strong": ["hypertension", "hypertensive", "high blood pressure", "blood pressure", "high bp", "bp",
+                   "darah tinggi", "tekanan darah tinggi", "tekanan darah"],
+        "weak": ["pressure", "salt", "sodium", "garam", "amlodipine"],
+    },
+    "CKD": {
+        "strong": ["ckd", "chronic kidney disease", "kidney disease", "renal disease", "renal failure",
+                   "kidney failure", "dialysis", "egfr", "penyakit buah pinggang", "buah pinggang", "dialisis"],
+        "weak": ["kidney", "kidneys", "renal", "potassium", "phosphorus", "creatinine", "kalium"],
+    },
+    "high cholesterol": {
+        "strong": ["high cholesterol", "cholesterol", "hypercholesterolemia", "hyperlipidemia", "dyslipidemia",
+                   "ldl", "kolesterol", "kolesterol tinggi", "lemak dalam darah"],
+        "weak": ["triglyceride", "triglycerides", "statin", "statins", "hdl", "lipid", "lipids"],
+    },
+}
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercases and collapses punctuation to single spaces, padded so that
+    patterns only match on whole words.
+    """
+    return " " + " ".join(re.findall(r"[a-z0-9]+", text.lower())) + " "
+
+
+def load_synonyms(path: str = CONDITION_SYNONYMS_PATH) -> dict:
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return DEFAULT_SYNONYMS
+
+
+# --- Aho–Corasick Multi-Pattern Matcher ---
+class AhoCorasick:
+    """
+    Finds every occurrence of a fixed set of patterns in one pass over the text.
+    """
+    def __init__(self, patterns: dict):
+        # patterns: pattern string -> payload
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern, payload in patterns.items():
+            self._add(pattern, payload)
+        self._build()
+
+    def _add(self, pattern: str, payload):
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._output[state].append((pattern, payload))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(char, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find(self, text: str) -> list:
+        """
+        Returns (end_index, pattern, payload) for every match in `text`.
+        """
+        state, matches = 0, []
+        for i, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern, payload in self._output[state]:
+                matches.append((i, pattern, payload))
+        return matches
+
+
+def _within_edit_distance(a: str, b: str, max_distance: int) -> bool:
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent transpositions),
+    abandoning early once every cell in a row exceeds `max_distance`.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return False
+        previous2, previous = previous, current
+    return previous[-1] <= max_distance
+
+
+@dataclass
+class ClassificationResult:
+    label: str
+    ambiguous: bool
+    strong_labels: set = field(default_factory=set)
+    weak_labels: set = field(default_factory=set)
+    matches: list = field(default_factory=list)
+
+
+class ConditionClassifier:
+    """
+    Local classifier for the condition vocabulary. Exact terms are found with
+    an Aho–Corasick automaton; remaining words are checked against single-word
+    strong terms with a small edit distance to absorb common misspellings.
+    """
+    FUZZY_MIN_LENGTH = 5
+
+    def __init__(self, synonyms: dict | None = None):
+        self.synonyms = synonyms or load_synonyms()
+        patterns = {}
+        for label, terms in self.synonyms.items():
+            for kind in ("strong", "weak"):
+                for term in terms.get(kind, []):
+                    key = normalize(term)
+                    # Strong wins when a term is listed under both.
+                    if key not in patterns or kind == "strong":
+                        patterns[key] = (label, kind)
+        self._matcher = AhoCorasick(patterns)
+        self._fuzzy_terms = [
+            (term.strip(), label)
+            for term, (label, kind) in patterns.items()
+            if kind == "strong" and " " not in term.strip() and len(term.strip()) >= self.FUZZY_MIN_LENGTH
+        ]
+        self._exact_words = {term.strip() for term in patterns}
+
+    @property
+    def labels(self) -> list:
+        return list(self.synonyms)
+
+    def _fuzzy_matches(self, text: str) -> list:
+        matches = []
+        for word in set(text.split()):
+            if len(word) < self.FUZZY_MIN_LENGTH or word in self._exact_words:
+                continue
+            max_distance = 2 if len(word) >= 9 else 1
+            for term, label in self._fuzzy_terms:
+                if _within_edit_distance(word, term, max_distance):
+                    matches.append((word, label, "fuzzy"))
+                    break
+        return matches
+
+    def classify(self, text: str) -> ClassificationResult:
+        normalized = normalize(text)
+        matches = [(pattern.strip(), label, kind) for _, pattern, (label, kind) in self._matcher.find(normalized)]
+        matches += self._fuzzy_matches(normalized)
+
+        strong = {label for _, label, kind in matches if kind in ("strong", "fuzzy")}
+        weak = {label for _, label, kind in matches if kind == "weak"} - strong
+
+        if len(strong) == 1:
+            return ClassificationResult(next(iter(strong)), False, strong, weak, matches)
+        if strong or weak:
+            # Several conditions, or only vague cues: let the LLM decide.
+            return ClassificationResult(GENERAL_LABEL, True, strong, weak, matches)
+        return ClassificationResult(GENERAL_LABEL, False, strong, weak, matches)
+
+    def detect(self, text: str) -> set:
+        """
+        Returns the labels named outright in `text` (used to spot a change of condition).
+        """
+        return self.classify(text).strong_labels
+
+
+_classifier = None
+
+def get_classifier() -> ConditionClassifier:
+    global _classifier
+    if _classifier is None:
+        _classifier = ConditionClassifier()
+    return _classifier
+
+
+def to_label(text: str) -> str:
+    """
+    Maps free-form text (e.g. an LLM answer) onto the label vocabulary.
+    """
+    result = get_classifier().classify(text)
+    for _, label, kind in result.matches:
+        if kind != "weak":
+            return label
+    return GENERAL_LABEL
@@ -1,5 +1,7 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Text, DateTime
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 # --- UPDATED IMPORTS ---
@@ -21,9 +23,64 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     hashed_password = Column(String)
 
+# --- Ingestion Job Model ---
+# Uploads are processed in the background (see ingest_jobs.py). Jobs live in
+# the same SQLite database so queued work survives a restart.
+JOB_QUEUED = "queued"
+JOB_PARTITIONING = "partitioning"
+JOB_EMBEDDING = "embedding"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+def _utcnow():
+    # SQLite has no timezone support, so timestamps are stored as naive UTC.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    id = Column(String, primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = Column(String, index=True, nullable=False)
+    filename = Column(String, nullable=False)
+    filepath = Column(String, nullable=False)
+    content_hash = Column(String, index=True, nullable=True)
+    status = Column(String, index=True, default=JOB_QUEUED, nullable=False)
+    chunks_partitioned = Column(Integer, default=0, nullable=False)
+    chunks_embedded = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=_utcnow, nullable=False)
+    updated_at = Column(DateTime, default=_utcnow, onupdate=_utcnow, nullable=False)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "filename": self.filename,
+            "content_hash": self.content_hash,
+            "status": self.status,
+            "chunks_partitioned": self.chunks_partitioned,
+            "chunks_embedded": self.chunks_embedded,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+# --- Tenant Activity Model ---
+# Chat turns per tenant, so a starting worker can pre-open the busiest tenants'
+# stores (see warmup.py). Counts are buffered in memory and added in batches.
+class TenantActivity(Base):
+    __tablename__ = "tenant_activity"
+    user_id = Column(String, primary_key=True)
+    chat_turns = Column(Integer, default=0, nullable=False)
+    last_active_at = Column(DateTime, default=_utcnow, index=True, nullable=False)
+
 # --- Database Creation ---
 def create_db_and_tables():
     Base.metadata.create_all(bind=engine)
+    # create_all does not alter existing tables, so add columns introduced later.
+    job_columns = {column["name"] for column in inspect(engine).get_columns("ingest_jobs")}
+    with engine.begin() as connection:
+        if "content_hash" not in job_columns:
+            connection.execute(text("ALTER TABLE ingest_jobs ADD COLUMN content_hash VARCHAR"))
 
 # --- User Management Functions ---
 def get_user(db_session, username: str):
@@ -47,5 +104,90 @@ def check_login(db_session, username: str, password: str) -> bool:
     # --- UPDATED: Use werkzeug to check password ---
     return check_password_hash(user.hashed_password, password)
 
+# --- Ingestion Job Functions ---
+def create_ingest_job(db_session, user_id: str, filename: str, filepath: str, job_id: str | None = None,
+                      content_hash: str | None = None):
+    job = IngestJob(id=job_id or uuid.uuid4().hex, user_id=user_id, filename=filename, filepath=filepath,
+                    content_hash=content_hash)
+    db_session.add(job)
+    db_session.commit()
+    db_session.refresh(job)
+    return job
+
+def get_ingest_job(db_session, job_id: str):
+    return db_session.query(IngestJob).filter(IngestJob.id == job_id).first()
+
+def find_active_ingest_job(db_session, user_id: str, content_hash: str):
+    """Returns a job for the same tenant and content that is still queued or running."""
+    return (
+        db_session.query(IngestJob)
+        .filter(
+            IngestJob.user_id == user_id,
+            IngestJob.content_hash == content_hash,
+            IngestJob.status.in_((JOB_QUEUED, JOB_PARTITIONING, JOB_EMBEDDING)),
+        )
+        .first()
+    )
+
+def update_ingest_job(db_session, job_id: str, **fields):
+    db_session.query(IngestJob).filter(IngestJob.id == job_id).update({**fields, "updated_at": _utcnow()})
+    db_session.commit()
+
+def claim_ingest_job(db_session, job_id: str) -> bool:
+    """Atomically moves a queued job to partitioning. Returns False if another worker got it first."""
+    claimed = (
+        db_session.query(IngestJob)
+        .filter(IngestJob.id == job_id, IngestJob.status == JOB_QUEUED)
+        .update({"status": JOB_PARTITIONING, "updated_at": _utcnow()})
+    )
+    db_session.commit()
+    return claimed == 1
+
+def requeue_stale_ingest_jobs(db_session, stale_after_seconds: float) -> int:
+    """Puts in-progress jobs that stopped reporting progress (e.g. after a crash) back in the queue."""
+    cutoff = _utcnow() - timedelta(seconds=stale_after_seconds)
+    requeued = (
+        db_session.query(IngestJob)
+        .filter(IngestJob.status.in_((JOB_PARTITIONING, JOB_EMBEDDING)), IngestJob.updated_at < cutoff)
+        .update({"status": JOB_QUEUED, "updated_at": _utcnow()}, synchronize_session=False)
+    )
+    db_session.commit()
+    return requeued
+
+def list_queued_ingest_job_ids(db_session) -> list:
+    rows = (
+        db_session.query(IngestJob.id)
+        .filter(IngestJob.status == JOB_QUEUED)
+        .order_by(IngestJob.created_at)
+        .all()
+    )
+    return [row[0] for row in rows]
+
+# --- Tenant Activity Functions ---
+def add_tenant_activity(db_session, turns_by_user: dict):
+    """Adds buffered chat-turn counts ({user_id: turns}) in one transaction."""
+    now = _utcnow()
+    for user_id, turns in turns_by_user.items():
+        updated = (
+            db_session.query(TenantActivity)
+            .filter(TenantActivity.user_id == user_id)
+            .update({"chat_turns": TenantActivity.chat_turns + turns, "last_active_at": now})
+        )
+        if not updated:
+            db_session.add(TenantActivity(user_id=user_id, chat_turns=turns, last_active_at=now))
+    db_session.commit()
+
+def most_active_tenants(db_session, limit: int, active_since_days: float) -> list:
+    """Ids of the tenants with the most chat turns among those active in the last `active_since_days`."""
+    cutoff = _utcnow() - timedelta(days=active_since_days)
+    rows = (
+        db_session.query(TenantActivity.user_id)
+        .filter(TenantActivity.last_active_at >= cutoff)
+        .order_by(TenantActivity.chat_turns.desc(), TenantActivity.last_active_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [row[0] for row in rows]
+
 # --- Initial Database Creation ---
 create_db_and_tables()
\ No newline at end of file
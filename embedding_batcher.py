@@ -0,0 +1,147 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# --- Batching Configuration ---
+# Concurrent chats each need one query embedding. Instead of one HTTP call per
+# chat, queries arriving within QUERY_EMBED_MAX_WAIT_MS of each other are sent
+# as a single batched request and the vectors fanned back out.
+QUERY_EMBED_BATCHING = os.environ.get("QUERY_EMBED_BATCHING", "true").lower() in ("1", "true", "yes")
+QUERY_EMBED_MAX_WAIT_MS = float(os.environ.get("QUERY_EMBED_MAX_WAIT_MS", 5))
+QUERY_EMBED_MAX_BATCH_SIZE = int(os.environ.get("QUERY_EMBED_MAX_BATCH_SIZE", 64))
+QUERY_EMBED_MAX_IN_FLIGHT = int(os.environ.get("QUERY_EMBED_MAX_IN_FLIGHT", 4))
+
+
+class EmbeddingBatcher:
+    """
+    Collects single-text embedding requests on a background thread and sends
+    them in batches of up to `max_batch_size`, waiting at most `max_wait_ms`
+    after the first request of a batch. Up to `max_in_flight` batches are sent
+    concurrently, so collection continues while a request is outstanding.
+
+    `get_embeddings` returns the embeddings client to use for each batch; it is
+    looked up per batch so test/benchmark overrides in `clients` apply.
+    """
+    def __init__(self, get_embeddings, max_wait_ms: float = QUERY_EMBED_MAX_WAIT_MS,
+                 max_batch_size: int = QUERY_EMBED_MAX_BATCH_SIZE, max_in_flight: int = QUERY_EMBED_MAX_IN_FLIGHT):
+        self.get_embeddings = get_embeddings
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._pending = queue.Queue()
+        self._dispatcher = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed-batch")
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._stats_lock = threading.Lock()
+        self._stats = {"queries": 0, "batches": 0, "unique_texts": 0, "errors": 0, "queue_wait_ms": 0.0}
+        self._collector = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._collector.start()
+
+    def submit(self, text: str) -> Future:
+        future = Future()
+        self._pending.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> list:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> list:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect(self):
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._in_flight.acquire()
+            self._dispatcher.submit(self._send, batch)
+
+    def _send(self, batch: list):
+        try:
+            sent_at = time.perf_counter()
+            texts = list(dict.fromkeys(text for text, _, _ in batch))  # identical queries share one input
+            try:
+                vectors = dict(zip(texts, self.get_embeddings().embed_documents(texts)))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                return
+            for text, future, _ in batch:
+                future.set_result(vectors[text])
+            with self._stats_lock:
+                self._stats["queries"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["unique_texts"] += len(texts)
+                self._stats["queue_wait_ms"] += sum((sent_at - queued) * 1000 for _, _, queued in batch)
+        finally:
+            self._in_flight.release()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        queries, batches = stats["queries"], stats["batches"]
+        stats["mean_batch_size"] = round(queries / batches, 2) if batches else 0.0
+        stats["mean_queue_wait_ms"] = round(stats.pop("queue_wait_ms") / queries, 2) if queries else 0.0
+        stats["requests_saved"] = queries - batches
+        stats["max_wait_ms"] = self.max_wait * 1000
+        return stats
+
+
+class BatchedEmbeddings:
+    """
+    Embeddings whose query calls go through an EmbeddingBatcher. Query and
+    document embeddings are the same call for OpenAI models, so a batch of
+    queries is sent as one embed_documents request. Document calls pass
+    straight through. Instances are created through `clients.embeddings_class`.
+    """
+    def __init__(self, batcher: EmbeddingBatcher):
+        self.batcher = batcher
+
+    def embed_documents(self, texts: list) -> list:
+        return self.batcher.get_embeddings().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list:
+        return self.batcher.embed(text)
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.batcher.aembed(text)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            import clients
+            _batcher = EmbeddingBatcher(clients.get_embeddings)
+        return _batcher
+
+
+def get_query_embeddings():
+    """
+    Embeddings for query-time use (retrievers and the RAG pipeline): batched
+    across concurrent requests unless QUERY_EMBED_BATCHING is off.
+    """
+    import clients
+    if not QUERY_EMBED_BATCHING:
+        return clients.get_embeddings()
+    return clients.embeddings_class(BatchedEmbeddings)(get_batcher())
+
+
+def get_stats() -> dict:
+    if _batcher is None:
+        return {"enabled": QUERY_EMBED_BATCHING}
+    return {"enabled": QUERY_EMBED_BATCHING, **_batcher.stats()}
@@ -0,0 +1,209 @@
+import os
+import math
+import time
+import sqlite3
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from hashing import text_hash
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- UNIFIED PATH CONFIGURATION ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
+PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
+
+# --- Cache Configuration ---
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(PERSISTENT_DISK_PATH, "embedding_cache.sqlite"))
+EMBEDDING_CACHE_MAX_MB = float(os.environ.get("EMBEDDING_CACHE_MAX_MB", 2048))
+# float16 halves the footprint; the rounding is far below what affects retrieval.
+EMBEDDING_CACHE_DTYPE = os.environ.get("EMBEDDING_CACHE_DTYPE", "float32")
+SQLITE_MAX_VARIABLES = 500
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache keyed by (model name, SHA-256 of the normalized
+    text). Vectors are stored as raw float16/float32 blobs in SQLite and the
+    least recently used rows are evicted once the cache exceeds its size budget.
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_mb: float = EMBEDDING_CACHE_MAX_MB,
+                 dtype: str = EMBEDDING_CACHE_DTYPE):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: list) -> dict:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), SQLITE_MAX_VARIABLES):
+                batch = hashes[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, dtype, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for h, dtype, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+                if rows:
+                    hit_hashes = [r[0] for r in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({','.join('?' * len(hit_hashes))})",
+                        [now, model, *hit_hashes],
+                    )
+            self._conn.commit()
+        return found
+
+    def put_many(self, model: str, vectors: dict):
+        now = time.time()
+        rows = [
+            (model, h, self.dtype.name, np.asarray(v, dtype=self.dtype).tobytes(), now)
+            for h, v in vectors.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dtype, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._evict_if_needed()
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._size_bytes()
+
+    def _size_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def _evict_if_needed(self):
+        size = self._size_bytes()
+        if size <= self.max_bytes:
+            return
+        # Evict down to 90% of the budget so we do not evict on every insert.
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for model, h, length in self._conn.execute(
+            "SELECT model, text_hash, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        ).fetchall():
+            if size <= target:
+                break
+            self._conn.execute("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", (model, h))
+            size -= length
+            evicted += 1
+        self._conn.commit()
+        print(f"Embedding cache: evicted {evicted} least recently used vectors.")
+
+
+class CachedEmbeddings:
+    """
+    Wraps an embeddings client so that document embeddings are served from the
+    EmbeddingCache when available. Query embeddings pass straight through.
+    Instances are created through `clients.embeddings_class`.
+    """
+    def __init__(self, underlying, cache: EmbeddingCache | None = None, model: str | None = None):
+        self.underlying = underlying
+        self.cache = cache or get_cache()
+        self.model = model or getattr(underlying, "model", type(underlying).__name__)
+        self.stats = {"chunks": 0, "cache_hits": 0, "chunks_embedded": 0, "requests": 0, "requests_saved": 0}
+        self._busy_seconds = 0.0
+
+    def embed_documents(self, texts: list) -> list:
+        start = time.perf_counter()
+        try:
+            return self._embed_documents(texts)
+        finally:
+            self._busy_seconds += time.perf_counter() - start
+
+    def _embed_documents(self, texts: list) -> list:
+        hashes = [text_hash(t) for t in texts]
+        vectors = self.cache.get_many(self.model, list(set(hashes)))
+
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in vectors and h not in missing:
+                missing[h] = t
+
+        # The client sends at most `chunk_size` inputs per API request.
+        per_request = getattr(self.underlying, "chunk_size", 1000) or 1000
+        requests_needed = math.ceil(len(missing) / per_request)
+        self.stats["chunks"] += len(texts)
+        self.stats["cache_hits"] += sum(1 for h in hashes if h in vectors)
+        self.stats["requests"] += requests_needed
+        self.stats["requests_saved"] += math.ceil(len(set(hashes)) / per_request) - requests_needed
+        if missing:
+            embedded = self.underlying.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing.keys(), embedded))
+            self.cache.put_many(self.model, new_vectors)
+            vectors.update(new_vectors)
+            self.stats["chunks_embedded"] += len(missing)
+        return [vectors[h] for h in hashes]
+
+    def embed_query(self, text: str) -> list:
+        return self.underlying.embed_query(text)
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.underlying.aembed_query(text)
+
+    def report(self, label: str = "Ingest") -> dict:
+        chunks = self.stats["chunks"]
+        hit_rate = self.stats["cache_hits"] / chunks if chunks else 0.0
+        chunks_per_second = chunks / self._busy_seconds if self._busy_seconds else 0.0
+        print(f"{label} embedding cache: {self.stats['cache_hits']}/{chunks} chunks served from cache "
+              f"({hit_rate:.0%} hit rate), {self.stats['chunks_embedded']} embedded via the API, "
+              f"{self.stats['requests_saved']} API calls saved.")
+        result = {**self.stats, "hit_rate": round(hit_rate, 4), "chunks_per_second": round(chunks_per_second, 2)}
+        if hasattr(self.underlying, "throughput"):
+            scheduler = self.underlying.throughput()
+            print(f"{label} embedding throughput: {chunks_per_second:.1f} chunks/s overall, "
+                  f"{scheduler['chunks_per_second']:.1f} chunks/s via the API "
+                  f"({scheduler['requests']} requests, {scheduler['rate_limited']} rate limited, "
+                  f"{scheduler['transient_errors']} retried after errors, {scheduler['throttled_seconds']:.1f}s throttled).")
+            result["scheduler"] = scheduler
+        return result
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+def cached_embeddings(max_retries: int = 10) -> CachedEmbeddings:
+    """
+    Returns a fresh cache-backed embeddings wrapper for one ingest run, so its
+    stats describe that run only. Cache misses go through the rate-limited
+    embedding scheduler, which owns retries of 429s, 5xx responses, timeouts
+    and connection errors (`max_retries` attempts per batch), so the
+    underlying client is built without its own retries. The client,
+    rate limits and cache are shared.
+    """
+    import clients
+    from embedding_scheduler import RateLimitedEmbeddings
+    underlying = RateLimitedEmbeddings(clients.get_embeddings(max_retries=0), max_attempts=max_retries)
+    return clients.embeddings_class(CachedEmbeddings)(underlying)
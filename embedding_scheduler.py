@@ -0,0 +1,230 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- Scheduler Configuration ---
+# Limits are per process and shared by every ingestion path in it; set them a
+# little below the account's OpenAI limits for the embedding model.
+EMBED_RPM_LIMIT = int(os.environ.get("EMBED_RPM_LIMIT", 3000))
+EMBED_TPM_LIMIT = int(os.environ.get("EMBED_TPM_LIMIT", 1_000_000))
+EMBED_MAX_CONCURRENT_BATCHES = int(os.environ.get("EMBED_MAX_CONCURRENT_BATCHES", 4))
+EMBED_MAX_BATCH_TOKENS = int(os.environ.get("EMBED_MAX_BATCH_TOKENS", 100_000))
+EMBED_MAX_BATCH_INPUTS = int(os.environ.get("EMBED_MAX_BATCH_INPUTS", 1000))
+EMBED_MAX_BACKOFF_SECONDS = float(os.environ.get("EMBED_MAX_BACKOFF_SECONDS", 60))
+
+# Loading the tokenizer reads (and on first use downloads) its BPE file, so it
+# happens on the first count rather than at import. False means unavailable.
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count for the embedding models; a ~4 chars/token estimate if tiktoken is missing."""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `per_minute` / 60 per
+    second, holding at most one minute's worth.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float) -> float:
+        """Blocks until `amount` is available, takes it and returns the seconds waited."""
+        # A single request larger than the bucket still goes through after a full refill.
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._available >= amount:
+                    self._available -= amount
+                    return waited
+                delay = (amount - self._available) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def drain(self):
+        """Empties the bucket, e.g. after the API reported the limit was hit anyway."""
+        with self._lock:
+            self._available = 0.0
+            self._updated = time.monotonic()
+
+
+class RateLimiter:
+    """Requests/min and tokens/min buckets plus a shared cooldown after 429s."""
+    def __init__(self, rpm: int = EMBED_RPM_LIMIT, tpm: int = EMBED_TPM_LIMIT):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> float:
+        waited = 0.0
+        with self._lock:
+            cooldown = self._cooldown_until - time.monotonic()
+        if cooldown > 0:
+            time.sleep(cooldown)
+            waited += cooldown
+        waited += self.requests.acquire(1)
+        waited += self.tokens.acquire(tokens)
+        return waited
+
+    def backoff(self, seconds: float):
+        """Pauses every caller for `seconds` and drops the buffered budget."""
+        with self._lock:
+            self._cooldown_until = max(self._cooldown_until, time.monotonic() + seconds)
+        self.requests.drain()
+        self.tokens.drain()
+
+
+def _retry_after_seconds(error) -> float | None:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Bulk embedding front end. Splits document lists into batches sized by
+    token count, sends up to EMBED_MAX_CONCURRENT_BATCHES of them at once
+    within the shared rate limits, and handles 429s itself with a backoff
+    shared across all in-flight batches. Connection errors, timeouts and 5xx
+    responses are retried per batch with the same exponential backoff. The
+    wrapped client should be built with max_retries=0 so these errors reach
+    the scheduler.
+    """
+    def __init__(self, underlying: Embeddings, limiter: "RateLimiter | None" = None, max_attempts: int = 10,
+                 max_concurrency: int = EMBED_MAX_CONCURRENT_BATCHES, max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                 max_batch_inputs: int = EMBED_MAX_BATCH_INPUTS):
+        self.underlying = underlying
+        self.model = getattr(underlying, "model", type(underlying).__name__)
+        self.limiter = limiter or get_limiter()
+        self.max_attempts = max_attempts
+        self.max_concurrency = max_concurrency
+        # Keep concurrent batches inside one minute's token budget.
+        self.max_batch_tokens = max(1, min(max_batch_tokens, self.limiter.tokens.capacity // max(1, max_concurrency)))
+        self.max_batch_inputs = min(max_batch_inputs, getattr(underlying, "chunk_size", max_batch_inputs) or max_batch_inputs)
+        self._stats_lock = threading.Lock()
+        self.stats = {"chunks": 0, "tokens": 0, "requests": 0, "rate_limited": 0, "transient_errors": 0,
+                      "throttled_seconds": 0.0, "busy_seconds": 0.0}
+
+    @property
+    def chunk_size(self) -> int:
+        return self.max_batch_inputs
+
+    def _batches(self, texts: list) -> list:
+        """Returns [(start, end, tokens)] spans of `texts`, each within the batch token and input caps."""
+        batches, start, tokens = [], 0, 0
+        for i, text in enumerate(texts):
+            n = count_tokens(text)
+            if i > start and (tokens + n > self.max_batch_tokens or i - start >= self.max_batch_inputs):
+                batches.append((start, i, tokens))
+                start, tokens = i, 0
+            tokens += n
+        if start < len(texts):
+            batches.append((start, len(texts), tokens))
+        return batches
+
+    def _record(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def _embed_batch(self, texts: list, tokens: int) -> list:
+        import openai
+
+        for attempt in range(1, self.max_attempts + 1):
+            self._record(throttled_seconds=self.limiter.acquire(tokens))
+            try:
+                vectors = self.underlying.embed_documents(texts)
+                self._record(requests=1)
+                return vectors
+            except openai.RateLimitError as e:
+                if attempt == self.max_attempts:
+                    raise
+                delay = _retry_after_seconds(e) or min(EMBED_MAX_BACKOFF_SECONDS, 2 ** attempt)
+                delay *= 0.5 + random.random() / 2
+                self._record(requests=1, rate_limited=1)
+                print(f"Embedding rate limited (attempt {attempt}/{self.max_attempts}); backing off {delay:.1f}s.")
+                self.limiter.backoff(delay)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                # Connection errors, timeouts (a subclass) and 5xx only affect
+                # this batch, so it backs off alone instead of pausing everyone.
+                if attempt == self.max_attempts:
+                    raise
+                delay = min(EMBED_MAX_BACKOFF_SECONDS, 2 ** attempt) * (0.5 + random.random() / 2)
+                self._record(requests=1, transient_errors=1)
+                print(f"Embedding request failed with {type(e).__name__} "
+                      f"(attempt {attempt}/{self.max_attempts}); retrying in {delay:.1f}s.")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = self._batches(texts)
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches)),
+                                thread_name_prefix="embed") as executor:
+            futures = [executor.submit(self._embed_batch, texts[i:j], tokens) for i, j, tokens in batches]
+            results = [future.result() for future in futures]
+        self._record(chunks=len(texts), tokens=sum(tokens for _, _, tokens in batches),
+                     busy_seconds=time.perf_counter() - start)
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> list:
+        return self._embed_batch([text], count_tokens(text))[0]
+
+    async def aembed_query(self, text: str) -> list:
+        return await self.underlying.aembed_query(text)
+
+    def throughput(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        busy = stats["busy_seconds"]
+        stats["chunks_per_second"] = round(stats["chunks"] / busy, 2) if busy else 0.0
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 2)
+        stats["busy_seconds"] = round(busy, 2)
+        return stats
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
@@ -0,0 +1,60 @@
+import hashlib
+import unicodedata
+
+# --- Content Hashing ---
+# One place for the hashes that identify content across ingestion: file
+# hashes for change detection and deduplication, text hashes for the
+# embedding cache, and stable chunk ids for the vector stores.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes chunk text before hashing so cosmetic differences (Unicode
+    composition, whitespace runs) do not change the hash.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def copy_and_hash(src, dst_path: str) -> str:
+    """
+    Copies the file-like `src` to `dst_path` block by block and returns the
+    SHA-256 of the content, so the upload is hashed without a second read.
+    """
+    digest = hashlib.sha256()
+    with open(dst_path, "wb") as out:
+        while True:
+            block = src.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest()
+
+
+def chunk_ids(source: str, texts: list) -> list:
+    """
+    Stable ids for the chunks of one source document, derived from the source
+    name and each chunk's normalized text. Identical chunks within the same
+    document are told apart by their occurrence number.
+    """
+    seen = {}
+    ids = []
+    for text in texts:
+        content = text_hash(text)
+        occurrence = seen.get(content, 0)
+        seen[content] = occurrence + 1
+        ids.append(hashlib.sha256(f"{source}\0{content}\0{occurrence}".encode("utf-8")).hexdigest()[:32])
+    return ids
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+import numpy as np
+import image_index
+
+# --- Configuration ---
+ANNOTATION_MATRIX_FILE = os.path.join("data", "image_annotations.npy")
+ANNOTATION_FILENAMES_FILE = os.path.join("data", "image_annotations.filenames.json")
+# "keyword" (BM25 only), "embedding" (cosine only), "hybrid" (weighted blend),
+# or "auto": hybrid when the matrix has been built, keyword otherwise.
+IMAGE_MATCH_MODE = os.environ.get("IMAGE_MATCH_MODE", "auto")
+IMAGE_HYBRID_ALPHA = float(os.environ.get("IMAGE_HYBRID_ALPHA", 0.7))
+IMAGE_MATCH_MIN_SCORE = float(os.environ.get("IMAGE_MATCH_MIN_SCORE", 0.35))
+BUILD_BATCH_SIZE = 256
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder (feature-hashed bag of stemmed tokens) for
+    tests, benchmarks and offline builds. Exposes the same two methods as
+    LangChain embeddings.
+    """
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def embed_query(self, text: str) -> list:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in image_index.tokenize(text):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        return [self.embed_query(text) for text in texts]
+
+
+def _default_embedder():
+    import clients
+    return clients.get_embeddings()
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+# --- Offline Build ---
+def build_annotation_matrix(embedder=None, annotation_file: str = image_index.ANNOTATION_FILE,
+                            matrix_file: str = ANNOTATION_MATRIX_FILE,
+                            filenames_file: str = ANNOTATION_FILENAMES_FILE) -> int:
+    """
+    Embeds every annotated description into a row-normalized float32 matrix
+    saved as .npy, with the row -> filename mapping in a JSON sidecar.
+    Both files are written to temporaries and renamed into place.
+    """
+    embedder = embedder or _default_embedder()
+    annotations = [a for a in image_index.load_annotations(annotation_file)
+                   if a.get('filename') and a.get('description', '').strip()]
+    if not annotations:
+        print("No annotated images found. Nothing to embed.")
+        return 0
+
+    vectors = []
+    for i in range(0, len(annotations), BUILD_BATCH_SIZE):
+        batch = annotations[i:i + BUILD_BATCH_SIZE]
+        vectors.extend(embedder.embed_documents([a['description'] for a in batch]))
+        print(f"Embedded {min(i + BUILD_BATCH_SIZE, len(annotations))}/{len(annotations)} descriptions.")
+
+    matrix = np.ascontiguousarray(_normalize_rows(np.asarray(vectors, dtype=np.float32)))
+    sidecar = {
+        "filenames": [a['filename'] for a in annotations],
+        "dim": int(matrix.shape[1]),
+        "embedder": getattr(embedder, "model", type(embedder).__name__),
+    }
+
+    tmp_matrix, tmp_sidecar = matrix_file + ".tmp.npy", filenames_file + ".tmp"
+    np.save(tmp_matrix, matrix)
+    with open(tmp_sidecar, 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f)
+    os.replace(tmp_sidecar, filenames_file)
+    os.replace(tmp_matrix, matrix_file)
+    print(f"✅ Saved {matrix.shape[0]}x{matrix.shape[1]} annotation matrix to '{matrix_file}'.")
+    return matrix.shape[0]
+
+
+# --- Query Time ---
+class AnnotationMatrix:
+    """
+    Memory-mapped annotation matrix. Scoring a query is one matrix-vector product.
+    """
+    def __init__(self, matrix_file: str = ANNOTATION_MATRIX_FILE,
+                 filenames_file: str = ANNOTATION_FILENAMES_FILE):
+        self.matrix = np.load(matrix_file, mmap_mode='r')
+        with open(filenames_file, 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+        self.filenames = sidecar["filenames"]
+        if len(self.filenames) != self.matrix.shape[0]:
+            raise ValueError("Annotation matrix and filename sidecar are out of sync. Rebuild the matrix.")
+        self.rows = {filename: i for i, filename in enumerate(self.filenames)}
+        self.embedder_name = sidecar.get("embedder")
+
+    def similarities(self, query_vector) -> np.ndarray:
+        q = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return np.zeros(len(self.filenames), dtype=np.float32)
+        return self.matrix @ (q / norm)
+
+    def best(self, query_vector) -> tuple:
+        scores = self.similarities(query_vector)
+        i = int(np.argmax(scores))
+        return self.filenames[i], float(scores[i])
+
+
+_embedder = None
+_matrix = None
+_matrix_mtime = None
+_last_check = 0.0
+_lock = threading.Lock()
+_coverage = (None, None, set())  # (matrix, index, uncovered doc ids)
+
+
+def set_embedder(embedder):
+    """
+    Replaces the query-time embedder (anything with `embed_query`).
+    """
+    global _embedder
+    _embedder = embedder
+
+
+def get_matrix() -> AnnotationMatrix | None:
+    global _matrix, _matrix_mtime, _last_check
+    now = time.monotonic()
+    if now - _last_check < image_index.ANNOTATION_RELOAD_CHECK_SECONDS:
+        return _matrix
+    with _lock:
+        _last_check = now
+        try:
+            mtime = os.path.getmtime(ANNOTATION_MATRIX_FILE)
+        except OSError:
+            _matrix, _matrix_mtime = None, None
+            return None
+        if mtime != _matrix_mtime:
+            try:
+                _matrix, _matrix_mtime = AnnotationMatrix(), mtime
+            except Exception as e:
+                print(f"Could not load annotation matrix: {e}")
+                _matrix, _matrix_mtime = None, mtime
+        return _matrix
+
+
+def _query_embedder(matrix: AnnotationMatrix):
+    if _embedder is not None:
+        return _embedder
+    # A matrix built offline with --local must be queried with the same embedder.
+    if matrix.embedder_name == HashingEmbedder.__name__:
+        return HashingEmbedder(matrix.matrix.shape[1])
+    return _default_embedder()
+
+
+def _match_mode(matrix) -> str:
+    if IMAGE_MATCH_MODE == "auto":
+        return "hybrid" if matrix is not None else "keyword"
+    if IMAGE_MATCH_MODE in ("embedding", "hybrid") and matrix is None:
+        return "keyword"
+    return IMAGE_MATCH_MODE
+
+
+def _uncovered_images(matrix: AnnotationMatrix, index) -> set:
+    """
+    Doc ids of annotated images with no matrix row (added to the CSV after
+    the matrix was built). Computed once per matrix/index pair.
+    """
+    global _coverage
+    if _coverage[0] is not matrix or _coverage[1] is not index:
+        uncovered = {doc_id for doc_id, filename in enumerate(index.filenames) if filename not in matrix.rows}
+        if uncovered:
+            print(f"{len(uncovered)} annotated images are missing from the annotation matrix and are only matched "
+                  f"by keyword, when no embedded image matches, until it is rebuilt (python image_embeddings.py).")
+        _coverage = (matrix, index, uncovered)
+    return _coverage[2]
+
+
+def find_best_image(query: str) -> str | None:
+    """
+    Returns the filename of the best matching image, or None.
+    """
+    matrix = get_matrix()
+    mode = _match_mode(matrix)
+    if mode == "keyword":
+        matches = image_index.search(query, k=1)
+        return matches[0][0] if matches else None
+
+    similarities = matrix.similarities(_query_embedder(matrix).embed_query(query))
+    # Best image the matrix does not cover, by BM25 alone (hybrid mode only).
+    fallback_filename, fallback_score = None, 0.0
+    if mode == "hybrid":
+        index = image_index.get_index()
+        uncovered = _uncovered_images(matrix, index)
+        raw_scores = index.scores(query)
+        top_score = max(raw_scores.values(), default=0.0)
+        keyword_scores = np.zeros_like(similarities)
+        for doc_id, score in raw_scores.items():
+            score = score / top_score if top_score > 0 else 0.0
+            if doc_id in uncovered:
+                if score > fallback_score:
+                    fallback_filename, fallback_score = index.filenames[doc_id], score
+                continue
+            row = matrix.rows.get(index.filenames[doc_id])
+            if row is not None:
+                keyword_scores[row] = score
+        similarities = IMAGE_HYBRID_ALPHA * similarities + (1 - IMAGE_HYBRID_ALPHA) * keyword_scores
+
+    best = int(np.argmax(similarities))
+    if similarities[best] >= IMAGE_MATCH_MIN_SCORE:
+        return matrix.filenames[best]
+    # Keyword-only scores are not on the blended scale, so an uncovered image
+    # is only used when no embedded image is a good enough match.
+    if fallback_score >= IMAGE_MATCH_MIN_SCORE:
+        return fallback_filename
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the embedding matrix for image annotations.")
+    parser.add_argument("--local", action="store_true",
+                        help="Use the deterministic local HashingEmbedder instead of the embedding API")
+    args = parser.parse_args()
+    built = build_annotation_matrix(HashingEmbedder() if args.local else None)
+    sys.exit(0 if built else 1)
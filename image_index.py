@@ -0,0 +1,148 @@
+import os
+import re
+import csv
+import math
+import time
+import threading
+from collections import Counter, defaultdict
+
+# --- Configuration ---
+ANNOTATION_FILE = os.path.join("data", "image_annotations.csv")
+IMAGE_DIR = os.path.join("data", "images")
+# How often (at most) the CSV's mtime is checked for changes.
+ANNOTATION_RELOAD_CHECK_SECONDS = float(os.environ.get("ANNOTATION_RELOAD_CHECK_SECONDS", 2))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOP_WORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'with', 'and', 'or', 'for', 'to', 'is', 'are', 'single',
+    'photo', 'image', 'picture', 'bowl', 'plate', 'serving', 'portion', 'size', 'approx', 'about',
+}
+
+
+def stem(token: str) -> str:
+    """
+    Light suffix folding so that plurals and simple verb forms share a term
+    ("tomatoes" / "tomato", "sliced" / "slice", "glasses" / "glass").
+    """
+    if len(token) > 4 and token.endswith("ies"):
+        token = token[:-3] + "y"
+    elif len(token) > 4 and token.endswith(("sses", "shes", "ches", "xes", "zes")):
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        token = token[:-1]
+    if len(token) > 5 and token.endswith("ing"):
+        token = token[:-3]
+    elif len(token) > 4 and token.endswith("ed"):
+        token = token[:-2]
+    if len(token) > 3 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list:
+    return [stem(t) for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOP_WORDS]
+
+
+def load_annotations(path: str = ANNOTATION_FILE) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        return [row for row in csv.DictReader(f)]
+
+
+class AnnotationIndex:
+    """
+    Inverted index over image descriptions, scored with BM25.
+    """
+    def __init__(self, annotations: list):
+        self.filenames = []
+        self.doc_lengths = []
+        self.postings = defaultdict(list)  # term -> [(doc_id, term_frequency)]
+
+        for annotation in annotations:
+            filename = annotation.get('filename')
+            if not filename:
+                continue
+            doc_id = len(self.filenames)
+            terms = tokenize(annotation.get('description', ''))
+            self.filenames.append(filename)
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings[term].append((doc_id, tf))
+
+        n = len(self.filenames)
+        self.avg_doc_length = (sum(self.doc_lengths) / n) if n else 0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def scores(self, query: str) -> dict:
+        """
+        Returns {doc_id: bm25_score} for every document sharing a term with the query.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / (self.avg_doc_length or 1))
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, k: int = 5) -> list:
+        """
+        Returns up to k (filename, score) pairs, best first.
+        """
+        scores = self.scores(query)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.filenames[doc_id], score) for doc_id, score in best]
+
+
+# --- Shared Index with Hot Reload ---
+# The index is rebuilt off to the side and swapped in with a single reference
+# assignment, so searches never see a half-built index.
+_index = None
+_index_mtime = None
+_last_check = 0.0
+_rebuild_lock = threading.Lock()
+
+
+def _annotation_mtime():
+    try:
+        return os.path.getmtime(ANNOTATION_FILE)
+    except OSError:
+        return None
+
+
+def get_index() -> AnnotationIndex:
+    global _index, _index_mtime, _last_check
+    now = time.monotonic()
+    if _index is not None and now - _last_check < ANNOTATION_RELOAD_CHECK_SECONDS:
+        return _index
+
+    _last_check = now
+    mtime = _annotation_mtime()
+    if _index is not None and mtime == _index_mtime:
+        return _index
+
+    # Only one thread rebuilds; the others keep serving the previous index.
+    if not _rebuild_lock.acquire(blocking=_index is None):
+        return _index
+    try:
+        if _index is None or mtime != _index_mtime:
+            new_index = AnnotationIndex(load_annotations())
+            _index, _index_mtime = new_index, mtime
+            print(f"Loaded image annotation index with {len(new_index)} images.")
+    finally:
+        _rebuild_lock.release()
+    return _index
+
+
+def search(query: str, k: int = 5) -> list:
+    return get_index().search(query, k)
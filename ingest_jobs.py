@@ -0,0 +1,246 @@
+import os
+import uuid
+import functools
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dotenv import load_dotenv
+import database as db
+import concurrency
+import upload_manifest
+import metrics
+from hashing import copy_and_hash
+from process_user_docs import partition_document, add_user_chunks
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- UNIFIED PATH CONFIGURATION ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
+PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
+UPLOADS_DIR = os.path.join(PERSISTENT_DISK_PATH, "uploads")
+
+# --- Queue Configuration ---
+# Partitioning (unstructured) is CPU-bound and runs in a process pool; the
+# embedding/write step is network-bound and runs on a small thread pool so it
+# never blocks the event loop that serves chats.
+INGEST_PARTITION_WORKERS = int(os.environ.get("INGEST_PARTITION_WORKERS", 2))
+INGEST_MAX_CONCURRENT_JOBS = int(os.environ.get("INGEST_MAX_CONCURRENT_JOBS", 2))
+INGEST_QUEUE_MAX_SIZE = int(os.environ.get("INGEST_QUEUE_MAX_SIZE", 1000))
+# In-progress jobs with no progress update for this long are assumed to belong
+# to a dead worker and are queued again by the periodic sweep.
+INGEST_STALE_JOB_SECONDS = float(os.environ.get("INGEST_STALE_JOB_SECONDS", 900))
+INGEST_SWEEP_INTERVAL_SECONDS = float(os.environ.get("INGEST_SWEEP_INTERVAL_SECONDS", 60))
+# A running job refreshes its updated_at this often, so a slow step (e.g.
+# partitioning a large document) is never mistaken for a dead worker's job.
+INGEST_HEARTBEAT_SECONDS = INGEST_STALE_JOB_SECONDS / 3
+
+_partition_pool = None
+_embed_executor = ThreadPoolExecutor(max_workers=INGEST_MAX_CONCURRENT_JOBS, thread_name_prefix="ingest")
+_queue = None
+_enqueued = set()
+_workers = []
+
+
+class IngestQueueFullError(Exception):
+    """Raised when INGEST_QUEUE_MAX_SIZE jobs are already waiting."""
+
+
+def _partition_executor() -> ProcessPoolExecutor:
+    global _partition_pool
+    if _partition_pool is None:
+        # "spawn" avoids forking a process that already runs executor threads.
+        _partition_pool = ProcessPoolExecutor(
+            max_workers=INGEST_PARTITION_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _partition_pool
+
+
+# --- Database Helpers (blocking; run via concurrency.run_db) ---
+def _with_session(func, *args, **kwargs):
+    session = db.SessionLocal()
+    try:
+        return func(session, *args, **kwargs)
+    finally:
+        session.close()
+
+
+def _load_job(job_id: str) -> dict | None:
+    def load(session):
+        job = db.get_ingest_job(session, job_id)
+        return {**job.to_dict(), "filepath": job.filepath} if job else None
+    return _with_session(load)
+
+
+def _update_job(job_id: str, **fields):
+    _with_session(db.update_ingest_job, job_id, **fields)
+
+
+def _find_existing(user_id: str, content_hash: str) -> tuple:
+    """
+    Looks for the same content among the tenant's ingested documents and
+    in-flight jobs. Returns (outcome, details) or (None, None).
+    """
+    filename, entry = upload_manifest.find_by_hash(user_id, content_hash)
+    if filename:
+        return "duplicate", {"filename": filename, "job_id": entry.get("job_id")}
+    job = _with_session(db.find_active_ingest_job, user_id, content_hash)
+    if job:
+        return "in_progress", job.to_dict()
+    return None, None
+
+
+# --- Public API ---
+async def submit(user_id: str, filename: str, fileobj) -> tuple:
+    """
+    Saves the upload to persistent disk, hashing it on the way, and returns
+    (outcome, job). If the tenant already has this exact content, outcome is
+    "duplicate" (or "in_progress" while an earlier upload of it is still being
+    processed) and nothing is queued. Otherwise a job is recorded and queued.
+    """
+    if _queue is None:
+        raise RuntimeError("The ingestion queue is not running.")
+    if _queue.qsize() >= INGEST_QUEUE_MAX_SIZE:
+        raise IngestQueueFullError("Too many documents are waiting to be processed. Please try again later.")
+
+    job_id = uuid.uuid4().hex
+    filename = os.path.basename(filename)
+    filepath = os.path.join(UPLOADS_DIR, f"{job_id}_{filename}")
+    # Copying a large upload would hold a DB executor slot that chat lookups need.
+    content_hash = await asyncio.to_thread(copy_and_hash, fileobj, filepath)
+
+    outcome, existing = await concurrency.run_db(_find_existing, user_id, content_hash)
+    if outcome:
+        os.remove(filepath)
+        print(f"Upload {filename} for user_id {user_id} matches {existing['filename']} ({outcome}); not re-ingesting.")
+        return outcome, existing
+
+    job = await concurrency.run_db(
+        _with_session,
+        lambda session: db.create_ingest_job(session, user_id, filename, filepath, job_id, content_hash).to_dict())
+    _enqueue(job_id)
+    return "queued", job
+
+
+async def get_job(job_id: str) -> dict | None:
+    job = await concurrency.run_db(_load_job, job_id)
+    if job:
+        job.pop("filepath")
+    return job
+
+
+# --- Workers ---
+def _enqueue(job_id: str):
+    if job_id not in _enqueued:
+        _enqueued.add(job_id)
+        _queue.put_nowait(job_id)
+
+
+async def _heartbeat(job_id: str):
+    while True:
+        await asyncio.sleep(INGEST_HEARTBEAT_SECONDS)
+        try:
+            await concurrency.run_db(_update_job, job_id)
+        except Exception as e:
+            print(f"Could not refresh ingest job {job_id}: {e}")
+
+
+async def _run_job(job_id: str):
+    if not await concurrency.run_db(_with_session, db.claim_ingest_job, job_id):
+        return
+    heartbeat = asyncio.create_task(_heartbeat(job_id))
+    try:
+        await _process_job(job_id)
+    finally:
+        heartbeat.cancel()
+
+
+async def _process_job(job_id: str):
+    job = await concurrency.run_db(_load_job, job_id)
+    loop = asyncio.get_running_loop()
+    print(f"--- Ingest job {job_id}: {job['filename']} for user_id {job['user_id']} ---")
+
+    try:
+        with metrics.span("ingest_user", "partition"):
+            chunks = await loop.run_in_executor(
+                _partition_executor(), partition_document, job["filepath"], job["filename"])
+        if not chunks:
+            raise ValueError("No content was generated from the document.")
+        await concurrency.run_db(_update_job, job_id, status=db.JOB_EMBEDDING, chunks_partitioned=len(chunks))
+
+        def report_progress(chunks_embedded: int):
+            _update_job(job_id, chunks_embedded=chunks_embedded)
+
+        await loop.run_in_executor(_embed_executor, functools.partial(
+            add_user_chunks, job["user_id"], chunks, report_progress,
+            id_prefix=job_id, content_hash=job["content_hash"]))
+        await concurrency.run_db(_update_job, job_id, status=db.JOB_SUCCEEDED)
+        print(f"✅ Ingest job {job_id} finished: {len(chunks)} chunks added.")
+    except asyncio.CancelledError:
+        # Shutting down: leave the job in progress so it is picked up again on restart.
+        raise
+    except Exception as e:
+        print(f"Ingest job {job_id} failed: {e}")
+        await concurrency.run_db(_update_job, job_id, status=db.JOB_FAILED, error=str(e))
+
+    if os.path.exists(job["filepath"]):
+        os.remove(job["filepath"])
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        _enqueued.discard(job_id)
+        try:
+            await _run_job(job_id)
+        except Exception as e:
+            print(f"Ingest worker error on job {job_id}: {e}")
+        finally:
+            _queue.task_done()
+
+
+async def _sweep() -> tuple:
+    """
+    Re-queues jobs left behind by a dead worker and picks up queued jobs this
+    process does not know about yet. Claiming is atomic, so a job that is also
+    queued in another worker process still runs only once.
+    """
+    requeued = await concurrency.run_db(_with_session, db.requeue_stale_ingest_jobs, INGEST_STALE_JOB_SECONDS)
+    pending = await concurrency.run_db(_with_session, db.list_queued_ingest_job_ids)
+    for job_id in pending:
+        _enqueue(job_id)
+    return requeued, len(pending)
+
+
+async def _sweeper():
+    while True:
+        await asyncio.sleep(INGEST_SWEEP_INTERVAL_SECONDS)
+        try:
+            await _sweep()
+        except Exception as e:
+            print(f"Ingest queue sweep failed: {e}")
+
+
+async def start():
+    """Starts the queue workers and re-queues jobs left over from a previous run."""
+    global _queue
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    _queue = asyncio.Queue()
+    _enqueued.clear()
+    requeued, pending = await _sweep()
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(INGEST_MAX_CONCURRENT_JOBS))
+    _workers.append(asyncio.create_task(_sweeper()))
+    print(f"Ingestion queue started: {INGEST_MAX_CONCURRENT_JOBS} workers, {pending} pending jobs "
+          f"({requeued} resumed after an interrupted run).")
+
+
+async def stop():
+    global _queue, _partition_pool
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
+    if _partition_pool is not None:
+        _partition_pool.shutdown(wait=False, cancel_futures=True)
+        _partition_pool = None
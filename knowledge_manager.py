@@ -4,12 +4,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyMuPDFLoader, Docx2txtLoader
 from fastapi import UploadFile
 from uploader import save_uploaded_file_as_text
+from embedding_cache import cached_embeddings
+import base_index
 
 # (Path configurations and other constants remain the same)
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -29,6 +27,12 @@ def add_document_to_base_db(doc_path: str, tags: str = ""):
 
     print(f"--- Starting incremental update for: {os.path.basename(doc_path)} with tags: '{tags}' ---")
     try:
+        # Loaders (PyMuPDF), splitters and Chroma are imported on first use so
+        # routers that include this module start quickly.
+        from langchain_chroma import Chroma
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        from langchain_community.document_loaders import PyMuPDFLoader, Docx2txtLoader
+
         if doc_path.endswith(".pdf"):
             loader = PyMuPDFLoader(doc_path)
         elif doc_path.endswith(".docx"):
@@ -47,13 +51,19 @@ def add_document_to_base_db(doc_path: str, tags: str = ""):
         chunks = text_splitter.split_documents(documents)
         if not chunks: return False
 
-        embedding_function = OpenAIEmbeddings(model="text-embedding-ada-002")
+        embedding_function = cached_embeddings(max_retries=10)
+        # Refuses to add chunks embedded with a different model than the collection's.
+        base_index.check_embedding_model(embedding_function.model, BASE_DB_PATH)
         vector_store = Chroma(
             persist_directory=BASE_DB_PATH,
             embedding_function=embedding_function,
             collection_name=BASE_COLLECTION_NAME
         )
-        vector_store.add_documents(chunks)
+        # Until the export below finishes, workers on BASE_INDEX_BACKEND=auto search Chroma.
+        with base_index.source_write():
+            vector_store.add_documents(chunks)
+        embedding_function.report("Base KB incremental update")
+        base_index.export_base_index(vector_store)
         
         print("✅ Incremental update complete.")
         return True
@@ -76,6 +86,10 @@ def build_user_database(user_id: str, uploaded_files: list, status_callback=None
     
     os.makedirs(user_db_path, exist_ok=True)
     
+    from langchain_chroma import Chroma
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PyMuPDFLoader, Docx2txtLoader
+
     all_docs = []
     temp_dir = os.path.join(user_db_path, "temp_uploads")
     os.makedirs(temp_dir, exist_ok=True)
@@ -111,13 +125,14 @@ def build_user_database(user_id: str, uploaded_files: list, status_callback=None
 
     if chunks:
         if status_callback: status_callback("Embedding documents...")
-        embedding_function = OpenAIEmbeddings(model="text-embedding-ada-002")
+        embedding_function = cached_embeddings(max_retries=10)
         Chroma.from_documents(
             documents=chunks,
             embedding=embedding_function,
             persist_directory=user_db_path,
             collection_name=USER_COLLECTION_NAME
         )
+        embedding_function.report(f"User {user_id} training")
         if status_callback: status_callback("✅ Training complete!")
     else:
         if status_callback: status_callback("No content found in documents.")
@@ -1,46 +1,45 @@
-import os
-from langchain_openai import ChatOpenAI
-from dotenv import load_dotenv
+import clients
+import metrics
 
-# --- Load Environment Variables ---
-load_dotenv()
-
-# --- Validate Environment Variable ---
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise EnvironmentError("OPENAI_API_KEY environment variable not found. Please set it in your .env file.")
+# OPENAI_API_KEY is validated by `clients` when the first client is built (and
+# by the app at startup), not at import time, so importing this module is cheap.
 
 # --- Language Model Initialization ---
 def get_llm():
     """
-    Initializes and returns the ChatOpenAI model instance.
+    Returns the shared ChatOpenAI model instance.
 
-    This function is configured to use a more powerful model (gpt-4-turbo)
-    for enhanced reasoning and interpretation, which is crucial for handling
-    complex patient scenarios.
+    The model (gpt-4-turbo by default, see OPENAI_MODEL) is configured for
+    enhanced reasoning and interpretation, which is crucial for handling
+    complex patient scenarios. The instance is owned by the client registry,
+    so repeated calls reuse the same pooled HTTP connections.
     
     Returns:
         An instance of ChatOpenAI configured with the upgraded model.
     """
     try:
-        # UPGRADE: Using gpt-4-turbo for superior reasoning, synthesis,
-        # and ability to follow complex instructions. This is key for
-        # providing dietitian-level interpretations.
-        llm = ChatOpenAI(
-            model_name="gpt-4-turbo",
-            temperature=0.5, # Lower temperature for more factual, less creative responses
-            max_tokens=1500, # Increased token limit for more detailed analysis
-            openai_api_key=OPENAI_API_KEY
-        )
-        return llm
+        # Lower temperature for more factual, less creative responses, and an
+        # increased token limit for more detailed analysis.
+        return clients.get_chat_model(temperature=0.5, max_tokens=1500)
     except Exception as e:
         print(f"Error initializing ChatOpenAI model: {e}")
         # This will prevent the application from starting if the LLM can't be initialized
         raise
-def get_direct_llm_response(question: str) -> str:
+def get_direct_llm_response(question: str, call: str = "direct") -> str:
+    """
+    Gets a direct response from the LLM wihtout RAG. `call` labels the token
+    usage in the metrics.
+    """
+    llm = get_llm()
+    response = llm.invoke(question)
+    metrics.record_llm_usage(response, call)
+    return response.content
+
+async def aget_direct_llm_response(question: str, call: str = "direct") -> str:
     """
-    Gets a direct response from the LLM wihtout RAG
+    Async variant of get_direct_llm_response for the concurrent RAG pipeline.
     """
     llm = get_llm()
-    response = llm.predict(question)
-    return response
\ No newline at end of file
+    response = await llm.ainvoke(question)
+    metrics.record_llm_usage(response, call)
+    return response.content
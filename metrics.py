@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, REGISTRY,
+)
+
+# --- Metrics Configuration ---
+# With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to a shared empty
+# directory so /metrics aggregates all of them.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+# Adds a Server-Timing header with the per-stage breakdown to chat responses.
+DEBUG_TIMING_HEADER = os.environ.get("DEBUG_TIMING_HEADER", "false").lower() in ("1", "true", "yes")
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# --- Metric Definitions ---
+STAGE_SECONDS = Histogram(
+    "nutribot_stage_seconds", "Duration of each pipeline stage.", ["pipeline", "stage"], buckets=STAGE_BUCKETS)
+LLM_TOKENS = Counter(
+    "nutribot_llm_tokens_total", "LLM tokens used, by call and direction.", ["call", "direction"])
+RAG_FALLBACKS = Counter(
+    "nutribot_rag_fallbacks_total", "Answers that fell back to the direct LLM.", ["endpoint"])
+ANSWER_CACHE_LOOKUPS = Counter(
+    "nutribot_answer_cache_lookups_total", "Semantic answer cache lookups.", ["result"])
+CONDITION_RESOLUTIONS = Counter(
+    "nutribot_condition_resolutions_total", "How the condition for a chat turn was decided.", ["cache", "source"])
+INGEST_CHUNKS = Counter(
+    "nutribot_ingest_chunks_total", "Chunks written to a vector store by ingestion.", ["pipeline"])
+
+# In-process totals, so command-line runs (e.g. build_base_db) can print a summary.
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def observe_stage(pipeline: str, stage: str, seconds: float):
+    STAGE_SECONDS.labels(pipeline, stage).observe(seconds)
+    with _totals_lock:
+        count, total = _totals.get((pipeline, stage), (0, 0.0))
+        _totals[(pipeline, stage)] = (count + 1, total + seconds)
+
+
+@contextmanager
+def span(pipeline: str, stage: str):
+    """Times the enclosed block as one observation of `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(pipeline, stage, time.perf_counter() - start)
+
+
+def stage_totals(pipeline: str) -> dict:
+    with _totals_lock:
+        return {
+            stage: {"count": count, "total_s": round(total, 3)}
+            for (p, stage), (count, total) in _totals.items() if p == pipeline
+        }
+
+
+def record_llm_usage(message, call: str):
+    """Counts prompt/completion tokens from a LangChain AIMessage (or final stream chunk), if reported."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.labels(call, "prompt").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(call, "completion").inc(usage.get("output_tokens", 0))
+
+
+def server_timing(timings_ms: dict) -> str:
+    """Formats a StageTimings report as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={span['duration']}" for name, span in timings_ms.items())
+
+
+def render() -> tuple:
+    """Returns (body, content_type) for the /metrics endpoint."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -2,8 +2,8 @@ import os
 import csv
 import base64
 import fitz  # PyMuPDF
-from openai import OpenAI
 from dotenv import load_dotenv
+import clients
 
 # --- Configuration ---
 load_dotenv()
@@ -17,7 +17,7 @@ ANNOTATION_FILE = os.path.join("data", "image_annotations.csv")
 VISION_MODEL = "gpt-4o"  # GPT-4 with Vision is required for this task
 
 # --- Initialize OpenAI Client ---
-client = OpenAI()
+client = clients.get_openai_client()
 
 def encode_image(image_bytes):
     """Encodes image bytes to a base64 string."""
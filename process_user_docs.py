@@ -1,11 +1,12 @@
 import os
 import json
+import uuid
 from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain.docstore.document import Document
-from unstructured.partition.auto import partition
-from unstructured.chunking.title import chunk_by_title
+import vector_store as vs
+from embedding_cache import cached_embeddings
+import upload_manifest
+import metrics
+from hashing import file_sha256
 
 # --- Load environment variables ---
 load_dotenv()
@@ -15,36 +16,91 @@ APP_DIR = os.path.dirname(os.path.abspath(__file__))
 LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
 PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
 USER_STORES_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstores_user")
-EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Chunks are written to the tenant store in batches so progress can be reported.
+ADD_BATCH_SIZE = int(os.environ.get("INGEST_ADD_BATCH_SIZE", 64))
+
+def partition_document(filepath: str, filename: str | None = None) -> list:
+    """
+    Partitions and chunks one document into LangChain Documents. This is the
+    CPU-heavy step; it has no shared state so it can run in a worker process.
+    """
+    # unstructured and its model dependencies take seconds to import; only the
+    # processes that actually partition documents pay for them.
+    from langchain_core.documents import Document
+    from unstructured.partition.auto import partition
+    from unstructured.chunking.title import chunk_by_title
+
+    filename = filename or os.path.basename(filepath)
+    print(f"Partitioning and chunking: {filename}")
+    elements = partition(filename=filepath)
+    chunks = chunk_by_title(elements, max_characters=1500, combine_under_n_chars=500)
+
+    documents = []
+    for chunk in chunks:
+        title = chunk.metadata.get_element_orig_filename()
+        if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'title'):
+            title = chunk.metadata.title
+        documents.append(Document(
+            page_content=str(chunk),
+            metadata={"source": filename, "title": title}
+        ))
+    return documents
+
+def add_user_chunks(user_id: str, chunks: list, progress_callback=None, id_prefix: str | None = None,
+                    content_hash: str | None = None) -> dict:
+    """
+    Embeds `chunks` (all from one source document) and adds them to the
+    user's personal vector store, replacing any chunks from an earlier version
+    of the same file. `progress_callback(chunks_embedded)` is called after
+    every batch. Chunk ids are derived from `id_prefix` (the job id), so
+    re-running the same job overwrites its chunks instead of duplicating them.
+    Returns the embedding cache report for the run.
+    """
+    embedding_function = cached_embeddings(max_retries=10)
+    id_prefix = id_prefix or uuid.uuid4().hex
+    source = chunks[0].metadata["source"]
+    new_ids = [f"{id_prefix}:{i}" for i in range(len(chunks))]
+
+    # Initialize or load the user's personal ChromaDB and add the new chunks.
+    # The write goes through vector_store so the tenant's cached retriever is
+    # invalidated once it is done.
+    with vs.tenant_write(user_id, embedding_function) as vector_store:
+        for i in range(0, len(chunks), ADD_BATCH_SIZE):
+            with metrics.span("ingest_user", "embed_and_store"):
+                vector_store.add_documents(chunks[i:i + ADD_BATCH_SIZE], ids=new_ids[i:i + ADD_BATCH_SIZE])
+            if progress_callback:
+                progress_callback(min(i + ADD_BATCH_SIZE, len(chunks)))
+        metrics.INGEST_CHUNKS.labels("ingest_user").inc(len(chunks))
+
+        # Drop the previous version of this file only once the new one is in.
+        with metrics.span("ingest_user", "replace_previous"):
+            stale_ids = set(vector_store.get(where={"source": source}, include=[])["ids"]) - set(new_ids)
+            if stale_ids:
+                vector_store.delete(ids=list(stale_ids))
+        if stale_ids:
+            print(f"Replaced {len(stale_ids)} chunks from the previous version of {source}.")
+        if content_hash:
+            upload_manifest.record(user_id, source, content_hash, len(chunks), job_id=id_prefix)
+    return embedding_function.report(f"User {user_id} upload")
 
 def process_user_document(user_id: str, filepath: str):
     """
     Processes a single uploaded document for a specific user and adds it to their
-    personal, persistent vector store.
+    personal, persistent vector store. Documents already ingested with the
+    same content are skipped.
     """
     print(f"--- Processing document for user_id: {user_id} ---")
-    
-    user_index_dir = os.path.join(USER_STORES_DIR, f"user_{user_id}")
-    os.makedirs(user_index_dir, exist_ok=True) # Ensure the user's directory exists
 
-    embedding_function = OpenAIEmbeddings(model=EMBEDDING_MODEL, max_retries=10)
-    
-    all_chunks = []
+    content_hash = file_sha256(filepath)
+    duplicate_of, _ = upload_manifest.find_by_hash(user_id, content_hash)
+    if duplicate_of:
+        print(f"{os.path.basename(filepath)} is identical to already ingested {duplicate_of}. Skipping.")
+        return
+
     try:
-        filename = os.path.basename(filepath)
-        print(f"Partitioning and chunking: {filename}")
-        elements = partition(filename=filepath)
-        chunks = chunk_by_title(elements, max_characters=1500, combine_under_n_chars=500)
-        
-        for chunk in chunks:
-            title = chunk.metadata.get_element_orig_filename()
-            if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'title'):
-                title = chunk.metadata.title
-            all_chunks.append(Document(
-                page_content=str(chunk),
-                metadata={"source": filename, "title": title}
-            ))
-            
+        with metrics.span("ingest_user", "partition"):
+            all_chunks = partition_document(filepath)
     except Exception as e:
         print(f"Error processing {os.path.basename(filepath)}: {e}")
         return
@@ -54,13 +110,5 @@ def process_user_document(user_id: str, filepath: str):
         return
 
     print(f"Generated {len(all_chunks)} chunks to add to user's knowledge base.")
-
-    # Initialize or load the user's personal ChromaDB and add the new chunks
-    vector_store = Chroma(
-        collection_name=f"user_{user_id}_knowledge",
-        embedding_function=embedding_function,
-        persist_directory=user_index_dir
-    )
-    
-    vector_store.add_documents(all_chunks)
-    print(f"✅ Successfully added new knowledge to user {user_id}'s bot.")
\ No newline at end of file
+    add_user_chunks(user_id, all_chunks, content_hash=content_hash)
+    print(f"✅ Successfully added new knowledge to user {user_id}'s bot.")
@@ -0,0 +1,419 @@
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- UNIFIED PATH CONFIGURATION ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
+PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
+USER_STORES_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstores_user")
+
+# --- Compact Store Configuration ---
+# Format for tenant stores created from now on: "chroma" (the default), or a
+# compact store keeping "int8" (scalar-quantized, one scale per vector) or
+# "float16" vectors in memory for the first-pass search. Existing Chroma
+# stores keep working until they are migrated with `python quantized_store.py migrate`.
+TENANT_STORE_FORMAT = os.environ.get("TENANT_STORE_FORMAT", "chroma")
+# "exact": the top candidates are rescored with float32 vectors read from disk
+# (only the compact vectors are held in memory). "none": no float32 copy is
+# kept and the first-pass scores are final, which also shrinks the file.
+TENANT_STORE_RESCORE = os.environ.get("TENANT_STORE_RESCORE", "exact")
+# Candidates rescored per result requested.
+TENANT_STORE_RESCORE_FACTOR = int(os.environ.get("TENANT_STORE_RESCORE_FACTOR", 4))
+
+STORE_FILE = "compact.sqlite3"
+COMPACT_FORMATS = ("int8", "float16")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    source TEXT,
+    document TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    qvector BLOB NOT NULL,
+    scale REAL NOT NULL,
+    vector BLOB
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+"""
+
+
+# --- Quantization ---
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray, fmt: str) -> tuple:
+    """
+    Returns (compact, scales) for unit-normalized float32 rows. int8 uses a
+    symmetric per-vector scale (x ~= q * scale); float16 has a scale of 1.
+    """
+    if fmt == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+
+def approximate_scores(compact: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """First-pass dot products of a unit query against the dequantized rows."""
+    return (compact.astype(np.float32) @ query) * scales
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def exists(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, STORE_FILE))
+
+
+# --- Store ---
+class QuantizedStore:
+    """
+    Compact tenant vector store: rows live in one SQLite file, and only the
+    quantized vectors (plus a scale each) are loaded into memory. Implements
+    the subset of the Chroma store API the app uses (add_documents /
+    add_texts, get, delete, similarity_search_by_vector, as_retriever).
+    Vectors are unit-normalized, so rankings match Chroma's L2 ordering for
+    normalized embeddings such as OpenAI's.
+    """
+    def __init__(self, directory: str, embedding_function=None, fmt: str | None = None,
+                 rescore: str = TENANT_STORE_RESCORE):
+        self.path = os.path.join(directory, STORE_FILE)
+        self.embedding_function = embedding_function
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+            stored = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+            if "format" not in stored:
+                stored = {"format": fmt or TENANT_STORE_FORMAT, "rescore": rescore}
+                if stored["format"] not in COMPACT_FORMATS:
+                    raise ValueError(f"Unsupported compact store format: {stored['format']}")
+                connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", stored.items())
+        # A store keeps the format and rescore mode it was created with.
+        self.format = stored["format"]
+        self.rescore = stored["rescore"]
+        self._dtype = np.int8 if self.format == "int8" else np.float16
+        self._lock = threading.Lock()
+        self._loaded_stamp = None
+        self._ids, self._compact, self._scales = [], None, None
+
+    @contextmanager
+    def _connect(self):
+        """A short-lived connection, committed on success and always closed."""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _stamp(self):
+        stamps = []
+        for name in (self.path, self.path + "-wal"):
+            try:
+                stamps.append(os.path.getmtime(name))
+            except OSError:
+                pass
+        return max(stamps, default=None)
+
+    def _load(self):
+        # Reloaded when the file changes, including writes by other workers.
+        stamp = self._stamp()
+        if stamp == self._loaded_stamp and self._compact is not None:
+            return
+        with self._connect() as connection:
+            rows = connection.execute("SELECT id, qvector, scale FROM chunks ORDER BY rowid").fetchall()
+        if rows:
+            compact = np.frombuffer(b"".join(row[1] for row in rows), dtype=self._dtype).reshape(len(rows), -1)
+        else:
+            compact = np.empty((0, 0), dtype=self._dtype)
+        self._ids = [row[0] for row in rows]
+        self._compact = compact
+        self._scales = np.asarray([row[2] for row in rows], dtype=np.float32)
+        self._loaded_stamp = stamp
+
+    def memory_bytes(self) -> int:
+        """Resident size of the in-memory search structures (vectors and scales)."""
+        with self._lock:
+            self._load()
+            return self._compact.nbytes + self._scales.nbytes
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    # --- Writes ---
+    def add_vectors(self, ids: list, vectors, texts: list, metadatas: list):
+        """Upserts rows with precomputed embeddings (used by add_texts and migration)."""
+        unit = normalize(np.asarray(vectors, dtype=np.float32))
+        compact, scales = quantize(unit, self.format)
+        keep_exact = self.rescore == "exact"
+        rows = [
+            (chunk_id, (metadata or {}).get("source"), text, json.dumps(metadata or {}, ensure_ascii=False),
+             compact[i].tobytes(), float(scales[i]), unit[i].tobytes() if keep_exact else None)
+            for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+        ]
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunks (id, source, document, metadata, qvector, scale, vector) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def add_texts(self, texts: list, metadatas: list | None = None, ids: list | None = None, **kwargs) -> list:
+        texts = list(texts)
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        if texts:
+            self.add_vectors(ids, self.embedding_function.embed_documents(texts), texts, metadatas)
+        return ids
+
+    def add_documents(self, documents: list, ids: list | None = None, **kwargs) -> list:
+        return self.add_texts([d.page_content for d in documents], [d.metadata for d in documents], ids=ids)
+
+    def delete(self, ids: list | None = None, **kwargs):
+        if not ids:
+            return
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+
+    def get(self, where: dict | None = None, include: list | None = None, limit: int | None = None,
+            offset: int | None = None, **kwargs) -> dict:
+        """Chroma-style get; `where` supports equality on metadata keys."""
+        include = ["documents", "metadatas"] if include is None else include
+        clauses, params = [], []
+        for key, value in (where or {}).items():
+            if key == "source":
+                clauses.append("source = ?")
+            else:
+                clauses.append("json_extract(metadata, ?) = ?")
+                params.append(f"$.{key}")
+            params.append(value)
+        query = "SELECT id, document, metadata, vector, qvector, scale FROM chunks"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY rowid"
+        if limit is not None:
+            query += f" LIMIT {int(limit)} OFFSET {int(offset or 0)}"
+        with self._connect() as connection:
+            rows = connection.execute(query, params).fetchall()
+
+        result = {"ids": [row[0] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [row[1] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(row[2]) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = [self._row_vector(row[3], row[4], row[5]) for row in rows]
+        return result
+
+    def _row_vector(self, exact, qvector, scale) -> np.ndarray:
+        if exact is not None:
+            return np.frombuffer(exact, dtype=np.float32)
+        return np.frombuffer(qvector, dtype=self._dtype).astype(np.float32) * scale
+
+    # --- Search ---
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        query = normalize(np.asarray(embedding, dtype=np.float32))
+        with self._lock:
+            self._load()
+            ids, compact, scales = self._ids, self._compact, self._scales
+        if not ids:
+            return []
+
+        # First pass over the compact vectors in memory; with exact rescoring,
+        # a few times more candidates than requested are re-ranked in float32.
+        rescoring = self.rescore == "exact"
+        first_pass = approximate_scores(compact, scales, query)
+        candidates = top_k(first_pass, k * TENANT_STORE_RESCORE_FACTOR if rescoring else k)
+        approximate = {ids[i]: float(first_pass[i]) for i in candidates}
+
+        placeholders = ",".join("?" * len(approximate))
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT id, document, metadata, vector FROM chunks WHERE id IN ({placeholders})",
+                list(approximate)).fetchall()
+        from langchain_core.documents import Document
+        scored = []
+        for chunk_id, text, metadata, vector in rows:
+            score = float(np.frombuffer(vector, dtype=np.float32) @ query) if rescoring and vector is not None \
+                else approximate[chunk_id]
+            scored.append((Document(id=chunk_id, page_content=text, metadata=json.loads(metadata)), score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:k]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def as_retriever(self, search_kwargs: dict | None = None):
+        from base_index import make_retriever
+        return make_retriever(self, (search_kwargs or {}).get("k", 4))
+
+
+# --- Migration & Comparison (offline) ---
+def tenant_dirs(user_ids: list | None) -> list:
+    """(user_id, directory) for the given tenants, or for every per-user store on disk."""
+    if user_ids:
+        return [(user_id, os.path.join(USER_STORES_DIR, f"user_{user_id}")) for user_id in user_ids]
+    if not os.path.isdir(USER_STORES_DIR):
+        return []
+    return [(name[len("user_"):], os.path.join(USER_STORES_DIR, name))
+            for name in sorted(os.listdir(USER_STORES_DIR)) if name.startswith("user_")]
+
+
+def _open_chroma(user_id: str, directory: str):
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=directory, collection_name=f"user_{user_id}_knowledge")
+
+
+def read_rows(store, page_size: int = 5000) -> dict:
+    """Every row of a Chroma-style store (ids, embeddings, documents, metadatas), read a page at a time."""
+    rows = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    offset = 0
+    while True:
+        page = store.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return rows
+        for key in rows:
+            rows[key].extend(page[key])
+        offset += len(page["ids"])
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def migrate(user_ids: list | None, fmt: str, rescore: str, keep_chroma: bool) -> list:
+    """
+    Copies each tenant's Chroma store (embeddings included, nothing is
+    re-embedded) into a compact store in the same directory, then removes the
+    Chroma files unless `keep_chroma`. Run it while the app is stopped.
+    """
+    import shutil
+
+    report = []
+    for user_id, directory in tenant_dirs(user_ids):
+        if exists(directory) or not os.path.exists(os.path.join(directory, "chroma.sqlite3")):
+            continue
+        start = time.perf_counter()
+        chroma_bytes = _directory_size(directory)
+        rows = read_rows(_open_chroma(user_id, directory))
+        store = QuantizedStore(directory, fmt=fmt, rescore=rescore)
+        if rows["ids"]:
+            store.add_vectors(rows["ids"], rows["embeddings"], rows["documents"], rows["metadatas"])
+        if len(store) != len(rows["ids"]):
+            os.remove(store.path)
+            raise RuntimeError(f"Migration of tenant {user_id} wrote {len(store)} of {len(rows['ids'])} chunks.")
+        if not keep_chroma:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name.startswith(STORE_FILE):
+                    continue
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        report.append({"user_id": user_id, "chunks": len(rows["ids"]), "chroma_bytes": chroma_bytes,
+                       "compact_bytes": os.path.getsize(store.path), "seconds": round(time.perf_counter() - start, 2)})
+        print(json.dumps(report[-1]))
+    return report
+
+
+def compare(user_ids: list | None, queries: int, k: int, noise: float, seed: int) -> dict:
+    """
+    For each Chroma tenant store, compares recall@k against exact search, query
+    latency and in-memory vector size of the current layout (Chroma HNSW) and
+    of the int8 and float16 compact stores. Queries are stored vectors plus
+    Gaussian noise, so no embedding calls are made.
+    """
+    import tempfile
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for user_id, directory in tenant_dirs(user_ids):
+        if not os.path.exists(os.path.join(directory, "chroma.sqlite3")):
+            continue
+        chroma = _open_chroma(user_id, directory)
+        rows = read_rows(chroma)
+        if len(rows["ids"]) < k:
+            continue
+        vectors = normalize(np.asarray(rows["embeddings"], dtype=np.float32))
+        picks = rng.integers(0, len(vectors), size=queries)
+        query_vectors = normalize(vectors[picks] + rng.normal(0, noise, size=(queries, vectors.shape[1])))
+        truth = [set(rows["ids"][i] for i in top_k(vectors @ q, k)) for q in query_vectors]
+
+        def measure(search) -> dict:
+            latencies, hits = [], 0
+            for q, expected in zip(query_vectors, truth):
+                start = time.perf_counter()
+                found = search(q.tolist())
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += len(expected & {doc.id for doc in found})
+            latencies.sort()
+            return {"recall_at_k": round(hits / (k * len(truth)), 4),
+                    "p50_ms": round(latencies[len(latencies) // 2], 3),
+                    "p95_ms": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3)}
+
+        tenant = {"user_id": user_id, "chunks": len(vectors), "dim": int(vectors.shape[1]),
+                  "chroma": {**measure(lambda q: chroma.similarity_search_by_vector(q, k)),
+                             "vector_bytes": int(vectors.nbytes), "disk_bytes": _directory_size(directory)}}
+        with tempfile.TemporaryDirectory() as scratch:
+            for fmt in COMPACT_FORMATS:
+                for rescore in ("exact", "none"):
+                    store = QuantizedStore(os.path.join(scratch, f"{fmt}_{rescore}"), fmt=fmt, rescore=rescore)
+                    store.add_vectors(rows["ids"], vectors, rows["documents"], rows["metadatas"])
+                    tenant[f"{fmt}_rescore_{rescore}"] = {
+                        **measure(lambda q: store.similarity_search_by_vector(q, k)),
+                        "vector_bytes": store.memory_bytes(), "disk_bytes": os.path.getsize(store.path)}
+        results.append(tenant)
+        print(json.dumps(tenant), file=sys.stderr)
+    return {"k": k, "queries_per_tenant": queries, "noise": noise, "tenants": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact (quantized) tenant vector stores.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Convert Chroma tenant stores to compact stores")
+    migrate_parser.add_argument("--users", help="Comma-separated user ids (default: every tenant)")
+    migrate_parser.add_argument("--format", choices=COMPACT_FORMATS,
+                                default=TENANT_STORE_FORMAT if TENANT_STORE_FORMAT in COMPACT_FORMATS else "int8")
+    migrate_parser.add_argument("--rescore", choices=["exact", "none"], default=TENANT_STORE_RESCORE)
+    migrate_parser.add_argument("--keep-chroma", action="store_true", help="Leave the Chroma files in place")
+    compare_parser = commands.add_parser("compare", help="Recall@k / latency / memory report against Chroma")
+    compare_parser.add_argument("--users", help="Comma-separated user ids (default: every tenant)")
+    compare_parser.add_argument("--queries", type=int, default=200, help="Queries per tenant")
+    compare_parser.add_argument("--k", type=int, default=3)
+    compare_parser.add_argument("--noise", type=float, default=0.02, help="Query perturbation (std dev)")
+    compare_parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    users = args.users.split(",") if args.users else None
+    if args.command == "migrate":
+        print(json.dumps(migrate(users, args.format, args.rescore, args.keep_chroma), indent=2))
+    else:
+        print(json.dumps(compare(users, args.queries, args.k, args.noise, args.seed), indent=2))
@@ -1,59 +1,29 @@
 import os
-import re
-import csv
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.prompts import PromptTemplate
-from llm import get_llm, get_direct_llm_response
-from vector_store import get_retriever
-
-# --- Image Annotation Loading & Search ---
-def load_image_annotations():
-    annotation_file = os.path.join("data", "image_annotations.csv")
-    if not os.path.exists(annotation_file):
-        return []
-    with open(annotation_file, 'r', newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        return [row for row in reader]
-
-IMAGE_ANNOTATIONS = load_image_annotations()
+import time
+import asyncio
+import threading
+from llm import get_llm, get_direct_llm_response, aget_direct_llm_response
+import vector_store as vs
+import embedding_batcher
+import image_index
+import image_embeddings
+import concurrency
+import answer_cache
+import metrics
+from cache import LRUTTLCache
+from condition_classifier import get_classifier, to_label
 
+# --- Image Annotation Search ---
 def find_image_url(query: str) -> str | None:
     """
     Searches annotations for the best matching image file based on a
-    descriptive query from the LLM, with improved keyword matching.
+    descriptive query from the LLM. Uses the BM25 annotation index, blended
+    with embedding similarity once the annotation matrix has been built.
     """
-    if not IMAGE_ANNOTATIONS:
+    best_match = image_embeddings.find_best_image(query)
+    if not best_match:
         return None
-
-    # --- Smarter Keyword Extraction ---
-    stop_words = {'a', 'an', 'the', 'of', 'in', 'a', 'single', 'photo', 'image', 'bowl', 'plate'}
-    query_words = set(query.lower().split()) - stop_words
-    
-    print(f"\n[DEBUG] Image search initiated.")
-    print(f"  - LLM Query: '{query}'")
-    print(f"  - Search Keywords: {query_words}")
-
-    best_match = None
-    highest_score = 0
-
-    for annotation in IMAGE_ANNOTATIONS:
-        description_words = set(annotation.get('description', '').lower().split()) - stop_words
-        
-        score = len(query_words.intersection(description_words))
-        
-        if score > highest_score:
-            highest_score = score
-            best_match = annotation.get('filename')
-
-    if best_match and highest_score > 0: # More flexible threshold
-        image_path = os.path.join("data", "images", best_match)
-        print(f"  - Best Match Found: '{best_match}' (Score: {highest_score})")
-        print(f"  - Returning Path: '{image_path}'")
-        return image_path
-    
-    print(f"  - No suitable image match found.")
-    return None
+    return os.path.join(image_index.IMAGE_DIR, best_match)
 
 # --- NEW: Separate function to decide if an image is needed ---
 def get_image_query(question: str, answer: str) -> str | None:
@@ -76,19 +46,13 @@ def get_image_query(question: str, answer: str) -> str | None:
     """
     
     query = get_direct_llm_response(prompt).strip()
-    
-    print(f"[DEBUG] Image Decision Step:")
-    print(f"  - Generated Query: '{query}'")
 
     if "none" in query.lower() or len(query) < 3:
         return None
     return query
 
-def identify_target_disease(question: str) -> str:
-    """
-    Uses a direct LLM call to identify the primary health condition in the user's query.
-    """
-    prompt = f"""
+def _disease_prompt(question: str) -> str:
+    return f"""
     Analyze the following user question and identify the primary health condition or disease mentioned.
     If a specific condition like 'Type 2 Diabetes', 'hypertension', 'CKD', or 'high cholesterol' is mentioned, return that name.
     If no specific disease is mentioned, return the phrase 'general health and wellness'.
@@ -96,10 +60,73 @@ def identify_target_disease(question: str) -> str:
 
     User Question: "{question}"
     """
-    disease = get_direct_llm_response(prompt)
-    print(f"[DEBUG] Identified target condition: {disease}")
+
+def identify_target_disease(question: str) -> str:
+    """
+    Identifies the primary health condition in the user's query. The local
+    classifier decides when it can; a direct LLM call is only made when the
+    question is ambiguous (several conditions, or only vague cues).
+    """
+    result = get_classifier().classify(question)
+    if not result.ambiguous:
+        return result.label
+    disease = get_direct_llm_response(_disease_prompt(question))
     return disease.strip()
 
+async def aclassify_condition(question: str) -> tuple[str, str]:
+    """
+    Async variant of identify_target_disease that also returns which path
+    produced the label ("local" or "llm").
+    """
+    result = get_classifier().classify(question)
+    if not result.ambiguous:
+        return result.label, "local"
+    disease = await aget_direct_llm_response(_disease_prompt(question))
+    return disease.strip(), "llm"
+
+async def aidentify_target_disease(question: str) -> str:
+    label, _ = await aclassify_condition(question)
+    return label
+
+# --- Per-Session Condition Pinning ---
+# The condition rarely changes within a chat session, so the first label is
+# pinned to the session and only re-classified when the question mentions a
+# condition the pinned label does not cover.
+SESSION_CONDITION_TTL_SECONDS = float(os.environ.get("SESSION_CONDITION_TTL_SECONDS", 3600))
+SESSION_CONDITION_MAX_SESSIONS = int(os.environ.get("SESSION_CONDITION_MAX_SESSIONS", 10000))
+_session_conditions = LRUTTLCache(
+    max_entries=SESSION_CONDITION_MAX_SESSIONS,
+    ttl_seconds=SESSION_CONDITION_TTL_SECONDS,
+)
+
+async def aresolve_target_disease(question: str, chat_session_id: str) -> tuple[str, dict]:
+    """
+    Returns the condition for this turn and how it was obtained. "cache" is
+    "pinned" (reused from the session), "classified" (first turn) or
+    "reclassified" (the question named a new condition); "source" is "local"
+    or "llm" for the classifier path that produced the label.
+    """
+    classifier = get_classifier()
+    pinned = _session_conditions.get(chat_session_id) if chat_session_id else None
+    if pinned is not None:
+        if not classifier.detect(question) - pinned["conditions"]:
+            return pinned["label"], {"cache": "pinned", "source": pinned["source"]}
+        cache_decision = "reclassified"
+    else:
+        cache_decision = "classified"
+
+    label, source = await aclassify_condition(question)
+    if chat_session_id:
+        _session_conditions.put(chat_session_id, {
+            "label": label,
+            "source": source,
+            "conditions": classifier.detect(label) or {to_label(label)},
+        })
+    return label, {"cache": cache_decision, "source": source}
+
+def get_session_cache_stats() -> dict:
+    return _session_conditions.stats()
+
 # --- DYNAMIC BEHAVIOR TEMPLATE (No longer a constant) ---
 def get_behavior_template(target_disease: str) -> str:
     """
@@ -142,51 +169,309 @@ Your goal is to have a natural conversation that covers the ADIME steps.
 """
 
 # --- Constants ---
-CONVERSATION_MEMORY_WINDOW = 10
 RAG_FAILURE_PHRASES = ["i don't know", "i am not sure", "i cannot answer"]
 
 def parse_response_for_image(text: str) -> dict:
-    match = re.search(r"\[IMAGE:\s*(.*?)\]", text)
-    if match:
-        query = match.group(1).strip()
-        cleaned_text = text.replace(match.group(0), "").strip()
-        image_url = find_image_url(query)
-        return {"answer": cleaned_text, "image_url": image_url}
-    else:
-        return {"answer": text, "image_url": None}
+    """
+    Strips every `[IMAGE: ...]` tag from a complete answer, as the streaming
+    path does, and looks up an image for the first one.
+    """
+    tag_filter = ImageTagFilter()
+    cleaned_text = (tag_filter.feed(text) + tag_filter.flush()).strip()
+    image_url = find_image_url(tag_filter.queries[0]) if tag_filter.queries else None
+    return {"answer": cleaned_text, "image_url": image_url}
 
-def get_rag_response(question: str, user_id: str, chat_session_id: str) -> dict:
-    target_disease = identify_target_disease(question)
-    behavior_template = get_behavior_template(target_disease)
-    
-    llm = get_llm()
-    retriever = get_retriever(user_id=user_id)
-    memory = ConversationBufferWindowMemory(
-        k=CONVERSATION_MEMORY_WINDOW,
-        memory_key="chat_history",
-        return_messages=True,
-        output_key='answer'
+# --- Concurrent Pipeline ---
+# Only generation depends on the disease label, so classification runs
+# alongside query embedding and the base/user store searches. Each stage
+# lists the stages it waits on, which is used to report the critical path.
+STAGE_DEPENDENCIES = {
+    "disease_identification": [],
+    "retriever_setup": [],
+    "query_embedding": [],
+    "base_search": ["query_embedding", "retriever_setup"],
+    "user_search": ["query_embedding", "retriever_setup"],
+    "generation": ["disease_identification", "base_search", "user_search"],
+    "fallback_generation": ["generation"],
+    "image_lookup": ["generation", "fallback_generation"],
+}
+
+class StageTimings:
+    """
+    Records start/end offsets (ms from the start of the request) for each pipeline stage.
+    """
+    def __init__(self, pipeline: str = "chat"):
+        self._origin = time.perf_counter()
+        self.pipeline = pipeline
+        self.stages = {}
+
+    def _now_ms(self) -> float:
+        return (time.perf_counter() - self._origin) * 1000
+
+    def now(self) -> float:
+        return self._now_ms()
+
+    def record(self, name: str, start: float, observe: bool = True):
+        end = self._now_ms()
+        self.stages[name] = {"start": round(start, 1), "end": round(end, 1)}
+        if observe:
+            metrics.observe_stage(self.pipeline, name, (end - start) / 1000)
+
+    async def run(self, name: str, awaitable):
+        start = self._now_ms()
+        completed = False
+        try:
+            result = await awaitable
+            completed = True
+            return result
+        finally:
+            # Stages cancelled part-way (e.g. searches after an answer cache hit)
+            # stay in the report but are kept out of the latency histograms.
+            self.record(name, start, observe=completed)
+
+    def critical_path(self) -> list:
+        if not self.stages:
+            return []
+        path = [max(self.stages, key=lambda name: self.stages[name]["end"])]
+        while True:
+            deps = [d for d in STAGE_DEPENDENCIES.get(path[-1], []) if d in self.stages]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda name: self.stages[name]["end"]))
+        return list(reversed(path))
+
+    def report(self) -> dict:
+        return {
+            "timings_ms": {
+                name: {**span, "duration": round(span["end"] - span["start"], 1)}
+                for name, span in self.stages.items()
+            },
+            "critical_path": self.critical_path(),
+            "total_ms": round(self._now_ms(), 1),
+        }
+
+def _merge_documents(*results: list) -> list:
+    """
+    Interleaves search results the way MergerRetriever does (first hit of
+    each store, then the second, ...), so the prompt context is unchanged.
+    """
+    merged = []
+    for i in range(max((len(r) for r in results), default=0)):
+        for docs in results:
+            if i < len(docs):
+                merged.append(docs[i])
+    return merged
+
+async def _search(store, embedding: list) -> list:
+    if store is None:
+        return []
+    return await concurrency.run_search(store.similarity_search_by_vector, embedding, vs.RETRIEVER_K)
+
+async def _open_stores(user_id: str):
+    return await asyncio.gather(
+        concurrency.run_search(vs.get_base_store),
+        concurrency.run_search(vs.get_user_store, user_id),
     )
 
-    # --- CORRECTED PROMPT TEMPLATE ---
+async def _aprepare_generation(question: str, user_id: str, chat_session_id: str,
+                               timings: StageTimings) -> dict:
+    """
+    Runs everything generation depends on. Returns a dict with the final
+    "prompt", the condition "diagnostics", and either a "cached" answer (when
+    the semantic answer cache hits, in which case the searches are abandoned)
+    or the "cache_key" under which the generated answer should be stored.
+    """
+    disease_task = asyncio.create_task(
+        timings.run("disease_identification", aresolve_target_disease(question, chat_session_id)))
+    stores_task = asyncio.create_task(timings.run("retriever_setup", _open_stores(user_id)))
+    embedding_task = asyncio.create_task(
+        timings.run("query_embedding", embedding_batcher.get_query_embeddings().aembed_query(question)))
+    search_task = None
+
+    try:
+        (base_store, user_store), embedding = await asyncio.gather(stores_task, embedding_task)
+        search_task = asyncio.ensure_future(asyncio.gather(
+            timings.run("base_search", _search(base_store, embedding)),
+            timings.run("user_search", _search(user_store, embedding)),
+        ))
+        target_disease, condition_decision = await disease_task
+        metrics.CONDITION_RESOLUTIONS.labels(condition_decision["cache"], condition_decision["source"]).inc()
+        diagnostics = {
+            "condition": target_disease,
+            "condition_cache": condition_decision["cache"],
+            "condition_source": condition_decision["source"],
+        }
+
+        cache_key = None
+        if answer_cache.is_enabled():
+            cache_key = (user_id, to_label(target_disease), embedding, vs.kb_version(user_id))
+            cached, similarity = answer_cache.get_cache().lookup(*cache_key)
+            diagnostics["answer_cache"] = "hit" if cached else "miss"
+            metrics.ANSWER_CACHE_LOOKUPS.labels(diagnostics["answer_cache"]).inc()
+            diagnostics["answer_cache_similarity"] = similarity
+            if cached is not None:
+                return {"prompt": None, "diagnostics": diagnostics, "cached": cached, "cache_key": None}
+
+        base_docs, user_docs = await search_task
+    finally:
+        for task in (disease_task, stores_task, embedding_task, search_task):
+            if task is not None:
+                task.cancel()
+
+    from langchain.prompts import PromptTemplate
+
     custom_prompt = PromptTemplate(
-        template=behavior_template,
+        template=get_behavior_template(target_disease),
         input_variables=["context", "chat_history", "question"]
     )
+    context = "\n\n".join(doc.page_content for doc in _merge_documents(base_docs, user_docs))
+    prompt = custom_prompt.format(context=context, chat_history="", question=question)
+    return {"prompt": prompt, "diagnostics": diagnostics, "cached": None, "cache_key": cache_key}
 
-    qa_chain = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=retriever,
-        memory=memory,
-        combine_docs_chain_kwargs={"prompt": custom_prompt},
-        return_source_documents=True
-    )
+def _is_insufficient(answer: str) -> bool:
+    return not answer or any(phrase.lower() in answer.lower() for phrase in RAG_FAILURE_PHRASES)
 
-    response = qa_chain({"question": question})
-    answer = response.get("answer", "")
+async def aget_rag_response(question: str, user_id: str, chat_session_id: str) -> dict:
+    timings = StageTimings()
+    plan = await _aprepare_generation(question, user_id, chat_session_id, timings)
+    if plan["cached"] is not None:
+        result = plan["cached"]
+        result["diagnostics"] = {**plan["diagnostics"], **timings.report()}
+        return result
 
-    if not answer or any(phrase.lower() in answer.lower() for phrase in RAG_FAILURE_PHRASES):
+    response = await timings.run("generation", get_llm().ainvoke(plan["prompt"]))
+    metrics.record_llm_usage(response, "generation")
+    answer = response.content or ""
+
+    if _is_insufficient(answer):
         print("RAG response insufficient. Falling back to direct LLM.")
-        answer = get_direct_llm_response(question)
-    
-    return parse_response_for_image(answer)
\ No newline at end of file
+        metrics.RAG_FALLBACKS.labels("get_response").inc()
+        answer = await timings.run("fallback_generation", aget_direct_llm_response(question, call="fallback"))
+
+    # Image matching may call the embedding API, so it runs off the event loop.
+    result = await timings.run("image_lookup", concurrency.run_search(parse_response_for_image, answer))
+    if plan["cache_key"] is not None:
+        answer_cache.get_cache().store(*plan["cache_key"], result)
+    result["diagnostics"] = {**plan["diagnostics"], **timings.report()}
+    return result
+
+# --- Streaming ---
+class ImageTagFilter:
+    """
+    Strips `[IMAGE: ...]` tags from a token stream as it is produced. Text that
+    might be the start of a tag is held back until it is either a complete tag
+    or clearly not one.
+    """
+    TAG_PREFIX = "[IMAGE:"
+    MAX_TAG_LENGTH = 200
+
+    def __init__(self):
+        self._buffer = ""
+        self.queries = []
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        output = []
+        while self._buffer:
+            start = self._buffer.find("[")
+            if start == -1:
+                output.append(self._buffer)
+                self._buffer = ""
+                break
+            output.append(self._buffer[:start])
+            self._buffer = self._buffer[start:]
+
+            if len(self._buffer) < len(self.TAG_PREFIX):
+                if self.TAG_PREFIX.startswith(self._buffer):
+                    break  # Could still become a tag; wait for more tokens.
+            elif self._buffer.startswith(self.TAG_PREFIX):
+                end = self._buffer.find("]")
+                if end != -1:
+                    self.queries.append(self._buffer[len(self.TAG_PREFIX):end].strip())
+                    self._buffer = self._buffer[end + 1:]
+                    continue
+                if len(self._buffer) <= self.MAX_TAG_LENGTH:
+                    break  # Inside a tag; wait for the closing bracket.
+            # Not a tag: release the bracket as ordinary text.
+            output.append("[")
+            self._buffer = self._buffer[1:]
+        return "".join(output)
+
+    def flush(self) -> str:
+        remainder, self._buffer = self._buffer, ""
+        return remainder
+
+async def _astream_answer(stream, tag_filter: ImageTagFilter, parts: list, call: str):
+    async for chunk in stream:
+        metrics.record_llm_usage(chunk, call)  # Usage arrives on the final chunk.
+        text = tag_filter.feed(chunk.content or "")
+        if text:
+            parts.append(text)
+            yield text
+    remainder = tag_filter.flush()
+    if remainder:
+        parts.append(remainder)
+        yield remainder
+
+async def astream_rag_response(question: str, user_id: str, chat_session_id: str):
+    """
+    Streams the answer as events: ("token", text) while generating, ("reset", None)
+    if the answer is discarded for the direct-LLM fallback, and finally
+    ("done", {"answer", "image_url", "diagnostics"}).
+    """
+    timings = StageTimings("chat_stream")
+    plan = await _aprepare_generation(question, user_id, chat_session_id, timings)
+    if plan["cached"] is not None:
+        yield "token", plan["cached"]["answer"]
+        yield "done", {**plan["cached"], "diagnostics": {**plan["diagnostics"], **timings.report()}}
+        return
+
+    tag_filter, parts = ImageTagFilter(), []
+    generation_start = timings.now()
+    first_token_ms = None
+    async for text in _astream_answer(get_llm().astream(plan["prompt"]), tag_filter, parts, "generation"):
+        if first_token_ms is None:
+            first_token_ms = round(timings.now(), 1)
+        yield "token", text
+    timings.record("generation", generation_start)
+
+    if _is_insufficient("".join(parts)):
+        print("RAG response insufficient. Falling back to direct LLM.")
+        metrics.RAG_FALLBACKS.labels("stream_response").inc()
+        yield "reset", None
+        tag_filter, parts = ImageTagFilter(), []
+        fallback_start = timings.now()
+        async for text in _astream_answer(get_llm().astream(question), tag_filter, parts, "fallback"):
+            yield "token", text
+        timings.record("fallback_generation", fallback_start)
+
+    image_url = None
+    if tag_filter.queries:
+        image_url = await timings.run("image_lookup", concurrency.run_search(find_image_url, tag_filter.queries[0]))
+
+    result = {"answer": "".join(parts).strip(), "image_url": image_url}
+    if plan["cache_key"] is not None:
+        answer_cache.get_cache().store(*plan["cache_key"], result)
+    yield "done", {
+        **result,
+        "diagnostics": {**plan["diagnostics"], "first_token_ms": first_token_ms, **timings.report()},
+    }
+
+# --- Sync Entry Point ---
+# Sync callers (the chat router, the admin UI) share one long-lived event loop
+# so the pooled async HTTP clients are reused across requests.
+_background_loop = None
+_background_lock = threading.Lock()
+
+def _get_background_loop():
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="rag-event-loop", daemon=True).start()
+        return _background_loop
+
+def get_rag_response(question: str, user_id: str, chat_session_id: str) -> dict:
+    future = asyncio.run_coroutine_threadsafe(
+        aget_rag_response(question, user_id, chat_session_id), _get_background_loop())
+    return future.result()
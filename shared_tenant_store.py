@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import shutil
+import argparse
+import threading
+from dotenv import load_dotenv
+import quantized_store
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- UNIFIED PATH CONFIGURATION ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
+PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
+SHARED_TENANT_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstore_tenants")
+MIGRATED_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstores_user_migrated")
+
+# --- Layout Configuration ---
+# "per_user": one Chroma directory per tenant (vectorstores_user/user_<id>).
+# "shared": every tenant's chunks live in TENANT_SHARDS collections, tagged
+# with tenant_id and searched with a tenant filter. Each shard is its own
+# Chroma directory (vectorstore_tenants/shard_<n>), so a write only affects
+# the other workers' copy of that shard. Tenants that still have a per-user
+# store keep using it until migrated with `python shared_tenant_store.py migrate`.
+TENANT_STORE_LAYOUT = os.environ.get("TENANT_STORE_LAYOUT", "per_user")
+TENANT_SHARDS = int(os.environ.get("TENANT_SHARDS", 8))
+TENANT_FIELD = "tenant_id"
+# Chroma loads a collection's index once per process, so a worker reopens a
+# shard when another process (e.g. another uvicorn worker) has written to it.
+# Checked at most this often per shard, which also bounds how often a shard
+# is reloaded while other workers are ingesting into it.
+SHARED_TENANT_RELOAD_CHECK_SECONDS = float(os.environ.get("SHARED_TENANT_RELOAD_CHECK_SECONDS", 5))
+# A reopened shard's previous client is stopped once in-flight searches on it
+# have had this long to finish (same setting as for evicted per-user stores).
+RELEASE_GRACE_SECONDS = float(os.environ.get("RETRIEVER_RELEASE_GRACE_SECONDS", 30))
+# Chroma rejects very large batches; migration upserts at most this many rows at once.
+UPSERT_BATCH_SIZE = 4000
+
+_shards = {}  # shard -> {"client", "generation", "stamp", "checked"}
+_generations = {}
+_shards_lock = threading.Lock()
+
+
+def shard_for(tenant_id: str) -> int:
+    """Stable shard number of a tenant (independent of process and restart)."""
+    return zlib.crc32(str(tenant_id).encode("utf-8")) % TENANT_SHARDS
+
+
+def collection_name(shard: int) -> str:
+    return f"tenants_shard_{shard:03d}"
+
+
+def shard_dir(shard: int) -> str:
+    return os.path.join(SHARED_TENANT_DIR, f"shard_{shard:03d}")
+
+
+def _stamp(shard: int):
+    stamps = []
+    for name in ("chroma.sqlite3", "chroma.sqlite3-wal"):
+        try:
+            stamps.append(os.path.getmtime(os.path.join(shard_dir(shard), name)))
+        except OSError:
+            pass
+    return max(stamps, default=None)
+
+
+def _retire(client):
+    """
+    Detaches a shard's client from Chroma's per-directory registry, so the
+    next client loads the shard afresh, and stops its system (SQLite handles,
+    HNSW segments) after RELEASE_GRACE_SECONDS.
+    """
+    identifier = getattr(client, "_identifier", None)
+    try:
+        from chromadb.api.client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+    except Exception as e:
+        print(f"Could not detach shared tenant store client at {identifier}: {e}")
+        return
+    if system is not None:
+        timer = threading.Timer(RELEASE_GRACE_SECONDS, system.stop)
+        timer.daemon = True
+        timer.start()
+
+
+def _shard_state(shard: int, force_check: bool = False) -> dict:
+    """
+    The open client of a shard, reopened when another process has written to
+    the shard since it was opened. The check runs at most every
+    SHARED_TENANT_RELOAD_CHECK_SECONDS, or always with `force_check`.
+    """
+    import chromadb
+    with _shards_lock:
+        now = time.monotonic()
+        state = _shards.get(shard)
+        if state is not None and (force_check or now - state["checked"] >= SHARED_TENANT_RELOAD_CHECK_SECONDS):
+            state["checked"] = now
+            stamp = _stamp(shard)
+            if stamp is not None and (state["stamp"] is None or stamp > state["stamp"]):
+                print(f"Shared tenant shard {shard} changed on disk; reopening it.")
+                _retire(state["client"])
+                state = None
+        if state is None:
+            os.makedirs(shard_dir(shard), exist_ok=True)
+            _generations[shard] = _generations.get(shard, 0) + 1
+            state = {"client": chromadb.PersistentClient(path=shard_dir(shard)),
+                     "generation": _generations[shard], "stamp": _stamp(shard), "checked": now}
+            _shards[shard] = state
+        return state
+
+
+def get_client(shard: int, force_check: bool = False):
+    """The process-wide Chroma client of a shard, opened on first use."""
+    return _shard_state(shard, force_check)["client"]
+
+
+def generation(shard: int) -> int:
+    """
+    Bumped each time this process reopens the shard, i.e. after another
+    process wrote to it. Cached per-tenant results for the shard are stale
+    once it moves.
+    """
+    return _shard_state(shard)["generation"]
+
+
+def note_write(shard: int):
+    """Records this process's own write, so it does not trigger a reopen."""
+    with _shards_lock:
+        if shard in _shards:
+            _shards[shard]["stamp"] = _stamp(shard)
+
+
+class TenantView:
+    """
+    One tenant's slice of its shard, with the subset of the Chroma store API
+    the app uses. Writes tag every chunk with the tenant id, reads and
+    searches filter on it, and chunk ids are namespaced per tenant on disk
+    (callers see their own ids). Every call goes through the shard's current
+    client, so a cached view follows the shard when it is reopened.
+    """
+    def __init__(self, tenant_id: str, embedding_function=None):
+        self.tenant_id = str(tenant_id)
+        self.shard = shard_for(self.tenant_id)
+        self.embedding_function = embedding_function
+        self._prefix = f"{self.tenant_id}:"
+        self._store = (None, None)  # (shard generation, LangChain Chroma store)
+
+    def store(self, force_check: bool = False):
+        """The LangChain Chroma store over the shard's current client."""
+        state = _shard_state(self.shard, force_check)
+        cached_generation, store = self._store
+        if cached_generation != state["generation"]:
+            from langchain_chroma import Chroma
+            store = Chroma(client=state["client"], collection_name=collection_name(self.shard),
+                           embedding_function=self.embedding_function)
+            self._store = (state["generation"], store)
+        return store
+
+    def _key(self, chunk_id: str) -> str:
+        return self._prefix + chunk_id
+
+    def _strip(self, key: str) -> str:
+        return key[len(self._prefix):] if key.startswith(self._prefix) else key
+
+    def _filter(self, where: dict | None = None) -> dict:
+        clause = {TENANT_FIELD: self.tenant_id}
+        if not where:
+            return clause
+        return {"$and": [clause] + [{key: value} for key, value in where.items()]}
+
+    def _tag(self, metadata: dict | None) -> dict:
+        return {**(metadata or {}), TENANT_FIELD: self.tenant_id}
+
+    # --- Writes ---
+    # Writes always check for other processes' writes first, so they are not
+    # made on top of an outdated copy of the shard's index.
+    def add_texts(self, texts: list, metadatas: list | None = None, ids: list | None = None, **kwargs) -> list:
+        texts = list(texts)
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        metadatas = [self._tag(m) for m in (metadatas or [{} for _ in texts])]
+        self.store(force_check=True).add_texts(texts, metadatas=metadatas, ids=[self._key(i) for i in ids])
+        note_write(self.shard)
+        return ids
+
+    def add_documents(self, documents: list, ids: list | None = None, **kwargs) -> list:
+        return self.add_texts([d.page_content for d in documents], [d.metadata for d in documents], ids=ids)
+
+    def add_vectors(self, ids: list, vectors, texts: list, metadatas: list):
+        """Upserts rows with precomputed embeddings (used by migration)."""
+        collection = get_client(self.shard, force_check=True).get_or_create_collection(
+            collection_name(self.shard), embedding_function=None)
+        for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+            collection.upsert(
+                ids=[self._key(chunk_id) for chunk_id in ids[i:i + UPSERT_BATCH_SIZE]],
+                embeddings=[list(map(float, v)) for v in vectors[i:i + UPSERT_BATCH_SIZE]],
+                documents=texts[i:i + UPSERT_BATCH_SIZE],
+                metadatas=[self._tag(m) for m in metadatas[i:i + UPSERT_BATCH_SIZE]],
+            )
+        note_write(self.shard)
+
+    def delete(self, ids: list | None = None, **kwargs):
+        if ids:
+            self.store(force_check=True).delete(ids=[self._key(chunk_id) for chunk_id in ids])
+            note_write(self.shard)
+
+    # --- Reads ---
+    def get(self, where: dict | None = None, include: list | None = None, limit: int | None = None,
+            offset: int | None = None, **kwargs) -> dict:
+        options = {"include": include} if include is not None else {}
+        result = self.store().get(where=self._filter(where), limit=limit, offset=offset, **options)
+        result["ids"] = [self._strip(key) for key in result["ids"]]
+        return result
+
+    def has_documents(self) -> bool:
+        return bool(self.store().get(where=self._filter(), limit=1, include=[])["ids"])
+
+    def _own(self, documents: list) -> list:
+        for document in documents:
+            if getattr(document, "id", None):
+                document.id = self._strip(document.id)
+        return documents
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        return self._own(self.store().similarity_search_by_vector(embedding, k, filter=self._filter()))
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return self._own(self.store().similarity_search(query, k, filter=self._filter()))
+
+    def as_retriever(self, search_kwargs: dict | None = None):
+        # Searches through the view rather than a store, so it follows reopens too.
+        from base_index import make_retriever
+        return make_retriever(self, (search_kwargs or {}).get("k", 4))
+
+
+# --- Migration (offline) ---
+def _open_per_user_store(user_id: str, directory: str):
+    if quantized_store.exists(directory):
+        return quantized_store.QuantizedStore(directory)
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=directory, collection_name=f"user_{user_id}_knowledge")
+
+
+def migrate(user_ids: list | None, delete: bool) -> list:
+    """
+    Moves each per-user store (Chroma or compact) into its shard, embeddings
+    included, so nothing is re-embedded. Migrated directories are moved to
+    MIGRATED_DIR, or deleted with `delete`. Run it while the app is stopped.
+    """
+    report = []
+    for user_id, directory in quantized_store.tenant_dirs(user_ids):
+        if not (quantized_store.exists(directory) or os.path.exists(os.path.join(directory, "chroma.sqlite3"))):
+            continue
+        start = time.perf_counter()
+        rows = quantized_store.read_rows(_open_per_user_store(user_id, directory))
+        view = TenantView(user_id)
+        view.add_vectors(rows["ids"], rows["embeddings"], rows["documents"], rows["metadatas"])
+        migrated = len(view.get(include=[])["ids"])
+        if migrated < len(rows["ids"]):
+            raise RuntimeError(f"Tenant {user_id}: {migrated} of {len(rows['ids'])} chunks in the shared store.")
+
+        if delete:
+            shutil.rmtree(directory)
+        else:
+            os.makedirs(MIGRATED_DIR, exist_ok=True)
+            shutil.move(directory, os.path.join(MIGRATED_DIR, os.path.basename(directory)))
+        report.append({"user_id": user_id, "shard": shard_for(user_id), "chunks": len(rows["ids"]),
+                       "seconds": round(time.perf_counter() - start, 2)})
+        print(json.dumps(report[-1]))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared, sharded multi-tenant vector store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="Move per-user stores into the shared shards")
+    migrate_parser.add_argument("--users", help="Comma-separated user ids (default: every tenant)")
+    migrate_parser.add_argument("--delete", action="store_true",
+                                help=f"Delete migrated directories instead of moving them to {MIGRATED_DIR}")
+    args = parser.parse_args()
+    print(json.dumps(migrate(args.users.split(",") if args.users else None, args.delete), indent=2))
@@ -1,15 +1,36 @@
 import streamlit as st
 import requests
 import uuid
+import json
+import hashlib
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 import database as db # Import your database module
+from ui_jobs import wait_for_job
 
 # --- Configuration ---
 API_URL = "http://127.0.0.1:8000"
 
+# --- Server-Sent Events ---
+def iter_sse_events(response):
+    """
+    Yields (event, data) pairs from a streaming text/event-stream response.
+    """
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
 # --- Page Configuration ---
 st.set_page_config(page_title="AI Nutrition Assistant", layout="wide")
 
@@ -93,7 +114,18 @@ else:
         label_visibility="collapsed"
     )
 
-    if uploaded_file is not None:
+    # The uploader keeps returning the same file on every rerun, so remember
+    # what this session already sent instead of posting it again. A file is
+    # recorded when it is sent, so a failed upload is only re-sent on Retry.
+    if 'uploaded_hashes' not in st.session_state:
+        st.session_state.uploaded_hashes = set()
+    if 'upload_error' not in st.session_state:
+        st.session_state.upload_error = None  # (upload hash, message)
+    upload_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest() if uploaded_file is not None else None
+
+    if uploaded_file is not None and upload_hash not in st.session_state.uploaded_hashes:
+        st.session_state.uploaded_hashes.add(upload_hash)
+        st.session_state.upload_error = None
         with st.spinner(f"Processing {uploaded_file.name}..."):
             try:
                 files = {'file': (uploaded_file.name, uploaded_file, uploaded_file.type)}
@@ -105,12 +137,26 @@ else:
                     data=payload
                 )
                 
-                if response.status_code == 200:
-                    st.sidebar.success(f"✅ Successfully trained on {uploaded_file.name}!")
+                if response.status_code in (200, 202) and response.json()["status"] == "duplicate":
+                    st.sidebar.info(response.json()["detail"])
+                elif response.status_code in (200, 202):
+                    job = wait_for_job(API_URL, response.json()["job_id"], st.sidebar.empty())
+                    if job["status"] == "succeeded":
+                        st.sidebar.success(f"✅ Successfully trained on {uploaded_file.name}!")
+                    else:
+                        st.session_state.upload_error = (
+                            upload_hash, f"Error: {job.get('error') or 'processing did not finish'}")
                 else:
-                    st.sidebar.error(f"Error: {response.text}")
+                    st.session_state.upload_error = (upload_hash, f"Error: {response.text}")
             except Exception as e:
-                st.sidebar.error(f"An error occurred: {e}")
+                st.session_state.upload_error = (upload_hash, f"An error occurred: {e}")
+
+    if st.session_state.upload_error is not None and st.session_state.upload_error[0] == upload_hash:
+        st.sidebar.error(st.session_state.upload_error[1])
+        if st.sidebar.button("Retry upload"):
+            st.session_state.uploaded_hashes.discard(upload_hash)
+            st.session_state.upload_error = None
+            st.rerun()
 
 # --- Chat Interface ---
 if st.session_state.logged_in:
@@ -124,27 +170,42 @@ if st.session_state.logged_in:
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    response = requests.post(
-                        f"{API_URL}/chat/get_response",
-                        json={
-                            "username": st.session_state.username,
-                            "question": prompt,
-                            "session_id": st.session_state.session_id
-                        }
-                    )
+            placeholder = st.empty()
+            placeholder.markdown("Thinking...")
+            try:
+                # Stream the answer so text appears as soon as the model produces it.
+                with requests.post(
+                    f"{API_URL}/chat/stream_response",
+                    json={
+                        "username": st.session_state.username,
+                        "question": prompt,
+                        "session_id": st.session_state.session_id
+                    },
+                    stream=True,
+                    timeout=(10, 300)
+                ) as response:
                     if response.status_code == 200:
-                        response_data = response.json()
-                        answer = response_data.get("answer")
-                        image_url = response_data.get("image_url") # <-- Get the image URL
-
-                        st.markdown(answer) # Display the text
+                        answer, image_url = "", None
+                        for event, data in iter_sse_events(response):
+                            if event == "token":
+                                answer += data.get("text", "")
+                                placeholder.markdown(answer + "▌")
+                            elif event == "reset":
+                                answer = ""
+                                placeholder.markdown("Thinking...")
+                            elif event == "done":
+                                answer = data.get("answer", answer)
+                                image_url = data.get("image_url") # <-- Get the image URL
+                            elif event == "error":
+                                st.error(f"Failed to get a response from the bot: {data.get('detail')}")
+
+                        placeholder.markdown(answer) # Display the text
                         if image_url: # <-- If an image URL was sent
                             st.image(image_url) # <-- Display the image!
                     
                         st.session_state.messages.append({"role": "assistant", "content": answer})
                     else:
+                        placeholder.empty()
                         st.error("Failed to get a response from the bot.")
-                except requests.exceptions.RequestException as e:
-                    st.error(f"Could not connect to the API: {e}")
\ No newline at end of file
+            except requests.exceptions.RequestException as e:
+                st.error(f"Could not connect to the API: {e}")
@@ -0,0 +1,23 @@
+import time
+import requests
+
+# --- Ingestion Job Polling (shared by the Streamlit UIs) ---
+JOB_POLL_SECONDS = 1.0
+JOB_POLL_TIMEOUT_SECONDS = 1800
+
+
+def wait_for_job(api_url: str, job_id: str, placeholder) -> dict:
+    """
+    Polls GET /jobs/{job_id} until the upload has been processed, showing
+    progress in `placeholder`. Returns the final job status.
+    """
+    deadline = time.time() + JOB_POLL_TIMEOUT_SECONDS
+    while True:
+        job = requests.get(f"{api_url}/jobs/{job_id}", timeout=10).json()
+        if job["status"] in ("succeeded", "failed") or time.time() > deadline:
+            return job
+        if job["status"] == "embedding":
+            placeholder.info(f"Embedding {job['chunks_embedded']}/{job['chunks_partitioned']} chunks...")
+        else:
+            placeholder.info(f"{job['status'].capitalize()}...")
+        time.sleep(JOB_POLL_SECONDS)
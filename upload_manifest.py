@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- UNIFIED PATH CONFIGURATION ---
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_DATA_PATH = os.path.join(APP_DIR, "data")
+PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
+MANIFESTS_DIR = os.path.join(PERSISTENT_DISK_PATH, "manifests")
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _manifest_path(user_id: str) -> str:
+    return os.path.join(MANIFESTS_DIR, f"user_{user_id}.json")
+
+
+def tenant_lock(user_id: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(str(user_id), threading.Lock())
+
+
+@contextmanager
+def _exclusive(user_id: str):
+    # The thread lock serializes writers in this process; the flock on a
+    # sidecar lock file serializes them across worker processes.
+    os.makedirs(MANIFESTS_DIR, exist_ok=True)
+    with tenant_lock(user_id), open(f"{_manifest_path(user_id)}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load(user_id: str) -> dict:
+    """
+    Returns the tenant's manifest: {filename: {"sha256", "chunks", "job_id", "ingested_at"}}.
+    """
+    try:
+        with open(_manifest_path(user_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def find_by_hash(user_id: str, content_hash: str) -> tuple:
+    """Returns (filename, entry) of an already ingested document with this content, or (None, None)."""
+    for filename, entry in load(user_id).items():
+        if entry.get("sha256") == content_hash:
+            return filename, entry
+    return None, None
+
+
+def record(user_id: str, filename: str, content_hash: str, chunks: int, job_id: str | None = None):
+    """Records `filename` as ingested with `content_hash`, replacing any earlier version."""
+    with _exclusive(user_id):
+        manifest = load(user_id)
+        manifest[filename] = {
+            "sha256": content_hash,
+            "chunks": chunks,
+            "job_id": job_id,
+            "ingested_at": time.time(),
+        }
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=MANIFESTS_DIR, delete=False,
+                                         prefix=f"user_{user_id}.", suffix=".tmp") as f:
+            json.dump(manifest, f, indent=2)
+        try:
+            os.replace(f.name, _manifest_path(user_id))
+        except OSError:
+            os.remove(f.name)
+            raise
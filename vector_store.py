@@ -1,8 +1,14 @@
 import os
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain.retrievers import MergerRetriever # <-- New Import
+from cache import LRUTTLCache
+import embedding_batcher
+import base_index
+import quantized_store
+import shared_tenant_store
 
 # --- Load environment variables ---
 load_dotenv()
@@ -15,41 +21,371 @@ PERSISTENT_DISK_PATH = os.environ.get("PERSISTENT_DISK_PATH", LOCAL_DATA_PATH)
 # --- Vector Store Paths ---
 BASE_INDEX_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstore_base")
 USER_STORES_DIR = os.path.join(PERSISTENT_DISK_PATH, "vectorstores_user")
+BASE_COLLECTION_NAME = "base_knowledge"
+
+# --- Base Index Backend ---
+# "chroma" searches the base collection through Chroma in every worker.
+# "mmap" searches the export written by build_base_db (see base_index.py),
+# which all workers share through the page cache. "auto" uses the export when
+# there is one and it is not older than the Chroma store, and Chroma otherwise.
+BASE_INDEX_BACKEND = os.environ.get("BASE_INDEX_BACKEND", "auto")
+
+# --- Retriever Cache Configuration ---
+# Opened tenant stores are kept in a bounded LRU cache so a chat turn does not
+# reopen Chroma from disk. The budget is expressed both as a number of open
+# stores (file handles) and as the on-disk size of those stores in MB, which is
+# a reasonable proxy for the memory their indexes take once loaded.
+RETRIEVER_CACHE_MAX_TENANTS = int(os.environ.get("RETRIEVER_CACHE_MAX_TENANTS", 64))
+RETRIEVER_CACHE_MAX_MB = float(os.environ.get("RETRIEVER_CACHE_MAX_MB", 512))
+RETRIEVER_CACHE_TTL_SECONDS = float(os.environ.get("RETRIEVER_CACHE_TTL_SECONDS", 900))
+# Evicted stores are only closed after this grace period so in-flight searches finish.
+RETRIEVER_RELEASE_GRACE_SECONDS = float(os.environ.get("RETRIEVER_RELEASE_GRACE_SECONDS", 30))
+RETRIEVER_K = 3
+
+_base_store = None  # (base source version, Chroma store)
+_base_checked = 0.0
+_base_retriever = None
+_base_lock = threading.Lock()
+_base_backend = None
+_pinned_tenants = Counter()
+_pin_lock = threading.Lock()
+_tenant_generations = Counter()
+
+
+def _get_embedding_function():
+    # Query embeddings from retrievers are micro-batched across concurrent chats.
+    return embedding_batcher.get_query_embeddings()
+
+
+def _open_chroma(persist_directory: str, collection_name: str, embedding_function=None):
+    # langchain_chroma pulls in chromadb and its dependencies, so it is imported
+    # when the first store is opened rather than when this module is.
+    from langchain_chroma import Chroma
+    return Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding_function or _get_embedding_function(),
+        collection_name=collection_name
+    )
+
+
+def _user_index_dir(user_id: str) -> str:
+    return os.path.join(USER_STORES_DIR, f"user_{user_id}")
+
+
+def _open_tenant_store(user_id: str, embedding_function=None):
+    """
+    Opens a tenant's store in whatever format it was created in: a compact
+    store (see quantized_store.py) if there is one, otherwise Chroma. New
+    tenants get TENANT_STORE_FORMAT.
+    """
+    user_index_dir = _user_index_dir(user_id)
+    has_chroma = os.path.exists(os.path.join(user_index_dir, "chroma.sqlite3"))
+    if quantized_store.exists(user_index_dir) or (
+            not has_chroma and quantized_store.TENANT_STORE_FORMAT in quantized_store.COMPACT_FORMATS):
+        return quantized_store.QuantizedStore(user_index_dir, embedding_function or _get_embedding_function())
+    return _open_chroma(user_index_dir, f"user_{user_id}_knowledge", embedding_function)
+
+
+def _uses_shared_layout(user_id: str) -> bool:
+    # With TENANT_STORE_LAYOUT=shared, tenants without a per-user store (new
+    # or migrated ones) live in the shared, sharded collections.
+    return (shared_tenant_store.TENANT_STORE_LAYOUT == "shared"
+            and not os.path.exists(_user_index_dir(user_id)))
+
+
+def _shared_tenant_view(user_id: str, embedding_function=None):
+    return shared_tenant_store.TenantView(user_id, embedding_function or _get_embedding_function())
+
+
+def _directory_size_mb(path: str) -> float:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total / (1024 * 1024)
+
+
+def _release_store(store, grace_seconds: float = 0):
+    """
+    Best-effort release of the Chroma system (SQLite handles, HNSW segments)
+    behind a store. Chroma shares one system per persist directory, so it is
+    removed from that registry at once (the next open of the directory loads
+    it afresh) and stopped after `grace_seconds`, letting in-flight searches
+    on it finish.
+    """
+    client = getattr(store, "_client", None)
+    identifier = getattr(client, "_identifier", None)
+    if identifier is None:
+        return
+    try:
+        from chromadb.api.client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+    except Exception as e:
+        print(f"Could not release vector store at {identifier}: {e}")
+        return
+    if system is None:
+        return
+    if grace_seconds <= 0:
+        system.stop()
+        return
+    timer = threading.Timer(grace_seconds, system.stop)
+    timer.daemon = True
+    timer.start()
+
+
+def _on_tenant_evicted(user_id: str, entry: dict, reason: str):
+    store = entry.get("store")
+    if store is None:
+        return
+
+    def release():
+        # The tenant may have been reopened or be mid-write since it was evicted.
+        with _pin_lock:
+            if _pinned_tenants[user_id] or user_id in _tenant_cache:
+                return
+        _release_store(store)
+
+    timer = threading.Timer(RETRIEVER_RELEASE_GRACE_SECONDS, release)
+    timer.daemon = True
+    timer.start()
+
+
+_tenant_cache = LRUTTLCache(
+    max_entries=RETRIEVER_CACHE_MAX_TENANTS,
+    ttl_seconds=RETRIEVER_CACHE_TTL_SECONDS,
+    max_weight=RETRIEVER_CACHE_MAX_MB,
+    weigher=lambda user_id, entry: entry["size_mb"],
+    on_evict=_on_tenant_evicted,
+)
+
+
+def _get_mmap_base_index():
+    if BASE_INDEX_BACKEND == "chroma":
+        return None
+    index = base_index.get_index(_get_embedding_function())
+    if BASE_INDEX_BACKEND == "mmap":
+        if index is None:
+            raise RuntimeError("BASE_INDEX_BACKEND=mmap but no base index has been exported. "
+                               "Run build_base_db.py or `python base_index.py`.")
+        return index
+    if index is None or base_index.is_stale():
+        _note_base_backend("chroma", "no base index export" if index is None else
+                           f"base index export {base_index.version()} is older than the base collection")
+        return None
+    _note_base_backend("mmap", f"base index export {base_index.version()}")
+    return index
+
+
+def _note_base_backend(backend: str, reason: str):
+    # Logged when auto mode switches between the export and Chroma, not per search.
+    global _base_backend
+    if backend != _base_backend:
+        _base_backend = backend
+        print(f"Base knowledge searches use {'Chroma' if backend == 'chroma' else 'the memory-mapped index'} "
+              f"({reason}).")
+
+
+def _get_base_chroma():
+    """
+    The base Chroma collection, reopened when another process (build_base_db.py,
+    an admin upload) has written to it since it was opened. Checked at most
+    every BASE_INDEX_RELOAD_CHECK_SECONDS.
+    """
+    global _base_store, _base_checked
+    with _base_lock:
+        now = time.monotonic()
+        if _base_store is not None and (now - _base_checked < base_index.BASE_INDEX_RELOAD_CHECK_SECONDS
+                                        or base_index.write_in_progress()):
+            return _base_store[1]
+        _base_checked = now
+        source_version = base_index.read_source_version()
+        if _base_store is not None and _base_store[0] != source_version:
+            print("Base knowledge collection changed; reopening it.")
+            _release_store(_base_store[1], RETRIEVER_RELEASE_GRACE_SECONDS)
+            _base_store = None
+        if _base_store is None:
+            _base_store = (source_version, _open_chroma(BASE_INDEX_DIR, BASE_COLLECTION_NAME))
+        return _base_store[1]
+
+
+def get_base_store():
+    """
+    Returns the process-wide handle on the foundational knowledge base: the
+    memory-mapped export or the Chroma collection, per BASE_INDEX_BACKEND.
+    """
+    index = _get_mmap_base_index()
+    if index is not None:
+        return index
+    return _get_base_chroma()
+
+
+def get_base_retriever():
+    global _base_retriever
+    store = get_base_store()
+    # Rebuilt when the base store changes (a new export, or a fallback to Chroma).
+    if _base_retriever is None or _base_retriever[0] is not store:
+        _base_retriever = (store, store.as_retriever(search_kwargs={"k": RETRIEVER_K}))
+    return _base_retriever[1]
+
+
+def _open_user_store(user_id: str, create: bool = False) -> dict:
+    entry = _open_user_store_entry(user_id, create)
+    # Taken after opening, in case opening the store touches its files.
+    entry["stamp"] = _cache_stamp(user_id)
+    return entry
+
+
+def _open_user_store_entry(user_id: str, create: bool = False) -> dict:
+    if _uses_shared_layout(user_id):
+        view = _shared_tenant_view(user_id)
+        if not view.has_documents():
+            return {"store": None, "retriever": None, "size_mb": 0}
+        # The shard's index is shared by all its tenants, so a view weighs nothing.
+        return {"store": view, "retriever": view.as_retriever(search_kwargs={"k": RETRIEVER_K}), "size_mb": 0}
+
+    user_index_dir = _user_index_dir(user_id)
+    if not os.path.exists(user_index_dir) and not create:
+        return {"store": None, "retriever": None, "size_mb": 0}
+
+    print(f"Loading custom knowledge base for user_id: {user_id}")
+    os.makedirs(user_index_dir, exist_ok=True)
+    store = _open_tenant_store(user_id)
+    return {
+        "store": store,
+        "retriever": store.as_retriever(search_kwargs={"k": RETRIEVER_K}),
+        "size_mb": _directory_size_mb(user_index_dir),
+    }
+
+
+def _get_tenant_entry(user_id: str) -> dict:
+    """
+    Returns the cached store entry for a tenant. Writes only invalidate the
+    cache of the process that made them, so an entry whose store has changed
+    on disk since it was opened (e.g. an upload handled by another worker) is
+    reopened, as is a cached "no documents" entry once the tenant has some.
+    """
+    entry = _tenant_cache.get_or_create(user_id, lambda: _open_user_store(user_id))
+    with _pin_lock:
+        writing = bool(_pinned_tenants[user_id])
+    # A write in progress here invalidates the entry itself when it is done.
+    if writing or entry["stamp"] == _cache_stamp(user_id):
+        return entry
+    print(f"Knowledge base for user_id {user_id} changed on disk; reopening it.")
+    if entry["store"] is not None:
+        _release_store(entry["store"], RETRIEVER_RELEASE_GRACE_SECONDS)
+    _tenant_cache.invalidate(user_id)
+    return _tenant_cache.get_or_create(user_id, lambda: _open_user_store(user_id))
+
+
+def get_user_store(user_id: str):
+    """
+    Returns the cached store for a user's private knowledge base, or None if
+    the user has not uploaded any documents.
+    """
+    return _get_tenant_entry(str(user_id))["store"]
+
+
+def invalidate_user(user_id: str):
+    """
+    Drops a tenant's cached store and retriever. Called after their store is written to.
+    """
+    _tenant_generations[str(user_id)] += 1
+    _tenant_cache.invalidate(str(user_id))
+
+
+def _store_stamp(directory: str):
+    stamps = []
+    for name in ("chroma.sqlite3", "chroma.sqlite3-wal",
+                 quantized_store.STORE_FILE, f"{quantized_store.STORE_FILE}-wal"):
+        try:
+            stamps.append(os.path.getmtime(os.path.join(directory, name)))
+        except OSError:
+            pass
+    return max(stamps, default=None)
+
+
+def _tenant_stamp(user_id: str):
+    if _uses_shared_layout(user_id):
+        return _store_stamp(shared_tenant_store.shard_dir(shared_tenant_store.shard_for(user_id)))
+    return _store_stamp(_user_index_dir(user_id))
+
+
+def _cache_stamp(user_id: str):
+    # Shared-layout views always search their shard's current client, so their
+    # entries only need reopening (e.g. a cached "no documents") when this
+    # process has reopened the shard after another process wrote to it, not
+    # on every write to the shard.
+    if _uses_shared_layout(user_id):
+        return ("shard", shared_tenant_store.generation(shared_tenant_store.shard_for(user_id)))
+    return _tenant_stamp(user_id)
+
+
+def kb_version(user_id: str) -> tuple:
+    """
+    A cheap fingerprint of the knowledge a tenant's answers are based on: the
+    on-disk modification stamps of the base and tenant stores (which also
+    catch writes by other processes; a shared-layout tenant's stamp is that of
+    its shard), the loaded base index export and this process's write counter.
+    """
+    user_id = str(user_id)
+    return (_store_stamp(BASE_INDEX_DIR), base_index.version(), _tenant_stamp(user_id),
+            _tenant_generations[user_id])
+
+
+@contextmanager
+def tenant_write(user_id: str, embedding_function=None):
+    """
+    Yields a writable store for a tenant, embedding with `embedding_function`
+    (the query-time embeddings by default). The tenant is pinned open for the
+    duration of the write and its cache entry is invalidated afterwards.
+    """
+    user_id = str(user_id)
+    with _pin_lock:
+        _pinned_tenants[user_id] += 1
+    try:
+        if _uses_shared_layout(user_id):
+            yield _shared_tenant_view(user_id, embedding_function)
+        else:
+            os.makedirs(_user_index_dir(user_id), exist_ok=True)
+            yield _open_tenant_store(user_id, embedding_function)
+    finally:
+        with _pin_lock:
+            _pinned_tenants[user_id] -= 1
+            if not _pinned_tenants[user_id]:
+                del _pinned_tenants[user_id]
+        invalidate_user(user_id)
+
+
+def get_cache_stats() -> dict:
+    return {
+        "tenant_stores": _tenant_cache.stats(),
+        "base_store_open": _base_store is not None,
+        "base_index_backend": BASE_INDEX_BACKEND,
+        "base_index_version": base_index.version(),
+        "tenant_store_layout": shared_tenant_store.TENANT_STORE_LAYOUT,
+    }
 
-# --- Embedding Model ---
-EMBEDDING_MODEL = "text-embedding-3-small"
 
 def get_retriever(user_id: str):
     """
     Creates a hybrid retriever that searches both the base knowledge base
     and the specific user's private knowledge base.
     """
-    embedding_function = OpenAIEmbeddings(model=EMBEDDING_MODEL)
-    
     # 1. Load the foundational knowledge base retriever
-    base_db = Chroma(
-        persist_directory=BASE_INDEX_DIR,
-        embedding_function=embedding_function,
-        collection_name="base_knowledge"
-    )
-    base_retriever = base_db.as_retriever(search_kwargs={"k": 3})
+    base_retriever = get_base_retriever()
 
     # 2. Load the user-specific knowledge base if it exists
-    user_index_dir = os.path.join(USER_STORES_DIR, f"user_{user_id}")
-    
-    if os.path.exists(user_index_dir):
-        print(f"Loading custom knowledge base for user_id: {user_id}")
-        user_db = Chroma(
-            persist_directory=user_index_dir,
-            embedding_function=embedding_function,
-            collection_name=f"user_{user_id}_knowledge"
-        )
-        user_retriever = user_db.as_retriever(search_kwargs={"k": 3})
-        
+    entry = _get_tenant_entry(str(user_id))
+
+    if entry["retriever"] is not None:
         # 3. Create a MergerRetriever to search both simultaneously
-        hybrid_retriever = MergerRetriever(retrievers=[base_retriever, user_retriever])
+        from langchain.retrievers import MergerRetriever
+
+        hybrid_retriever = MergerRetriever(retrievers=[base_retriever, entry["retriever"]])
         return hybrid_retriever
     else:
         # If the user has no custom knowledge, return only the base retriever
-        print(f"No custom knowledge base found for user_id: {user_id}. Using base knowledge only.")
-        return base_retriever
\ No newline at end of file
+        return base_retriever
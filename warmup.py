@@ -0,0 +1,197 @@
+import os
+import time
+import asyncio
+import importlib
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+import database as db
+import concurrency
+import metrics
+
+# --- Load environment variables ---
+load_dotenv()
+
+# --- Warmup Configuration ---
+# Heavy dependencies are imported on first use and stores are opened on first
+# search, so a cold worker's first chat turn pays for all of it. With warmup
+# on, each worker does that work at startup and only reports ready (GET
+# /readyz) once it is done.
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+# How many of the most active tenants' stores to pre-open (capped by the
+# retriever cache size), counting only tenants active in the last N days.
+WARMUP_TENANTS = int(os.environ.get("WARMUP_TENANTS", 8))
+WARMUP_TENANT_ACTIVE_DAYS = float(os.environ.get("WARMUP_TENANT_ACTIVE_DAYS", 7))
+# A failed warmup (e.g. the base store could not be opened) is retried after this long.
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", 30))
+# Chat-turn counts are buffered in memory and written to users.db this often.
+TENANT_ACTIVITY_FLUSH_SECONDS = float(os.environ.get("TENANT_ACTIVITY_FLUSH_SECONDS", 30))
+
+WARMUP_QUERY = "healthy portion sizes"
+
+# Modules the chat path imports lazily, in the order they are first needed.
+CHAT_PATH_MODULES = [
+    "langchain_openai",
+    "langchain_chroma",
+    "langchain.retrievers",
+    "langchain.prompts",
+]
+
+_state = {"status": "starting", "started_at": None, "ready_at": None, "attempts": 0, "error": None,
+          "timings": {}}
+_activity = Counter()
+_activity_lock = threading.Lock()
+_tasks = []
+
+
+def import_modules(names: list) -> dict:
+    """Imports `names`, returning the seconds each took (0 if it was already loaded)."""
+    timings = {}
+    for name in names:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        timings[name] = round(time.perf_counter() - start, 3)
+        metrics.observe_stage("startup", f"import:{name}", timings[name])
+    return timings
+
+
+# --- Tenant Activity ---
+def note_chat(user_id: str):
+    """Counts a chat turn for `user_id`. Cheap; the counts are persisted by the flusher."""
+    with _activity_lock:
+        _activity[str(user_id)] += 1
+
+
+def _add_activity(turns_by_user: dict):
+    session = db.SessionLocal()
+    try:
+        db.add_tenant_activity(session, turns_by_user)
+    finally:
+        session.close()
+
+
+def _most_active_tenants(limit: int) -> list:
+    session = db.SessionLocal()
+    try:
+        return db.most_active_tenants(session, limit, WARMUP_TENANT_ACTIVE_DAYS)
+    finally:
+        session.close()
+
+
+async def flush_activity():
+    global _activity
+    with _activity_lock:
+        pending, _activity = _activity, Counter()
+    if not pending:
+        return
+    try:
+        await concurrency.run_db(_add_activity, dict(pending))
+    except Exception as e:
+        # Another worker may have inserted the same tenant first; retry next flush.
+        print(f"Could not record tenant activity: {e}")
+        with _activity_lock:
+            _activity.update(pending)
+
+
+async def _activity_flusher():
+    while True:
+        await asyncio.sleep(TENANT_ACTIVITY_FLUSH_SECONDS)
+        await flush_activity()
+
+
+# --- Warmup ---
+async def run() -> dict:
+    """
+    Does what the first chat turn would otherwise do: imports the lazy modules,
+    builds the chat clients and opens a connection to the API, opens the base
+    store and runs one search so its index is loaded, pre-opens the most active
+    tenants' stores and loads the image annotation index. Only a failure to
+    open the base store is fatal. Returns the seconds spent on each step.
+    """
+    import clients
+    import llm
+    import vector_store as vs
+    import embedding_batcher
+    import image_index
+
+    timings = {}
+
+    async def step(name: str, awaitable, required: bool = False):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        except Exception as e:
+            if required:
+                raise
+            print(f"Warmup step '{name}' failed (continuing): {e}")
+            return None
+        finally:
+            timings[name] = round(time.perf_counter() - start, 3)
+            metrics.observe_stage("startup", name, timings[name])
+
+    async def open_connection():
+        llm.get_llm()  # built for this event loop, which serves the chats
+        return await clients.aopen_connection()
+
+    async def open_and_touch(open_store, *args):
+        store = await concurrency.run_search(open_store, *args)
+        if store is not None and vector is not None:
+            await concurrency.run_search(store.similarity_search_by_vector, vector, 1)
+        return store
+
+    timings["imports"] = await asyncio.to_thread(import_modules, CHAT_PATH_MODULES)
+    await step("openai_connection", open_connection())
+    vector = await step("query_embedding", embedding_batcher.get_query_embeddings().aembed_query(WARMUP_QUERY))
+    await step("base_store", open_and_touch(vs.get_base_store), required=True)
+
+    tenants = await step("tenant_activity", concurrency.run_db(
+        _most_active_tenants, min(WARMUP_TENANTS, vs.RETRIEVER_CACHE_MAX_TENANTS)))
+    opened = 0
+    for user_id in tenants or []:
+        store = await step(f"tenant:{user_id}", open_and_touch(vs.get_user_store, user_id))
+        opened += store is not None
+    await step("image_index", asyncio.to_thread(image_index.get_index))
+    print(f"Warmup complete ({opened} tenant stores pre-opened): {timings}")
+    return timings
+
+
+async def _warm():
+    while True:
+        _state["attempts"] += 1
+        _state["status"] = "warming"
+        try:
+            _state["timings"] = await run()
+        except Exception as e:
+            _state.update(status="failed", error=str(e))
+            print(f"Warmup failed, retrying in {WARMUP_RETRY_SECONDS:.0f}s: {e}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+            continue
+        _state.update(status="ready", ready_at=time.time(), error=None)
+        return
+
+
+# --- Readiness ---
+def is_ready() -> bool:
+    return _state["status"] == "ready"
+
+
+def get_status() -> dict:
+    return {**_state, "ready": is_ready()}
+
+
+async def start():
+    """Starts warmup in the background (or marks the worker ready) and the activity flusher."""
+    _state.update(started_at=time.time(), attempts=0, error=None, timings={})
+    if WARMUP_ON_STARTUP:
+        _tasks.append(asyncio.create_task(_warm()))
+    else:
+        _state.update(status="ready", ready_at=time.time())
+    _tasks.append(asyncio.create_task(_activity_flusher()))
+
+
+async def stop():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    await flush_activity()
@@ -1,20 +1,34 @@
-from fastapi import APIRouter, HTTPException, Depends
+import json
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
 import database as db
 import rag
+import concurrency
+import metrics
+import warmup
 
 # --- Router Initialization ---
 chat_router = APIRouter()
 
-# --- Database Dependency ---
-def get_db():
+def _get_user_id(username: str) -> str | None:
+    """
+    Looks up a user's id with a short-lived session. Run on the DB executor.
+    """
     database = db.SessionLocal()
     try:
-        yield database
+        user = db.get_user(database, username)
+        return str(user.id) if user else None
     finally:
         database.close()
 
+async def _require_user_id(username: str) -> str:
+    user_id = await concurrency.run_db(_get_user_id, username)
+    if not user_id:
+        raise HTTPException(status_code=404, detail="User not found")
+    warmup.note_chat(user_id)
+    return user_id
+
 # --- Pydantic Models ---
 class ChatRequest(BaseModel):
     username: str
@@ -23,17 +37,59 @@ class ChatRequest(BaseModel):
 
 # --- Chat Endpoint ---
 @chat_router.post("/get_response")
-def get_chat_response(request: ChatRequest, database: Session = Depends(get_db)):
-    user = db.get_user(database, request.username)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def get_chat_response(request: ChatRequest, http_request: Request):
+    user_id = await _require_user_id(request.username)
 
     try:
-        response_data = rag.get_rag_response(
-            question=request.question,
-            user_id=str(user.id),
-            chat_session_id=request.session_id
-        )
+        async with concurrency.chat_slot():
+            response_data = await concurrency.cancel_on_disconnect(http_request, rag.aget_rag_response(
+                question=request.question,
+                user_id=user_id,
+                chat_session_id=request.session_id
+            ))
+        if metrics.DEBUG_TIMING_HEADER:
+            timing = metrics.server_timing(response_data["diagnostics"]["timings_ms"])
+            return JSONResponse(content=response_data, headers={"Server-Timing": timing})
         return response_data # <-- Return the whole dictionary
+    except concurrency.ChatCapacityError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except concurrency.ClientDisconnectedError:
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- Streaming Chat Endpoint (Server-Sent Events) ---
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_events(question: str, user_id: str, session_id: str):
+    # Starlette cancels this generator when the client disconnects; the chat
+    # slot and any in-flight stages are released through the normal unwinding.
+    try:
+        async with concurrency.chat_slot():
+            async for event, data in rag.astream_rag_response(
+                question=question,
+                user_id=user_id,
+                chat_session_id=session_id
+            ):
+                if event == "token":
+                    yield _sse("token", {"text": data})
+                else:
+                    yield _sse(event, data)
+    except Exception as e:
+        yield _sse("error", {"detail": str(e)})
+
+@chat_router.post("/stream_response")
+async def stream_chat_response(request: ChatRequest):
+    """
+    Streams the answer as Server-Sent Events: `token` events while the model
+    generates, an optional `reset` if the answer is replaced by the fallback,
+    and a final `done` event carrying the full answer and the `image_url`.
+    """
+    user_id = await _require_user_id(request.username)
+
+    return StreamingResponse(
+        _stream_events(request.question, user_id, request.session_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )